@@ -0,0 +1,156 @@
+"""Recall vs. latency of the approximate FAISS indexes against the exact one.
+
+The corpus is the vectors of ``data/index.faiss``, grown to each ``--sizes``
+entry with noisy copies of them (renormalised, so the neighbourhoods look like
+real chunks rather than uniform noise). Ground truth is the exact flat search.
+For every index kind and every ``nprobe`` / ``efSearch`` value it reports build
+time, index size, per-query latency (one query at a time, as the app searches)
+and recall@k:
+
+    python -m benchmarks.ann_recall --sizes 20000 100000 --kinds flat sq8 hnsw ivfsq8 ivfpq
+
+Queries are noisy copies of corpus vectors unless ``--queries`` names a stored
+query set (an ``.npy`` matrix of query embeddings, e.g. written earlier with
+``--save-queries``), so the same queries can be replayed against every build.
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from src.store_comps.ann import (
+    FAISS_HNSW_M,
+    FAISS_NLIST,
+    FAISS_REFINE_K_FACTOR,
+    FAISS_TRAIN_SAMPLE,
+    build_index,
+    configure_search,
+    factory_string,
+    index_bytes,
+)
+from src.store_comps.saved_index import read_faiss_index
+
+
+def load_vectors(data_dir):
+    index = read_faiss_index(data_dir)
+    return index.reconstruct_n(0, index.ntotal), index.metric_type
+
+
+def _normalize(matrix):
+    return (matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)).astype(np.float32)
+
+
+def noisy_copies(base, count, noise, rng):
+    rows = rng.integers(0, len(base), count)
+    scale = noise * np.linalg.norm(base, axis=1).mean() / np.sqrt(base.shape[1])
+    return _normalize(base[rows] + rng.normal(0, scale, (count, base.shape[1])))
+
+
+def grow(base, size, noise, rng):
+    """``size`` vectors: the real ones first, then noisy copies."""
+    base = _normalize(base)
+    if size <= len(base):
+        return base[:size]
+    return np.vstack([base, noisy_copies(base, size - len(base), noise, rng)])
+
+
+def search_latencies(index, queries, k):
+    """Per-query latencies in ms and the result ids, searching one query at a time."""
+    latencies = []
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids[i:i + 1] = index.search(queries[i:i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies), ids
+
+
+def recall_at_k(ids, truth):
+    return float(np.mean([len(set(found) & set(expected)) / len(expected) for found, expected in zip(ids, truth)]))
+
+
+def sweep(kind, args):
+    if kind in ("ivfsq8", "ivfpq") or kind.startswith("IVF"):
+        return [("nprobe", value) for value in args.nprobe]
+    if kind == "hnsw" or kind.startswith("HNSW"):
+        return [("efSearch", value) for value in args.ef_search]
+    return [(None, None)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20000, 100000])
+    parser.add_argument("--kinds", nargs="+", default=["flat", "sq8", "hnsw", "ivfsq8", "ivfpq"])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--nlist", type=int, default=FAISS_NLIST)
+    parser.add_argument("--hnsw-m", type=int, default=FAISS_HNSW_M)
+    parser.add_argument("--train-sample", type=int, default=FAISS_TRAIN_SAMPLE)
+    parser.add_argument("--k-factor", type=float, default=FAISS_REFINE_K_FACTOR, help="Candidates per result re-ranked by refine stages.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.5, help="Noise of the synthetic copies, relative to a vector's length.")
+    parser.add_argument("--queries", help="Stored query set (.npy) instead of synthetic queries.")
+    parser.add_argument("--save-queries", help="Write the queries used to this .npy file.")
+    parser.add_argument("--threads", type=int, default=1, help="FAISS OpenMP threads (1 matches one request per core).")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    rng = np.random.default_rng(0)
+    base, metric = load_vectors(args.data_dir)
+    dim = base.shape[1]
+    if args.queries:
+        queries = _normalize(np.load(args.queries))
+    else:
+        queries = noisy_copies(_normalize(base), args.num_queries, args.noise, rng)
+    if args.save_queries:
+        np.save(args.save_queries, queries)
+
+    results = []
+    print(f"{'size':>8} {'index':<22} {'param':<14} {'build s':>8} {'MB':>8} {'B/vec':>7} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7}")
+    for size in args.sizes:
+        corpus = grow(base, size, args.noise, rng)
+        exact = faiss.IndexFlat(dim, metric)
+        exact.add(corpus)
+        _, truth = exact.search(queries, args.k)
+
+        for kind in args.kinds:
+            factory = factory_string(kind, size, dim, args.train_sample, args.nlist, args.hnsw_m)
+            start = time.perf_counter()
+            index = build_index(corpus, factory, metric, args.train_sample)
+            build_seconds = time.perf_counter() - start
+            size_bytes = index_bytes(index)
+            for name, value in sweep(kind, args):
+                if name == "nprobe":
+                    configure_search(index, nprobe=value, k_factor=args.k_factor)
+                elif name == "efSearch":
+                    configure_search(index, ef_search=value, k_factor=args.k_factor)
+                latencies, ids = search_latencies(index, queries, args.k)
+                row = {
+                    "size": size,
+                    "index": factory,
+                    "param": f"{name}={value}" if name else "",
+                    "build_s": round(build_seconds, 2),
+                    "index_mb": round(size_bytes / 2 ** 20, 2),
+                    "bytes_per_vector": round(size_bytes / size, 1),
+                    "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                    "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+                    f"recall@{args.k}": round(recall_at_k(ids, truth), 3),
+                }
+                results.append(row)
+                print(
+                    f"{size:>8} {factory:<22} {row['param']:<14} {row['build_s']:>8} {row['index_mb']:>8} "
+                    f"{row['bytes_per_vector']:>7} {row['p50_ms']:>8} {row['p95_ms']:>8} {row[f'recall@{args.k}']:>7}"
+                )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
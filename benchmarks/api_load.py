@@ -0,0 +1,143 @@
+"""Load test for the API server: concurrent chat sessions over HTTP.
+
+Start the server with the fake models, e.g. against a local Postgres:
+
+    API_FAKE_MODELS=1 WEB_CONCURRENCY=4 uvicorn src.agent_comps.api:app --port 8000
+
+or without one (single worker, in-memory checkpoints):
+
+    API_FAKE_MODELS=1 API_CHECKPOINTER=memory uvicorn src.agent_comps.api:app --port 8000
+
+then run N sessions (one thread each, every session its own thread id and API
+key unless ``--shared-key``) against it:
+
+    python -m benchmarks.api_load --sessions 64 --turns 3 --max-p95-ms 8000 --max-error-rate 0.01
+
+Reports turn latency, time to first token, throughput and how many requests the
+admission control turned away (429 per-key limit, 503 queue full / timed out).
+Exits with status 1 when a ``--max-*`` / ``--min-*`` threshold is crossed.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import requests
+
+from benchmarks.graph_benchmark import QUESTIONS, percentile
+
+
+def run_session(args, session, results, statuses, lock):
+    thread_id = f"load-{session}-{uuid.uuid4().hex[:8]}"
+    api_key = "load-test" if args.shared_key else f"load-test-{session}"
+    http = requests.Session()
+    for turn in range(args.turns):
+        question = QUESTIONS[(session + turn) % len(QUESTIONS)]
+        start = time.perf_counter()
+        first_token = None
+        status = "ok"
+        try:
+            response = http.post(
+                f"{args.url}/v1/chat/stream",
+                json={"thread_id": thread_id, "message": question},
+                headers={"X-API-Key": api_key},
+                stream=True,
+                timeout=args.timeout,
+            )
+            if response.status_code != 200:
+                status = str(response.status_code)
+                response.close()
+            else:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)["event"]
+                    if event == "token" and first_token is None:
+                        first_token = time.perf_counter() - start
+                    elif event == "error":
+                        status = "error"
+        except requests.RequestException:
+            status = "connection"
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[status] += 1
+            if status == "ok":
+                results.append({"ms": elapsed * 1000, "first_token_ms": None if first_token is None else first_token * 1000})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--sessions", type=int, default=32, help="Concurrent chat sessions.")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per session.")
+    parser.add_argument("--shared-key", action="store_true", help="Send every session with the same API key.")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--max-p50-ms", type=float)
+    parser.add_argument("--max-p95-ms", type=float)
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--max-error-rate", type=float, help="Share of turns not answered, rejections included.")
+    parser.add_argument("--min-throughput", type=float, help="Answered turns per second.")
+    args = parser.parse_args()
+
+    results = []
+    statuses = Counter()
+    lock = threading.Lock()
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=run_session, args=(args, session, results, statuses, lock))
+        for session in range(args.sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    attempted = sum(statuses.values())
+    latencies = [r["ms"] for r in results]
+    first_tokens = [r["first_token_ms"] for r in results if r["first_token_ms"] is not None]
+    summary = {
+        "sessions": args.sessions,
+        "turns": attempted,
+        "answered": len(results),
+        "wall_s": round(wall, 3),
+        "throughput_turns_per_s": round(len(results) / wall, 3) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "first_token_p50_ms": round(percentile(first_tokens, 50), 1),
+        "first_token_p95_ms": round(percentile(first_tokens, 95), 1),
+        "error_rate": round(1 - len(results) / attempted, 4) if attempted else 0.0,
+        "statuses": dict(statuses),
+    }
+    for name, value in summary.items():
+        print(f"{name:<26}: {value}")
+
+    checks = [
+        ("p50_ms", args.max_p50_ms, lambda value, limit: value <= limit),
+        ("p95_ms", args.max_p95_ms, lambda value, limit: value <= limit),
+        ("p99_ms", args.max_p99_ms, lambda value, limit: value <= limit),
+        ("error_rate", args.max_error_rate, lambda value, limit: value <= limit),
+        ("throughput_turns_per_s", args.min_throughput, lambda value, limit: value >= limit),
+    ]
+    failures = [
+        f"{name} = {summary[name]} (limit {limit})"
+        for name, limit, ok in checks
+        if limit is not None and not ok(summary[name], limit)
+    ]
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({**summary, "failures": failures}, f, indent=2)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
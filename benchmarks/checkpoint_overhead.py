@@ -0,0 +1,142 @@
+"""Per-turn checkpoint overhead: connect-per-turn vs a shared, set-up-once checkpointer.
+
+Runs a trivial one-node graph so the numbers are pure checkpointing cost. The
+Postgres "shared" run is the API server's ``AsyncCheckpointBackend`` (its pool
+settings, statement timeout and per-turn pruning) driven with ``ainvoke``.
+
+    python -m benchmarks.checkpoint_overhead --backend sqlite
+    python -m benchmarks.checkpoint_overhead --backend postgres   # uses DB_* from .env
+"""
+import argparse
+import asyncio
+import operator
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+from langgraph.graph import StateGraph, START, END
+from typing_extensions import TypedDict, Annotated
+
+
+class TurnState(TypedDict):
+    messages: Annotated[list, operator.add]
+
+
+def build_workflow():
+    workflow = StateGraph(TurnState)
+    workflow.add_node("echo", lambda state: {"messages": ["ok"]})
+    workflow.add_edge(START, "echo")
+    workflow.add_edge("echo", END)
+    return workflow
+
+
+@contextmanager
+def sqlite_per_turn(path):
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    with sqlite3.connect(path, check_same_thread=False) as conn:
+        checkpointer = SqliteSaver(conn)
+        checkpointer.setup()
+        yield checkpointer
+
+
+def sqlite_shared(path):
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    checkpointer = SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+    checkpointer.setup()
+    return checkpointer
+
+
+async def run_postgres_per_turn(workflow, turns, uri):
+    from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+    from psycopg import AsyncConnection
+    from psycopg.rows import dict_row
+
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    timings = []
+    for i in range(turns):
+        start = time.perf_counter()
+        async with await AsyncConnection.connect(uri, autocommit=True, prepare_threshold=0, row_factory=dict_row) as conn:
+            checkpointer = AsyncPostgresSaver(conn)
+            await checkpointer.setup()
+            app = workflow.compile(checkpointer=checkpointer)
+            await app.ainvoke({"messages": [f"turn {i}"]}, config=config)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def run_postgres_shared(workflow, turns, uri):
+    from src.agent_comps.checkpoint import AsyncCheckpointBackend
+
+    backend = await AsyncCheckpointBackend(uri).open()
+    thread_id = str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    app = workflow.compile(checkpointer=backend.saver)
+    timings = []
+    try:
+        for i in range(turns):
+            start = time.perf_counter()
+            await app.ainvoke({"messages": [f"turn {i}"]}, config=config)
+            await backend.prune(thread_id)
+            timings.append(time.perf_counter() - start)
+    finally:
+        await backend.close()
+    return timings
+
+
+def run_per_turn(workflow, turns, open_checkpointer):
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    timings = []
+    for i in range(turns):
+        start = time.perf_counter()
+        with open_checkpointer() as checkpointer:
+            app = workflow.compile(checkpointer=checkpointer)
+            app.invoke({"messages": [f"turn {i}"]}, config=config)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_shared(workflow, turns, checkpointer):
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    app = workflow.compile(checkpointer=checkpointer)
+    timings = []
+    for i in range(turns):
+        start = time.perf_counter()
+        app.invoke({"messages": [f"turn {i}"]}, config=config)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p95 = timings[int(0.95 * (len(timings) - 1))]
+    print(f"{name:<16} mean {statistics.mean(timings) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["sqlite", "postgres"], default="sqlite")
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+
+    workflow = build_workflow()
+
+    if args.backend == "sqlite":
+        path = os.path.join(tempfile.mkdtemp(), "checkpoints.sqlite")
+        report("per-turn setup", run_per_turn(workflow, args.turns, lambda: sqlite_per_turn(path)))
+        report("shared/pooled", run_shared(workflow, args.turns, sqlite_shared(path)))
+    else:
+        from src.agent_comps.checkpoint import checkpoint_db_uri
+
+        uri = checkpoint_db_uri()
+        report("per-turn setup", asyncio.run(run_postgres_per_turn(workflow, args.turns, uri)))
+        report("shared/pooled", asyncio.run(run_postgres_shared(workflow, args.turns, uri)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Index build time: one opaque FAISS.from_documents call vs. the batched embedding stage.
+
+Uses deterministic fake embeddings with a simulated per-request latency, so it
+runs offline and every configuration produces the same vectors.
+
+    python -m benchmarks.embedding_stage --chunks 800 --latency 0.3 --in-flight 1 4 8
+"""
+import argparse
+import random
+import time
+
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+
+from src.agent_comps.fakes import FakeEmbeddings
+from src.ingestion_comps.embedding import EMBED_BATCH_TOKENS, EmbeddingStage, count_tokens
+
+
+def make_chunks(count, seed=0):
+    rng = random.Random(seed)
+    words = "fresco tempera chiaroscuro perspective baroque renaissance sculpture portrait mosaic".split()
+    return [
+        Document(page_content=" ".join(rng.choice(words) for _ in range(rng.randint(150, 300))), metadata={"source": f"chunk-{i}"})
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=800)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds per embedding request.")
+    parser.add_argument("--per-text-latency", type=float, default=0.002, help="Extra seconds per text in a request.")
+    parser.add_argument("--batch-tokens", type=int, default=EMBED_BATCH_TOKENS)
+    parser.add_argument("--in-flight", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument(
+        "--approx-tokens",
+        action="store_true",
+        help="Estimate tokens as len(text) / 4 instead of tiktoken (no encoding download).",
+    )
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks)
+    length_function = (lambda text: len(text) // 4) if args.approx_tokens else count_tokens
+
+    embeddings = FakeEmbeddings(latency=args.latency, per_text_latency=args.per_text_latency)
+    start = time.perf_counter()
+    FAISS.from_documents(chunks, embeddings)
+    print(f"from_documents      : {time.perf_counter() - start:6.2f} s   {embeddings.calls} requests")
+
+    for in_flight in args.in_flight:
+        embeddings = FakeEmbeddings(latency=args.latency, per_text_latency=args.per_text_latency)
+        stage = EmbeddingStage(
+            embeddings, max_tokens=args.batch_tokens, max_in_flight=in_flight, length_function=length_function
+        )
+        start = time.perf_counter()
+        first_batch = None
+        db = None
+        for positions, vectors in stage.run(chunks):
+            texts = [chunks[i].page_content for i in positions]
+            if db is None:
+                db = FAISS.from_embeddings(zip(texts, vectors), embeddings)
+                first_batch = time.perf_counter() - start
+            else:
+                db.add_embeddings(zip(texts, vectors))
+        elapsed = time.perf_counter() - start
+        print(
+            f"stage in-flight {in_flight:>3}: {elapsed:6.2f} s   {embeddings.calls} requests   "
+            f"first vectors after {first_batch:.2f} s   {db.index.ntotal} indexed"
+        )
+
+
+if __name__ == "__main__":
+    main()
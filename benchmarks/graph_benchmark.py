@@ -0,0 +1,244 @@
+"""End-to-end latency of the compiled RAG graph under concurrent chat sessions.
+
+Builds the real workflow from ``Agent.create_agent()`` over the real
+``data/index.faiss``, with the Gemini chat model, embeddings and Wikipedia
+replaced by deterministic fakes that sleep for a configurable latency. Each
+simulated session runs its turns one after another on its own thread id; all
+sessions share one compiled graph and one in-memory checkpointer, like the app.
+
+Exits with status 1 when a ``--max-*`` / ``--min-*`` threshold is crossed, so it
+can gate CI:
+
+    python -m benchmarks.graph_benchmark --sessions 8 --turns 3 --max-p95-ms 4000 --max-llm-calls-per-turn 6
+"""
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+from langgraph.checkpoint.memory import MemorySaver
+
+from src.agent_comps.agent import Agent
+from src.agent_comps.fakes import FakeChatModel, FakeEmbeddings, FakeWikipedia
+from src.agent_comps import prerouter
+from src.agent_comps.history import HISTORY_TOKEN_BUDGET, ConversationHistory, approx_tokens, count_tokens
+from src.agent_comps.streaming import astream_turn, stream_turn
+from src.agent_comps.wiki import WIKI_TIMEOUT, WikiLookup
+
+QUESTIONS = [
+    "Who painted the ceiling of the Sistine Chapel?",
+    "What is chiaroscuro and which Baroque painters used it?",
+    "How did linear perspective change Renaissance painting?",
+    "What were Byzantine mosaics made of?",
+    "Why were Egyptian figures shown in profile?",
+    "What is the difference between fresco and tempera?",
+    "Who commissioned the Arena Chapel frescoes?",
+    "What does contrapposto mean in Greek sculpture?",
+    "How were Gothic cathedrals lit?",
+    "What subjects did Dutch Golden Age painters prefer?",
+    "Why is the Ishtar Gate blue?",
+    "What is the Ghent Altarpiece?",
+]
+SMALL_TALK = ["Hi there!", "Thanks, that helps.", "How are you?", "Great, thank you!"]
+
+
+def question_for(session, turn, small_talk_every=0):
+    if small_talk_every and (turn + 1) % small_talk_every == 0:
+        return SMALL_TALK[(session + turn) % len(SMALL_TALK)]
+    return QUESTIONS[(session + turn) % len(QUESTIONS)]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def record(results, lock, start, first_token, final):
+    elapsed = time.perf_counter() - start
+    with lock:
+        results.append({
+            "ms": elapsed * 1000,
+            "first_token_ms": None if first_token is None else first_token * 1000,
+            "source": (final or {}).get("source"),
+            "retrieve_loops": (final or {}).get("route_to_retrieve", 0),
+            "wiki_loops": (final or {}).get("route_to_wiki", 0),
+        })
+
+
+def run_session(app, agent, session, turns, results, lock, small_talk_every=0):
+    config = {"configurable": {"thread_id": f"bench-{session}"}}
+    for turn in range(turns):
+        question = question_for(session, turn, small_talk_every)
+        start = time.perf_counter()
+        first_token = None
+        final = None
+        for event, payload in stream_turn(app, {"original_query": question}, config):
+            if event == "token" and first_token is None:
+                first_token = time.perf_counter() - start
+            elif event == "final":
+                final = payload
+        record(results, lock, start, first_token, final)
+        # After the answer, like the API: not part of the turn's latency.
+        agent.compact_history(app, config)
+
+
+async def arun_session(app, agent, session, turns, results, lock, small_talk_every=0):
+    config = {"configurable": {"thread_id": f"bench-{session}"}}
+    for turn in range(turns):
+        question = question_for(session, turn, small_talk_every)
+        start = time.perf_counter()
+        first_token = None
+        final = None
+        async for event, payload in astream_turn(app, {"original_query": question}, config):
+            if event == "token" and first_token is None:
+                first_token = time.perf_counter() - start
+            elif event == "final":
+                final = payload
+        record(results, lock, start, first_token, final)
+        await agent.acompact_history(app, config)
+
+
+async def arun_sessions(app, agent, sessions, turns, results, lock, small_talk_every=0):
+    await asyncio.gather(
+        *(arun_session(app, agent, session, turns, results, lock, small_talk_every) for session in range(sessions))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent chat sessions.")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per session.")
+    parser.add_argument("--data-path", default="./data")
+    parser.add_argument("--grading-mode", default="single_call", choices=["single_call", "concurrent", "sequential", "rerank"])
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="Seconds per chat model request.")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds per streamed answer word.")
+    parser.add_argument("--embedding-latency", type=float, default=0.1, help="Seconds per embedding request.")
+    parser.add_argument("--wiki-latency", type=float, default=0.5, help="Seconds per Wikipedia lookup.")
+    parser.add_argument("--wiki-timeout", type=float, default=WIKI_TIMEOUT, help="Hard timeout of a Wikipedia lookup.")
+    parser.add_argument("--no-wiki-cache", action="store_true", help="Send every Wikipedia fallback to the (fake) API.")
+    parser.add_argument("--document-relevance", type=float, default=0.6, help="Share of documents graded relevant.")
+    parser.add_argument("--answer-acceptance", type=float, default=0.8, help="Share of answers graded useful.")
+    parser.add_argument("--route", default="RAG", choices=["RAG", "LLM", "Irrelevant"])
+    parser.add_argument("--semantic-cache", action="store_true", help="Keep the semantic answer cache enabled.")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Run all sessions on one event loop with astream.")
+    parser.add_argument("--parallel-routing", action="store_true", help="Route and construct the query in parallel branches.")
+    parser.add_argument("--small-talk-every", type=int, default=0, help="Make every Nth turn a greeting / thanks.")
+    parser.add_argument("--no-prerouter", action="store_true", help="Send every routing decision to the LLM.")
+    parser.add_argument("--prerouter-embeddings", action="store_true", help="Also pre-route by embedding centroids.")
+    parser.add_argument("--speculative-wiki", action="store_true", help="Start the Wikipedia lookup next to retrieval.")
+    parser.add_argument("--multi-query", action="store_true", help="Replace the rewrite/retry loop by one multi-query search.")
+    parser.add_argument("--history-budget", type=int, default=HISTORY_TOKEN_BUDGET, help="Token budget of the message history.")
+    parser.add_argument(
+        "--approx-tokens",
+        action="store_true",
+        help="Estimate history tokens as len(text) / 4 instead of tiktoken (no encoding download).",
+    )
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--max-p50-ms", type=float)
+    parser.add_argument("--max-p95-ms", type=float)
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--max-llm-calls-per-turn", type=float)
+    parser.add_argument("--min-throughput", type=float, help="Turns per second.")
+    args = parser.parse_args()
+
+    chat_model = FakeChatModel(
+        latency=args.llm_latency,
+        token_latency=args.token_latency,
+        route=args.route,
+        document_relevance=args.document_relevance,
+        answer_acceptance=args.answer_acceptance,
+    )
+    embeddings = FakeEmbeddings(latency=args.embedding_latency)
+    wikipedia = FakeWikipedia(latency=args.wiki_latency)
+    wiki_lookup = WikiLookup(wikipedia, timeout=args.wiki_timeout, cache_size=0 if args.no_wiki_cache else 1024)
+    agent = Agent(
+        "fake-chat",
+        "offline",
+        data_path=args.data_path,
+        grading_mode=args.grading_mode,
+        chat_model=chat_model,
+        embeddings=embeddings,
+        wikipedia_tool=wiki_lookup,
+        speculative_wiki=args.speculative_wiki,
+        prerouting=not args.no_prerouter,
+        prerouting_embeddings=args.prerouter_embeddings,
+        multi_query=args.multi_query,
+        history=ConversationHistory(
+            budget=args.history_budget, length_function=approx_tokens if args.approx_tokens else count_tokens
+        ),
+    )
+    if not args.semantic_cache:
+        # Sessions repeat questions, which would otherwise be answered from the cache.
+        agent.semantic_cache = None
+    app = agent.create_agent(parallel_routing=args.parallel_routing).compile(checkpointer=MemorySaver())
+
+    results = []
+    lock = threading.Lock()
+    start = time.perf_counter()
+    if args.use_async:
+        asyncio.run(arun_sessions(app, agent, args.sessions, args.turns, results, lock, args.small_talk_every))
+    else:
+        threads = [
+            threading.Thread(target=run_session, args=(app, agent, session, args.turns, results, lock, args.small_talk_every))
+            for session in range(args.sessions)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall = time.perf_counter() - start
+
+    turns = len(results)
+    latencies = [r["ms"] for r in results]
+    first_tokens = [r["first_token_ms"] for r in results if r["first_token_ms"] is not None]
+    summary = {
+        "mode": "async" if args.use_async else "threads",
+        "sessions": args.sessions,
+        "turns": turns,
+        "wall_s": round(wall, 3),
+        "throughput_turns_per_s": round(turns / wall, 3) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "first_token_p50_ms": round(percentile(first_tokens, 50), 1),
+        "first_token_p95_ms": round(percentile(first_tokens, 95), 1),
+        "llm_calls_per_turn": round(chat_model.calls / turns, 2) if turns else 0.0,
+        "prerouted_share": round(sum(c for (m, _), c in prerouter.decisions.items() if m != "llm") / turns, 3) if turns else 0.0,
+        "max_prompt_words": chat_model.max_prompt_words,
+        "embedding_calls_per_turn": round(embeddings.calls / turns, 2) if turns else 0.0,
+        "wiki_calls_per_turn": round(wikipedia.calls / turns, 2) if turns else 0.0,
+        "wiki_cache_hits": wiki_lookup.stats["cache_hits"],
+        "wiki_page_cache_hits": wiki_lookup.stats["page_cache_hits"],
+        "wiki_timeouts": wiki_lookup.stats["timeouts"],
+        "retrieve_loops_per_turn": round(sum(r["retrieve_loops"] for r in results) / turns, 2) if turns else 0.0,
+        "wiki_loops_per_turn": round(sum(r["wiki_loops"] for r in results) / turns, 2) if turns else 0.0,
+    }
+    for name, value in summary.items():
+        print(f"{name:<26}: {value}")
+
+    checks = [
+        ("p50_ms", args.max_p50_ms, lambda value, limit: value <= limit),
+        ("p95_ms", args.max_p95_ms, lambda value, limit: value <= limit),
+        ("p99_ms", args.max_p99_ms, lambda value, limit: value <= limit),
+        ("llm_calls_per_turn", args.max_llm_calls_per_turn, lambda value, limit: value <= limit),
+        ("throughput_turns_per_s", args.min_throughput, lambda value, limit: value >= limit),
+    ]
+    failures = [
+        f"{name} = {summary[name]} (limit {limit})"
+        for name, limit, ok in checks
+        if limit is not None and not ok(summary[name], limit)
+    ]
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({**summary, "failures": failures}, f, indent=2)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Chapter fetch time vs. concurrency against the local pressbook stand-in.
+
+Every response is delayed by ``--latency`` seconds, so a sequential crawl takes
+roughly chapters * latency while the concurrent fetcher should divide that by
+the concurrency.
+
+    python -m benchmarks.ingestion_fetch --chapters 60 --latency 0.2
+"""
+import argparse
+import time
+
+from benchmarks.pressbook_server import serve
+from src.ingestion_comps.fetch import collect_links, fetch_pages
+from src.ingestion_comps.manifest import Manifest
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chapters", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    server, url = serve(latency=args.latency, chapters=args.chapters)
+    links = collect_links(url)
+    empty_manifest = Manifest("/nonexistent/manifest.json")
+
+    print(f"{len(links)} chapters, {args.latency * 1000:.0f} ms per response")
+    for concurrency in args.concurrency:
+        start = time.perf_counter()
+        pages = 0
+        chars = 0
+        for result in fetch_pages(links, empty_manifest, concurrency=concurrency):
+            pages += 1
+            chars += len(result.document.page_content)
+        elapsed = time.perf_counter() - start
+        print(f"concurrency {concurrency:>3}: {elapsed:6.2f} s   {pages / elapsed:7.1f} pages/s   {chars} chars")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
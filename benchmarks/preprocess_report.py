@@ -0,0 +1,141 @@
+"""Index size and retrieval hit rate with and without ingestion preprocessing.
+
+Rebuilds the chapters from the chunks in ``data/store`` and indexes them twice:
+as plain 400-token chunks (the old pipeline) and through ``Preprocessor``
+(boilerplate stripping, near-duplicate removal, parent-child chunks). Probe
+questions come from the glossary lines of the book ("chiaroscuro: An artistic
+technique ..."): a probe is a hit when a passage handed to generation contains
+the start of the definition. Retrieval is BM25, the offline half of the hybrid
+retriever, so no embeddings are needed:
+
+    python -m benchmarks.preprocess_report --approx-tokens
+"""
+import argparse
+import json
+import os
+import re
+import tempfile
+from collections import defaultdict
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from src.ingestion_comps.embedding import count_tokens
+from src.ingestion_comps.preprocess import CHILD_CHUNK_TOKENS, PARENT_CHUNK_TOKENS, Preprocessor
+from src.store_comps.bm25 import BM25Index, write_bm25
+from src.store_comps.hybrid import RETRIEVAL_K
+from src.store_comps.mmap_store import STORE_DIRNAME, MmapVectorStore
+from src.store_comps.parents import PARENT_RETRIEVAL_K, expand_to_parents
+
+GLOSSARY_LINE = re.compile(r"^([A-Za-z][ \w\-’'()]{1,40}): (.{30,})$", re.MULTILINE)
+
+
+def load_pages(data_dir):
+    store = MmapVectorStore(os.path.join(data_dir, STORE_DIRNAME))
+    chunks = defaultdict(list)
+    for row in range(len(store)):
+        doc = store.document(row)
+        chunks[doc.metadata["source"]].append(doc.page_content)
+    return [Document(page_content="\n".join(texts), metadata={"source": url}) for url, texts in chunks.items()]
+
+
+def _normalize(text):
+    return " ".join(text.lower().split())
+
+
+def probes(pages):
+    found = {}
+    for page in pages:
+        for term, definition in GLOSSARY_LINE.findall(page.page_content):
+            found.setdefault(term.strip().lower(), _normalize(" ".join(definition.split()[:8])))
+    return [(f"What is {term}?", expected) for term, expected in sorted(found.items())]
+
+
+class Variant:
+
+    def __init__(self, name, children, parents, length_function, dim):
+        self.name = name
+        self.children = children
+        self.parents = {parent.id: parent for parent in parents}
+        self.length_function = length_function
+        self.dim = dim
+        directory = tempfile.mkdtemp(prefix=f"bm25-{name}-")
+        write_bm25(children, directory)
+        self.bm25 = BM25Index(directory)
+
+    def retrieve(self, query):
+        children = [self.children[row] for row, _ in self.bm25.search(query, RETRIEVAL_K)]
+        if not self.parents:
+            return children
+        return expand_to_parents(children, self.parents, PARENT_RETRIEVAL_K)
+
+    def report(self, questions):
+        hits = 0
+        context_tokens = 0
+        for question, expected in questions:
+            docs = self.retrieve(question)
+            context_tokens += sum(self.length_function(doc.page_content) for doc in docs)
+            hits += any(expected in _normalize(doc.page_content) for doc in docs)
+        texts = [doc.page_content for doc in self.children]
+        return {
+            "vectors": len(self.children),
+            "parents": len(self.parents),
+            "embedded_tokens": sum(self.length_function(text) for text in texts),
+            "index_mb": round(len(self.children) * self.dim * 4 / 2 ** 20, 2),
+            "text_mb": round(sum(len(text.encode("utf-8")) for text in texts) / 2 ** 20, 2),
+            "hit_rate": round(hits / len(questions), 3) if questions else 0.0,
+            "context_tokens_per_query": round(context_tokens / len(questions), 1) if questions else 0.0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--chunk-tokens", type=int, default=400, help="Chunk size of the plain pipeline.")
+    parser.add_argument("--parent-tokens", type=int, default=PARENT_CHUNK_TOKENS)
+    parser.add_argument("--child-tokens", type=int, default=CHILD_CHUNK_TOKENS)
+    parser.add_argument(
+        "--approx-tokens",
+        action="store_true",
+        help="Estimate tokens as len(text) / 4 instead of tiktoken (no encoding download).",
+    )
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    length_function = (lambda text: len(text) // 4) if args.approx_tokens else count_tokens
+
+    def splitter(chunk_size):
+        return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=0, length_function=length_function)
+
+    pages = load_pages(args.data_dir)
+    dim = MmapVectorStore(os.path.join(args.data_dir, STORE_DIRNAME)).manifest["dim"]
+    questions = probes(pages)
+
+    plain = splitter(args.chunk_tokens).split_documents(pages)
+    preprocessor = Preprocessor(splitter(args.parent_tokens), splitter(args.child_tokens))
+    parents, children = preprocessor.process_pages(pages)
+
+    results = {
+        "pages": len(pages),
+        "probes": len(questions),
+        "before": Variant("plain", plain, [], length_function, dim).report(questions),
+        "after": Variant("preprocessed", children, parents, length_function, dim).report(questions),
+        "removed": {
+            "boilerplate_lines": preprocessor.stats["boilerplate_lines"],
+            "footer_lines": preprocessor.stats["footer_lines"],
+            "near_duplicate_chunks": preprocessor.stats["near_duplicates"],
+        },
+    }
+
+    print(f"{'':<26}{'before':>12}{'after':>12}")
+    for name in results["before"]:
+        print(f"{name:<26}{results['before'][name]:>12}{results['after'][name]:>12}")
+    print(f"pages: {results['pages']}, probes: {results['probes']}, removed: {results['removed']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Local HTTP stand-in for the pressbook site, for offline ingestion runs.
+
+Serves a table of contents with ``toc__title`` links and chapter pages with a
+``site-content`` block, honours ETag / Last-Modified conditional requests, and
+can add per-request latency. Pages come from a directory of saved pressbook HTML
+(``--pages``) or are generated.
+
+    python -m benchmarks.pressbook_server --port 8765 --chapters 40
+    python -m src.ingestion --book-url http://127.0.0.1:8765/arthistory/ --data-dir /tmp/art --fake-embeddings
+"""
+import argparse
+import hashlib
+import os
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ORIGIN = "https://boisestate.pressbooks.pub"
+WORDS = (
+    "fresco tempera chiaroscuro perspective baroque renaissance sculpture portrait altarpiece "
+    "cathedral mosaic impressionism canvas pigment patron workshop relief marble bronze gothic "
+    "tenebrism landscape still life manuscript icon facade column dome linear atmospheric"
+).split()
+NAV = '<nav class="nav">Home | Read | Contents | Search</nav>'
+FOOTER = (
+    '<div class="license">This chapter is licensed under a Creative Commons '
+    "Attribution-NonCommercial-ShareAlike 4.0 International License.</div>"
+)
+
+
+def chapter_text(index, paragraphs, revision):
+    rng = random.Random(index)
+    body = []
+    for _ in range(paragraphs):
+        body.append("<p>" + " ".join(rng.choice(WORDS) for _ in range(rng.randint(60, 140))) + ".</p>")
+    if revision:
+        body.append(f"<p>Revised edition {revision}.</p>")
+    return "\n".join(body)
+
+
+class PressbookSite:
+
+    def __init__(self, base_url, chapters=40, paragraphs=12, pages_dir=None, changed=0, revision=0):
+        self.base_url = base_url.rstrip("/")
+        self.pages = {}
+        self.modified = formatdate(time.time(), usegmt=True)
+        if pages_dir:
+            self._load_saved(pages_dir)
+        else:
+            self._generate(chapters, paragraphs, changed, revision)
+
+    def _generate(self, chapters, paragraphs, changed, revision):
+        toc = []
+        for i in range(chapters):
+            path = f"/arthistory/chapter/chapter-{i}/"
+            toc.append(f'<li class="toc__title"><a href="{self.base_url}{path}">Chapter {i}</a></li>')
+            text = chapter_text(i, paragraphs, revision if i < changed else 0)
+            self.pages[path] = (
+                f'<html lang="en"><head><title>Chapter {i}</title></head><body>{NAV}'
+                f'<div class="site-content"><h1>{i} Chapter {i}</h1>{text}\n{FOOTER}</div></body></html>'
+            )
+        self.pages["/arthistory/"] = f"<html><body><ul>{''.join(toc)}</ul></body></html>"
+
+    def _load_saved(self, pages_dir):
+        # <pages_dir>/arthistory/index.html is served at /arthistory/, links to the
+        # real site are rewritten to point here.
+        for root, _, files in os.walk(pages_dir):
+            for name in files:
+                full_path = os.path.join(root, name)
+                rel = "/" + os.path.relpath(full_path, pages_dir).replace(os.sep, "/")
+                path = rel[: -len("index.html")] if rel.endswith("index.html") else rel
+                with open(full_path, encoding="utf-8") as f:
+                    self.pages[path] = f.read().replace(ORIGIN, self.base_url)
+
+    def response(self, path, headers):
+        page = self.pages.get(path)
+        if page is None:
+            return 404, {}, b""
+        body = page.encode("utf-8")
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"ETag": etag, "Last-Modified": self.modified, "Content-Type": "text/html; charset=utf-8"}, body
+
+
+class _Server(ThreadingHTTPServer):
+    # A deep listen backlog so the stand-in is never the concurrency bottleneck.
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def serve(port=0, latency=0.0, **site_kwargs):
+    """Start the stand-in in a daemon thread; returns (server, base_url)."""
+    server = _Server(("127.0.0.1", port), BaseHTTPRequestHandler)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    site = PressbookSite(base_url, **site_kwargs)
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            status, headers, body = site.response(self.path, self.headers)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server.RequestHandlerClass = Handler
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url + "/arthistory/"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chapters", type=int, default=40)
+    parser.add_argument("--paragraphs", type=int, default=12)
+    parser.add_argument("--pages", help="Directory of saved pressbook HTML to serve instead of generated pages.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response.")
+    parser.add_argument("--changed", type=int, default=0, help="Number of chapters whose text carries --revision.")
+    parser.add_argument("--revision", type=int, default=0)
+    args = parser.parse_args()
+
+    server, url = serve(
+        args.port,
+        args.latency,
+        chapters=args.chapters,
+        paragraphs=args.paragraphs,
+        pages_dir=args.pages,
+        changed=args.changed,
+        revision=args.revision,
+    )
+    print(f"Serving {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
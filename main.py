@@ -1,26 +1,32 @@
+import json
+import os
 import streamlit as st
 import uuid
-import os
+import requests
 from dotenv import load_dotenv
-from psycopg import connect
-from langgraph.checkpoint.postgres import PostgresSaver
-from langchain_chroma import Chroma
 
-from src.agent_comps.agent import get_sources, Agent
+from src.agent_comps.streaming import NODE_LABELS
 
 load_dotenv()
 
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-CHECKPOINT_DB_URI = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-connection_kwargs = {
-    "autocommit": True,
-    "prepare_threshold": 0,
-}
+# The RAG pipeline runs in the API server (src/agent_comps/api.py); this app only renders it.
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "120"))
+
+def stream_chat(thread_id, message, model_name, api_key):
+    response = requests.post(
+        f"{API_URL}/v1/chat/stream",
+        json={"thread_id": thread_id, "message": message, "model": model_name},
+        headers={"X-API-Key": api_key},
+        stream=True,
+        timeout=API_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"API returned {response.status_code}: {response.text}")
+    for line in response.iter_lines():
+        if line:
+            event = json.loads(line)
+            yield event["event"], event["data"]
 
 def initialize_new_thread():
     return str(uuid.uuid4())
@@ -67,6 +73,18 @@ st.sidebar.text_input(
     help="Your API key to access the AI models."
 )
 
+if st.session_state.api_key:
+    with st.sidebar.expander("Rate limiter"):
+        try:
+            st.json(requests.get(
+                f"{API_URL}/v1/rate_limiter",
+                params={"model": st.session_state.model_name},
+                headers={"X-API-Key": st.session_state.api_key},
+                timeout=5,
+            ).json())
+        except requests.RequestException as e:
+            st.caption(f"API not reachable: {e}")
+
 if st.sidebar.button("Start New Chat", key="start_new_chat"):
     st.session_state.thread_id = initialize_new_thread()
     st.session_state.chat_history = []
@@ -86,37 +104,50 @@ if user_input := st.chat_input("Type your message..."):
         st.markdown(user_input)
 
     with st.chat_message("assistant"):
+        status_placeholder = st.empty()
         response_placeholder = st.empty()
         response_placeholder.markdown("Thinking...")
 
     try:
-        agent = Agent(st.session_state.model_name, st.session_state.api_key)
-        workflow = agent.create_agent()
-
-        with connect(CHECKPOINT_DB_URI, **connection_kwargs) as conn:
-            checkpointer = PostgresSaver(conn)
-            checkpointer.setup()
-
-            app = workflow.compile(checkpointer=checkpointer)
-
-            config = {"configurable": {"thread_id": st.session_state.thread_id}}
-
-            ans = app.invoke({"original_query": user_input}, config=config)
-
-            print(ans)
-            assistant_response = ans.get("generation", "Sorry, I couldn't process that.")
-
-            if ans.get('source') == 'retrieval':
-                sources = get_sources(ans)
-                source_links = "\n".join([f"- [{link}]({link})" for link in sources])
-                assistant_response += f"\n\n**Sources:**\n{source_links}"
-            elif ans.get('source') == 'wiki':
-                assistant_response += "\n\n**Source:** Wiki"
-
-            st.session_state.chat_history.append({"role": "assistant", "content": assistant_response})
-            response_placeholder.markdown(assistant_response)
+        ans = {}
+        streamed_text = ""
+        for event, payload in stream_chat(
+            st.session_state.thread_id, user_input, st.session_state.model_name, st.session_state.api_key
+        ):
+            if event == "node" and payload in NODE_LABELS:
+                status_placeholder.caption(f"{NODE_LABELS[payload]}...")
+            elif event == "token":
+                streamed_text += payload
+                response_placeholder.markdown(streamed_text + "▌")
+            elif event == "retract":
+                streamed_text = ""
+                response_placeholder.markdown("_That answer didn't hold up, looking further..._")
+            elif event == "error":
+                raise RuntimeError(payload)
+            elif event == "final":
+                ans = payload
+        if ans.get("trace"):
+            st.session_state.last_trace = ans["trace"]
+        status_placeholder.empty()
+
+        assistant_response = ans.get("generation") or "Sorry, I couldn't process that."
+
+        if ans.get('source') == 'retrieval':
+            sources = ans["sources"]
+            source_links = "\n".join([f"- [{link}]({link})" for link in sources])
+            assistant_response += f"\n\n**Sources:**\n{source_links}"
+        elif ans.get('source') == 'wiki':
+            assistant_response += "\n\n**Source:** Wiki"
+
+        st.session_state.chat_history.append({"role": "assistant", "content": assistant_response})
+        response_placeholder.markdown(assistant_response)
 
     except Exception as e:
         error_message = f"An error occurred: {e}"
         st.session_state.chat_history.append({"role": "assistant", "content": error_message})
         response_placeholder.markdown(error_message)
+
+
+if "last_trace" in st.session_state:
+    with st.sidebar.expander("Last turn"):
+        st.json(st.session_state.last_trace)
@@ -1,14 +1,17 @@
-import time
+import asyncio
+import contextvars
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from langchain.schema import Document
 
-from langchain_community.utilities import WikipediaAPIWrapper
-from langchain_community.tools import WikipediaQueryRun
-from langchain_core.prompts import ChatPromptTemplate
 from langgraph.graph.message import add_messages
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain_chroma import Chroma
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, get_buffer_string
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+from langchain_core.exceptions import OutputParserException
+from pydantic import ValidationError
 from langchain_community.vectorstores import FAISS
 from langgraph.graph import StateGraph, START, END, MessagesState
 
@@ -16,8 +19,43 @@ from typing_extensions import TypedDict, Annotated, List
 from dotenv import load_dotenv
 import os
 
-from src.agent_comps.chains import query_construction_prompt, re_write_prompt, rag_prompt, grade_prompt, answer_prompt, initial_routing
+from src.agent_comps.chains import query_construction_prompt, re_write_prompt, multi_query_prompt, rag_prompt, grade_prompt, batch_grade_prompt, answer_prompt, initial_routing, summary_prompt, direct_answer_prompt
+from src.agent_comps.history import HISTORY_SUMMARY_WORDS, ConversationHistory, remove_messages
 from src.agent_comps.output_models import *
+from src.agent_comps.prerouter import PREROUTER_EMBEDDINGS, PREROUTER_ENABLED, get_prerouter
+from src.agent_comps.rate_limiter import get_rate_limiter
+from src.agent_comps.relevance import RELEVANCE_SCORER, RelevanceGrader, audit_sample, get_scorer, log_gradings
+from src.agent_comps.semantic_cache import get_semantic_cache
+from src.agent_comps.streaming import ANSWER_STREAM_TAG
+from src.agent_comps.tracing import tracer
+from src.agent_comps.wiki import NO_RESULT, get_wiki_lookup
+from src.store_comps.embedding_cache import cached_embeddings
+from src.store_comps.bm25 import BM25_DIRNAME, BM25Index, has_bm25
+from src.store_comps.hybrid import HYBRID_RETRIEVAL_ENABLED, RETRIEVAL_K, HybridRetriever
+from src.store_comps.mmap_store import MMAP_STORE_ENABLED, STORE_DIRNAME, MmapVectorStore, has_mmap_store
+from src.store_comps.multi_query import MultiQueryRetriever
+from src.store_comps.parents import PARENTS_DIRNAME, ParentRetriever, ParentStore, has_parents
+from src.store_comps.saved_index import load_faiss
+
+# "single_call": one structured call grades every document, "concurrent": one call per
+# document run in parallel, "sequential": one call per document, one after another,
+# "rerank": a local relevance score decides, the LLM only grades borderline documents.
+GRADING_MODE = os.getenv("GRADING_MODE", "single_call")
+GRADING_CONCURRENCY = int(os.getenv("GRADING_CONCURRENCY", "5"))
+# Route the question and construct the retrieval query at the same time instead of
+# one after the other. Costs an extra LLM call on greetings / irrelevant questions.
+PARALLEL_ROUTING = os.getenv("PARALLEL_ROUTING", "0") == "1"
+# Start the Wikipedia lookup next to retrieval, so the fallback path finds it done.
+# The lookup then uses the constructed question rather than the rewritten one.
+SPECULATIVE_WIKI = os.getenv("SPECULATIVE_WIKI", "0") == "1"
+# When grading keeps nothing, search several rewrites of the question at once, locally
+# and on Wikipedia, and grade all candidates together, instead of rewriting the question
+# and then falling back to Wikipedia one step at a time.
+MULTI_QUERY = os.getenv("MULTI_QUERY", "0") == "1"
+MULTI_QUERY_COUNT = int(os.getenv("MULTI_QUERY_COUNT", "3"))
+# Rewrites also looked up on Wikipedia (the first ones); the rest are searched locally only.
+MULTI_QUERY_WIKI = int(os.getenv("MULTI_QUERY_WIKI", "1"))
+EMBEDDING_MODEL = "models/text-embedding-004"
 
 class GraphState(TypedDict):
     original_query: str
@@ -28,153 +66,554 @@ class GraphState(TypedDict):
     route_to_retrieve: int
     route_to_wiki: int
     source: str
+    cache_hit: bool
+    cache_query: str
+    sources: List[str]
+    route: str
+    wiki_prefetch: str
+    summary: str
+
+_shared_indexes = {}
+_shared_indexes_lock = threading.Lock()
+
+def _load_base_store(embeddings, path):
+    store_dir = os.path.join(path, STORE_DIRNAME)
+    if MMAP_STORE_ENABLED and has_mmap_store(store_dir):
+        print("--LOADING MMAP VECTOR STORE--")
+        return MmapVectorStore(store_dir, embeddings)
+    print("--LOADING VECTOR STORE--")
+    return load_faiss(path, embeddings)
+
+def load_vector_store(embeddings, path="./data"):
+    # The index and texts are loaded once per process; agents get their own
+    # lightweight view over them bound to their embeddings client.
+    with _shared_indexes_lock:
+        base = _shared_indexes.get(path)
+        if base is None:
+            base = _load_base_store(embeddings, path)
+            _shared_indexes[path] = base
+    if isinstance(base, MmapVectorStore):
+        return base.with_embeddings(embeddings)
+    return FAISS(
+        embedding_function=embeddings,
+        index=base.index,
+        docstore=base.docstore,
+        index_to_docstore_id=base.index_to_docstore_id,
+    )
+
+def load_bm25(path="./data"):
+    key = (path, BM25_DIRNAME)
+    with _shared_indexes_lock:
+        if key not in _shared_indexes:
+            directory = os.path.join(path, BM25_DIRNAME)
+            _shared_indexes[key] = BM25Index(directory) if has_bm25(directory) else None
+        return _shared_indexes[key]
+
+def load_parents(path="./data"):
+    key = (path, PARENTS_DIRNAME)
+    with _shared_indexes_lock:
+        if key not in _shared_indexes:
+            directory = os.path.join(path, PARENTS_DIRNAME)
+            _shared_indexes[key] = ParentStore(directory) if has_parents(directory) else None
+        return _shared_indexes[key]
+
+def _current_bm25(vector_store, path):
+    bm25 = load_bm25(path) if HYBRID_RETRIEVAL_ENABLED else None
+    if bm25 is not None and len(bm25) != vector_store.index.ntotal:
+        print("--BM25 INDEX OUT OF DATE, USING DENSE RETRIEVAL ONLY--")
+        bm25 = None
+    return bm25
+
+def build_retriever(vector_store, path="./data"):
+    bm25 = _current_bm25(vector_store, path)
+    if bm25 is None:
+        retriever = vector_store.as_retriever(search_kwargs={"k": RETRIEVAL_K})
+    else:
+        retriever = HybridRetriever(vectorstore=vector_store, bm25=bm25, k=RETRIEVAL_K)
+    # Indexes built with parent-child chunks match small children and answer from their parents.
+    parents = load_parents(path)
+    if parents is not None:
+        return ParentRetriever(retriever=retriever, parents=parents)
+    return retriever
+
+def build_multi_retriever(vector_store, path="./data"):
+    return MultiQueryRetriever(vector_store, _current_bm25(vector_store, path), load_parents(path))
+
+def clear_vector_stores():
+    with _shared_indexes_lock:
+        _shared_indexes.clear()
+
+def _normalize_grade(grade):
+    if grade is None:
+        return None
+    grade = str(grade).strip().strip(".'\"").lower()
+    return grade if grade in ("yes", "no") else None
+
+def _keep_relevant(docs, grades):
+    filtered_docs = []
+    for doc, grade in zip(docs, grades):
+        if grade == "yes":
+            print("--RELEVANT--")
+            filtered_docs.append(doc)
+        else:
+            print("--IRRELEVANT--")
+    return filtered_docs
+
+def _by_score(docs, grades, scores):
+    order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+    return [docs[i] for i in order], [grades[i] for i in order]
+
+def _batch_grades(res, docs):
+    if res is None or len(res.grades) != len(docs):
+        return None
+    grades = [_normalize_grade(score.grade) for score in res.grades]
+    if None in grades:
+        return None
+    return grades
+
+def _wiki_documents(pages):
+    texts = []
+    for page in pages:
+        if page and page != NO_RESULT and page not in texts:
+            texts.append(page)
+    return [Document(page_content=text) for text in texts]
+
+def _graded_source(docs):
+    # Multi-query candidates mix book chunks (with a source URL) and Wikipedia pages.
+    return 'retrieval' if any(doc.metadata.get('source') for doc in docs) else 'wiki'
+
+def _cache_miss(query):
+    return {"cache_hit": False, "cache_query": query, "sources": []}
+
+def _cache_result(query, entry):
+    if entry is None:
+        print("--CACHE MISS--")
+        tracer.count("semantic_cache_miss")
+        return _cache_miss(query)
+    print("--CACHE HIT--")
+    tracer.count("semantic_cache_hit")
+    return {"cache_hit": True, "cache_query": query, "generation": entry.generation, "documents": [], "sources": entry.sources, "source": entry.source}
+
+def _answer_verdict(score):
+    if score.binary_score == 'yes':
+        print("--USEFUL--")
+        return "useful"
+    print("--NOT USEFUL--")
+    return "not useful"
+
+def _is_follow_up(state):
+    return bool(state["messages"] or state.get("summary"))
 
 def get_sources(response):
+    if response.get('sources'):
+        return list(response['sources'])
     docs = response['documents']
     sources = []
     for doc in docs:
-        sources.append(doc.metadata['source'])
+        if doc.metadata.get('source'):
+            sources.append(doc.metadata['source'])
     return list(set(sources))
 
 class Agent:
 
-    def __init__(self, model_name, api_key):
+    def __init__(
+        self,
+        model_name,
+        api_key,
+        data_path="./data",
+        grading_mode=GRADING_MODE,
+        grading_concurrency=GRADING_CONCURRENCY,
+        chat_model=None,
+        embeddings=None,
+        wikipedia_tool=None,
+        speculative_wiki=SPECULATIVE_WIKI,
+        history=None,
+        prerouting=PREROUTER_ENABLED,
+        prerouting_embeddings=PREROUTER_EMBEDDINGS,
+        multi_query=MULTI_QUERY,
+        multi_query_count=MULTI_QUERY_COUNT,
+        multi_query_wiki=MULTI_QUERY_WIKI,
+    ):
+        # chat_model / embeddings / wikipedia_tool replace the Gemini and Wikipedia
+        # clients, e.g. with the offline fakes used by the benchmarks.
         print("--INITIALIZING AGENT--")
-        os.environ['GOOGLE_API_KEY'] = api_key
-        self.model = ChatGoogleGenerativeAI(
-            model=model_name,
+        self.grading_mode = grading_mode
+        self.grading_concurrency = grading_concurrency
+        self.speculative_wiki = speculative_wiki
+        self.multi_query = multi_query
+        self.multi_query_count = multi_query_count
+        self.multi_query_wiki = multi_query_wiki
+        self._wiki_prefetches = {}
+        self._prefetch_pool = None
+        self.history = history or ConversationHistory()
+        self.limiter = get_rate_limiter(model_name, api_key)
+        if chat_model is None:
+            chat_model = ChatGoogleGenerativeAI(
+                model=model_name,
+                google_api_key=api_key,
+                rate_limiter=self.limiter,
+                # 429s are retried by self.limiter with shared backoff; client retries would multiply them.
+                max_retries=0,
+                callbacks=[self.limiter.usage_callback] + ([tracer.llm_callback] if tracer.enabled else []),
+                )
+        self.model = chat_model
+        if wikipedia_tool is None:
+            # Shared by every agent in the process: one cache, one circuit breaker.
+            wikipedia_tool = get_wiki_lookup()
+        self.wikipedia_tool = wikipedia_tool
+
+        if embeddings is None:
+            embedding_model = EMBEDDING_MODEL
+            embeddings = cached_embeddings(
+                GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=api_key), EMBEDDING_MODEL
             )
-        self.wikipedia_wrapper = WikipediaAPIWrapper(top_k_results=1, doc_content_chars_max=1000)
-        self.wikipedia_tool = WikipediaQueryRun(api_wrapper = self.wikipedia_wrapper)
-        
-        self.embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
-        self.new_vector_store = FAISS.load_local(
-            "./data", self.embeddings, allow_dangerous_deserialization=True
-        )
-        self.retriever = self.new_vector_store.as_retriever(search_kwargs={"k": 5})
+        else:
+            # Keys the shared route centroids, so fakes never reuse Gemini's.
+            embedding_model = type(embeddings).__name__
+        self.embeddings = tracer.wrap_embeddings(embeddings)
+        self.new_vector_store = load_vector_store(self.embeddings, data_path)
+        self.prerouter = None
+        if prerouting:
+            self.prerouter = get_prerouter(self.embeddings, self.new_vector_store, embedding_model, prerouting_embeddings)
+        self.retriever = build_retriever(self.new_vector_store, data_path)
+        self.multi_retriever = build_multi_retriever(self.new_vector_store, data_path) if multi_query else None
+        self.relevance = None
+        if grading_mode == "rerank":
+            scorer = get_scorer(RELEVANCE_SCORER, self.embeddings, self.new_vector_store, load_bm25(data_path))
+            self.relevance = RelevanceGrader(scorer)
+        self.semantic_cache = get_semantic_cache(data_path, embedding_model)
+
+    def _construction_input(self, state):
+        construction_chain = query_construction_prompt | self.model | StrOutputParser()
+        history = self.history.render(state["messages"], state.get("summary", ""))
+        return construction_chain, {"query": state["original_query"], "history": history}
+
+    def _constructed(self, state, res):
+        print("Constructed Query: ", res)
+        return {"messages": res, "constructed_query": res, "original_query": state["original_query"], "route_to_retrieve" : 0, "route_to_wiki": 0}
 
     def construct_query(self, state):
         
         print("--QUERY CONSTRUCTION--")
         
-        construction_chain = query_construction_prompt | self.model | StrOutputParser()
-
-        query = state["original_query"]
-        messages = state["messages"]
-        res = construction_chain.invoke({"query": query, "history": messages})
-        print("Constructed Query: ", res)
-        return {"messages": res, "constructed_query": res, "original_query": query, "route_to_retrieve" : 0, "route_to_wiki": 0}
+        construction_chain, inputs = self._construction_input(state)
+        return self._constructed(state, self.limiter.invoke(construction_chain, inputs))
     
+    def cache_lookup(self, state):
+
+        query = state["constructed_query"]
+        if self.semantic_cache is None:
+            return _cache_miss(query)
+
+        print("--SEMANTIC CACHE LOOKUP--")
+        return _cache_result(query, self.semantic_cache.lookup(self.embeddings.embed_query(query)))
+
+    def decide_cache_hit(self, state):
+        return "hit" if state["cache_hit"] else "miss"
+
+    def _store_answer(self, state, sources, vector):
+        self.semantic_cache.store(state["cache_query"], vector, state["generation"], sources, state["source"])
+
+    def cache_answer(self, state):
+
+        sources = get_sources(state) if state["source"] == 'retrieval' else []
+        if self.semantic_cache is not None:
+            print("--CACHING ANSWER--")
+            self._store_answer(state, sources, self.embeddings.embed_query(state["cache_query"]))
+        return {"sources": sources}
+
+    def _retrieval_update(self, state):
+        query = state["constructed_query"]
+        print(query)
+        return query, {"constructed_query": query, "route_to_retrieve" : state["route_to_retrieve"] + 1, "source": 'retrieval'}
+
     def retrieve(self, state):
         
         print("--RETRIEVAL--")
 
-        query = state["constructed_query"]
-        route_to_retrieve = state["route_to_retrieve"] + 1
-        print(query)
+        query, update = self._retrieval_update(state)
+        if self.speculative_wiki:
+            update["wiki_prefetch"] = self._prefetch_wiki(self._submit_wiki(query))
+
+        with tracer.span("retrieval"):
+            docs = self.retriever.invoke(query)
+
+        return {"documents": docs, **update}
 
-        docs = self.retriever.invoke(query)
+    def _wiki_lookup(self, query):
+        with tracer.span("wikipedia"):
+            return self.wikipedia_tool.invoke({"query": query})
 
-        return {"documents": docs, "constructed_query": query, "route_to_retrieve" : route_to_retrieve, "source": 'retrieval'}
+    async def _awiki_lookup(self, query):
+        with tracer.span("wikipedia"):
+            return await self.wikipedia_tool.ainvoke({"query": query})
+
+    def _submit_wiki(self, query):
+        if self._prefetch_pool is None:
+            self._prefetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="wiki-prefetch")
+        return self._prefetch_pool.submit(contextvars.copy_context().run, self._wiki_lookup, query)
+
+    def _prefetch_wiki(self, pending):
+        # Keyed by a token in the state, since futures cannot be checkpointed.
+        key = uuid.uuid4().hex
+        self._wiki_prefetches[key] = pending
+        return key
+
+    def _take_wiki_prefetch(self, state):
+        pending = self._wiki_prefetches.pop(state.get("wiki_prefetch"), None)
+        if pending is not None:
+            print("--USING PREFETCHED WIKIPEDIA RESULT--")
+        return pending
+
+    def _drop_wiki_prefetch(self, state):
+        pending = self._wiki_prefetches.pop(state.get("wiki_prefetch"), None)
+        if pending is not None:
+            pending.cancel()
 
     
     def grade_docs(self, state):
         
         print("--GRADING DOCUMENTS--")
 
-        grader_model = self.model.with_structured_output(GradeDocument)
-        retrieval_grader = grade_prompt | grader_model
-
         query = state["constructed_query"]
         docs = state["documents"]
-        # print(docs)
-
-        filtered_docs = []
-
-        if len(docs) > 1:
-            for doc in docs:
-                # print(doc)
-                time.sleep(1)
-                score = retrieval_grader.invoke({"document": doc, "question": query})
-                if score.grade == "yes":
-                    print("--RELEVANT--")
-                    filtered_docs.append(doc)
-                else:
-                    print("--IRRELEVANT--")
-                continue
+
+        if not docs:
+            return {"documents": [], "constructed_query": query}
+
+        if self.grading_mode == "rerank":
+            docs, grades = self._grade_rerank(query, docs)
         else:
-            time.sleep(1)
-            score = retrieval_grader.invoke({"document": docs[0], "question": query})
-            if score.grade == "yes":
-                print("--RELEVANT--")
-                filtered_docs.append(docs[0])
-            else:
-                print("--IRRELEVANT--")
-    
-        return {"documents": filtered_docs, "constructed_query": query}
+            grades = self._grade_llm(query, docs, self.grading_mode)
+            log_gradings(query, docs, grades)
+
+        return self._graded(state, _keep_relevant(docs, grades))
+
+    def _graded(self, state, docs):
+        update = {"documents": docs, "constructed_query": state["constructed_query"]}
+        if state.get("source") == 'multi_query':
+            update["source"] = _graded_source(docs)
+        return update
+
+    def _grade_llm(self, query, docs, mode):
+        if mode == "sequential":
+            return self._grade_sequential(query, docs)
+        if mode == "single_call" and len(docs) > 1:
+            grades = self._grade_single_call(query, docs)
+            if grades is not None:
+                return grades
+            print("--MALFORMED BATCH GRADES, FALLING BACK TO PER-DOCUMENT GRADING--")
+        return self._grade_concurrent(query, docs)
+
+    def _grade_rerank(self, query, docs):
+        # Local scores settle the clear cases; only the borderline band reaches the
+        # LLM, in one batched call. Documents come back best-scored first.
+        grades, scores = self.relevance.grade(query, docs)
+        borderline = self._borderline(docs, grades)
+        if borderline:
+            subset = [docs[i] for i in borderline]
+            llm_grades = self._grade_llm(query, subset, "single_call")
+            log_gradings(query, subset, llm_grades)
+            for i, grade in zip(borderline, llm_grades):
+                grades[i] = grade
+        return _by_score(docs, grades, scores)
+
+    def _borderline(self, docs, grades):
+        borderline = [i for i, grade in enumerate(grades) if grade is None]
+        print(f"--RERANK: {len(docs) - len(borderline)} GRADED LOCALLY, {len(borderline)} BY LLM--")
+        tracer.count("grades_local", len(docs) - len(borderline))
+        tracer.count("grades_llm", len(borderline))
+        # Checked by the LLM too, so the calibration log is not limited to the borderline band.
+        audited = audit_sample(grades)
+        if audited:
+            tracer.count("grades_audit", len(audited))
+        return sorted(borderline + audited)
+
+    def _document_grader(self):
+        return grade_prompt | self.model.with_structured_output(GradeDocument)
+
+    def _grade_sequential(self, query, docs):
+        retrieval_grader = self._document_grader()
+
+        grades = []
+        for doc in docs:
+            score = self.limiter.invoke(retrieval_grader, {"document": doc, "question": query})
+            grades.append(_normalize_grade(score.grade if score else None))
+        return grades
+
+    def _batch_grade_input(self, query, docs):
+        batch_grader = batch_grade_prompt | self.model.with_structured_output(GradeDocuments)
+        numbered = "\n\n".join(
+            f"Document {i + 1}:\n{doc.page_content}" for i, doc in enumerate(docs)
+        )
+        return batch_grader, {"documents": numbered, "question": query}
+
+    def _grade_single_call(self, query, docs):
+        # One structured call for the whole batch. Returns None when the model's
+        # list does not line up with the documents so the caller can fall back.
+        batch_grader, grader_input = self._batch_grade_input(query, docs)
+        try:
+            res = self.limiter.invoke(batch_grader, grader_input)
+        except (OutputParserException, ValidationError) as e:
+            print("Batch grading failed: ", e)
+            return None
+        return _batch_grades(res, docs)
+
+    def _grade_concurrent(self, query, docs):
+        retrieval_grader = self._document_grader()
+
+        inputs = [{"document": doc, "question": query} for doc in docs]
+        results = retrieval_grader.batch(
+            inputs,
+            config={"max_concurrency": self.grading_concurrency},
+            return_exceptions=True,
+        )
+
+        grades = []
+        for grader_input, score in zip(inputs, results):
+            grade = None if isinstance(score, Exception) or score is None else _normalize_grade(score.grade)
+            if grade is None:
+                # Malformed or failed verdict: grade this document once more on its own.
+                print("--MALFORMED GRADE, RETRYING--")
+                score = self.limiter.invoke(retrieval_grader, grader_input)
+                grade = _normalize_grade(score.grade if score else None)
+            grades.append(grade)
+        return grades
+
+    def _generation_input(self, state):
+        rag_chain = (rag_prompt | self.model | StrOutputParser()).with_config(tags=[ANSWER_STREAM_TAG])
+        context = self.history.render(state["messages"], state.get("summary", ""))
+        return rag_chain, {"input": state["constructed_query"], "documents": state["documents"], "context": context}
 
     def generate(self, state):
 
         print("--GENERATION--")
     
-        rag_chain = rag_prompt | self.model | StrOutputParser()
-
-        query = state["constructed_query"]
-        docs = state["documents"]
-        messages = state["messages"]
-
-        time.sleep(1)
-        res = rag_chain.invoke({"input": query, "documents": docs, "context": state["messages"]})
+        rag_chain, inputs = self._generation_input(state)
+        res = self.limiter.invoke(rag_chain, inputs)
         print("Generated answer: ", res)
         return {"generation": res}
     
+    def _answer_grade_input(self, state):
+        answer_grader_chain = answer_prompt | self.model.with_structured_output(GradeAnswer)
+        return answer_grader_chain, {"question": state["constructed_query"], "generation": state["generation"]}
 
     def answer_grade(self, state):
 
         print("--ANSWER GRADING--")
 
-        answer_grader = self.model.with_structured_output(GradeAnswer)
-        answer_grader_chain = answer_prompt | answer_grader
-
-        query = state["constructed_query"]
-        generation = state["generation"]
-
-        time.sleep(1)
-        score = answer_grader_chain.invoke({"question": query, "generation": generation})
-        # print(score)
-        if score.binary_score == 'yes':
-            print("--USEFUL--")
-            # state["messages"] = generation
-            return "useful"
-        else:
-            print("--NOT USEFUL--")
-            return "not useful"
+        answer_grader_chain, inputs = self._answer_grade_input(state)
+        return _answer_verdict(self.limiter.invoke(answer_grader_chain, inputs))
         
     def save_messages(self, state):
         print("--SAVING MESSAGES--")
+        self._drop_wiki_prefetch(state)
         generation = state["generation"]
         new_msg = AIMessage(content = generation)
-        return {"messages": new_msg}
+        return {"messages": new_msg, "wiki_prefetch": ""}
     
-    def rewrite_query(self, state):
+    def _summary_input(self, state):
+        old = self.history.to_summarize(state["messages"])
+        return old, {"summary": state.get("summary") or "None yet.", "messages": get_buffer_string(old), "words": HISTORY_SUMMARY_WORDS}
 
-        print("--REWRITING QUERY--")
-        
+    def compact_history(self, app, config):
+        """Fold the oldest messages of a thread into its rolling summary, if they no longer fit.
+
+        Not a graph node: call it once the turn's final answer is delivered, so the
+        summary call never delays it. Writes a checkpoint as ``save_message``; returns
+        whether it summarized.
+        """
+        state = app.get_state(config).values
+        if not self.history.needs_summary(state.get("messages", [])):
+            return False
+        print("--SUMMARIZING HISTORY--")
+        old, inputs = self._summary_input(state)
+        summary = self.limiter.invoke(summary_prompt | self.model | StrOutputParser(), inputs)
+        app.update_state(config, {"summary": summary, "messages": remove_messages(old)}, as_node="save_message")
+        return True
+
+    def _rewrite_input(self, state):
         question_rewriter = re_write_prompt | self.model | StrOutputParser()
-        query = state["constructed_query"]
+        return question_rewriter, {"question": state["constructed_query"]}
 
-        res = question_rewriter.invoke({"question": query})
+    def _rewritten(self, res):
         print("Rewritten query: ", res)
         return {"constructed_query": res}
+
+    def rewrite_query(self, state):
+
+        print("--REWRITING QUERY--")
+        
+        question_rewriter, inputs = self._rewrite_input(state)
+        return self._rewritten(self.limiter.invoke(question_rewriter, inputs))
     
+    def _wiki_update(self, state, page):
+        return {"documents": [Document(page_content=page)], "constructed_query": state["constructed_query"], "route_to_wiki": state["route_to_wiki"] + 1, "source": 'wiki'}
+
     def wiki_search(self, state):
         print("--WIKIPEDIA SEARCH--")
-        query = state["constructed_query"]
-        route_to_wiki = state["route_to_wiki"] + 1
-        docs = self.wikipedia_tool.invoke({"query": query})
-        res = Document(page_content=docs)
+        pending = self._take_wiki_prefetch(state)
+        page = pending.result() if pending is not None else self._wiki_lookup(state["constructed_query"])
+        return self._wiki_update(state, page)
 
-        return {"documents": [res], "constructed_query": query, "route_to_wiki": route_to_wiki, "source": 'wiki'}
+    def _multi_query_input(self, query):
+        rewriter = multi_query_prompt | self.model.with_structured_output(MultiQuery)
+        return rewriter, {"question": query, "count": self.multi_query_count}
+
+    def _parse_rewrites(self, query, res):
+        rewrites = []
+        for rewrite in (res.queries if res is not None else []):
+            rewrite = rewrite.strip()
+            if rewrite and rewrite not in rewrites:
+                rewrites.append(rewrite)
+        return rewrites[:self.multi_query_count] or [query]
+
+    def _rewrites(self, query):
+        rewriter, rewriter_input = self._multi_query_input(query)
+        try:
+            res = self.limiter.invoke(rewriter, rewriter_input)
+        except (OutputParserException, ValidationError) as e:
+            print("Multi-query rewrite failed: ", e)
+            res = None
+        return self._parse_rewrites(query, res)
+
+    def _multi_query_update(self, state, docs, pages):
+        docs = docs + _wiki_documents(pages)
+        print(f"--{len(docs)} CANDIDATES TO GRADE--")
+        return {
+            "documents": docs,
+            "constructed_query": state["constructed_query"],
+            "route_to_retrieve": state["route_to_retrieve"] + 1,
+            "route_to_wiki": state["route_to_wiki"] + 1,
+            "source": 'multi_query',
+        }
+
+    def multi_query_search(self, state):
+        # One wide step: the first rewrites are looked up on Wikipedia while one
+        # batched search covers all of them locally; grade_docs then grades
+        # everything at once.
+        print("--MULTI-QUERY SEARCH--")
+        rewrites = self._rewrites(state["constructed_query"])
+        print("Rewritten queries: ", rewrites)
+        lookups = [self._submit_wiki(rewrite) for rewrite in rewrites[:self.multi_query_wiki]]
+        pending = self._wiki_prefetches.pop(state.get("wiki_prefetch"), None)
+        if pending is not None:
+            lookups.insert(0, pending)
+        with tracer.span("retrieval"):
+            docs = self.multi_retriever.invoke(rewrites)
+        return self._multi_query_update(state, docs, [lookup.result() for lookup in lookups])
+
+    def decide_to_widen(self, state):
+        # Multi-query mode gets one wide search after the first retrieval, then gives up.
+        if state["route_to_wiki"] < 1:
+            return "widen"
+        return "NA"
+
+    def decide_to_generate_or_widen(self, state):
+        return "generate" if state["documents"] else self.decide_to_widen(state)
+
+    def answer_grade_or_widen(self, state):
+        return "useful" if self.answer_grade(state) == "useful" else self.decide_to_widen(state)
 
     def decide_to_generate(self, state):
 
@@ -200,36 +639,42 @@ class Agent:
         else:
             return "NA"
 
-    def initial_redirection(self, state):
-        print("--INITIAL ROUTING--")
-
-        initial_router = self.model.with_structured_output(QuestionRouter)
-        initial_router_chain = initial_routing | initial_router
+    def _routing_input(self, state):
+        initial_router_chain = initial_routing | self.model.with_structured_output(QuestionRouter)
 
         messages = state["messages"]
         query = state['original_query']
-
         if len(messages) < 1:
             messages = [query]
         else:
             messages =messages[-1] + [query]
+        return initial_router_chain, {"messages": messages, 'query': query}
 
-        out = initial_router_chain.invoke({"messages": messages, 'query': query})
-        return out.route_to
+    def initial_redirection(self, state):
+        print("--INITIAL ROUTING--")
 
-    def llm(self, state):
+        if self.prerouter is not None:
+            route = self.prerouter.route(state['original_query'], follow_up=_is_follow_up(state))
+            if route is not None:
+                print("--FAST ROUTE--", route)
+                return route
 
-        print("--DIRECT GENERATION--")
+        initial_router_chain, inputs = self._routing_input(state)
+        return self.limiter.invoke(initial_router_chain, inputs).route_to
 
-        prompt_template = ChatPromptTemplate.from_template(
-            "You are a helpful RAG assistant that is a part of a system that answers questions related to Art history. Your job is to answer the casual greetings and common inquiries of users. User question: {question}"
-        )
-        # messages = state["messages"]
-        question = state['original_query']
-        prompt = prompt_template.invoke({"question": question})
-        res = self.model.invoke(prompt)
+    def _direct_input(self, state):
+        return self.model.with_config(tags=[ANSWER_STREAM_TAG]), direct_answer_prompt.invoke({"question": state['original_query']})
+
+    def _direct_answer(self, res):
         print(res)
         return {"generation": res.content}
+
+    def llm(self, state):
+
+        print("--DIRECT GENERATION--")
+
+        model, prompt = self._direct_input(state)
+        return self._direct_answer(self.limiter.invoke(model, prompt))
     
     def na(self, state):
         return {'generation': "I don't know. The input documents doesn't have information on this", "source": 'none'}
@@ -237,66 +682,356 @@ class Agent:
     def irrelevant(self, state):
         return {'generation': "The query is irrelevant to art history."}
     
-    def create_agent(self):
+    def route(self, state):
+        return {"route": self.initial_redirection(state)}
 
-        workflow = StateGraph(GraphState)
+    def speculative_construct_query(self, state):
+        # Runs next to routing, so it must not add to the history yet: dispatch
+        # does that once the question turns out to need retrieval.
+        update = self.construct_query(state)
+        del update["messages"]
+        return update
 
-        workflow.add_node("query_construction", self.construct_query)
-        workflow.add_node("retrieve", self.retrieve)
-        workflow.add_node("grade_docs", self.grade_docs)
-        workflow.add_node("generate", self.generate)
-        workflow.add_node("save_message", self.save_messages)
-        workflow.add_node("rewrite_query", self.rewrite_query)
-        workflow.add_node("wiki_search", self.wiki_search)
-        workflow.add_node("llm", self.llm)
-        workflow.add_node("na", self.na)
-        workflow.add_node("irrelevant", self.irrelevant)
+    def dispatch(self, state):
+        if state["route"] == "RAG":
+            return {"messages": state["constructed_query"]}
+        return {}
 
-        workflow.add_conditional_edges(
-            START,
-            self.initial_redirection,
-            {
-                "RAG": "query_construction",
-                "LLM": "llm",
-                "Irrelevant": "irrelevant"
-            }
-        )
+    def decide_route(self, state):
+        return state["route"]
 
-        workflow.add_edge("query_construction", "retrieve")
-        workflow.add_edge("retrieve", "grade_docs")
+    # Async variants of the nodes above, used when the graph runs with
+    # ainvoke / astream. They await the model, embeddings and Wikipedia instead
+    # of blocking a thread for the whole turn.
 
-        workflow.add_conditional_edges(
-            'grade_docs',
-            self.decide_to_generate,
-            {
-                "generate": "generate",
-                "rewrite": "rewrite_query"
-            }
-        )
+    async def aconstruct_query(self, state):
 
-        workflow.add_conditional_edges(
-            'generate',
-            self.answer_grade,
-            {
-                "useful": "save_message",
-                "not useful": "rewrite_query"
-            }
+        print("--QUERY CONSTRUCTION--")
+
+        construction_chain, inputs = self._construction_input(state)
+        return self._constructed(state, await self.limiter.ainvoke(construction_chain, inputs))
+
+    async def acache_lookup(self, state):
+
+        query = state["constructed_query"]
+        if self.semantic_cache is None:
+            return _cache_miss(query)
+
+        print("--SEMANTIC CACHE LOOKUP--")
+        return _cache_result(query, self.semantic_cache.lookup(await self.embeddings.aembed_query(query)))
+
+    async def acache_answer(self, state):
+
+        sources = get_sources(state) if state["source"] == 'retrieval' else []
+        if self.semantic_cache is not None:
+            print("--CACHING ANSWER--")
+            self._store_answer(state, sources, await self.embeddings.aembed_query(state["cache_query"]))
+        return {"sources": sources}
+
+    async def aretrieve(self, state):
+
+        print("--RETRIEVAL--")
+
+        query, update = self._retrieval_update(state)
+        if self.speculative_wiki:
+            update["wiki_prefetch"] = self._prefetch_wiki(asyncio.ensure_future(self._awiki_lookup(query)))
+
+        with tracer.span("retrieval"):
+            docs = await self.retriever.ainvoke(query)
+
+        return {"documents": docs, **update}
+
+    async def agrade_docs(self, state):
+
+        print("--GRADING DOCUMENTS--")
+
+        query = state["constructed_query"]
+        docs = state["documents"]
+
+        if not docs:
+            return {"documents": [], "constructed_query": query}
+
+        if self.grading_mode == "rerank":
+            docs, grades = await self._agrade_rerank(query, docs)
+        else:
+            grades = await self._agrade_llm(query, docs, self.grading_mode)
+            log_gradings(query, docs, grades)
+
+        return self._graded(state, _keep_relevant(docs, grades))
+
+    async def _agrade_llm(self, query, docs, mode):
+        if mode == "sequential":
+            return await self._agrade_sequential(query, docs)
+        if mode == "single_call" and len(docs) > 1:
+            grades = await self._agrade_single_call(query, docs)
+            if grades is not None:
+                return grades
+            print("--MALFORMED BATCH GRADES, FALLING BACK TO PER-DOCUMENT GRADING--")
+        return await self._agrade_concurrent(query, docs)
+
+    async def _agrade_rerank(self, query, docs):
+        # Scoring may embed Wikipedia pages or run a local model; keep it off the loop.
+        grades, scores = await asyncio.to_thread(self.relevance.grade, query, docs)
+        borderline = self._borderline(docs, grades)
+        if borderline:
+            subset = [docs[i] for i in borderline]
+            llm_grades = await self._agrade_llm(query, subset, "single_call")
+            log_gradings(query, subset, llm_grades)
+            for i, grade in zip(borderline, llm_grades):
+                grades[i] = grade
+        return _by_score(docs, grades, scores)
+
+    async def _agrade_sequential(self, query, docs):
+        retrieval_grader = self._document_grader()
+
+        grades = []
+        for doc in docs:
+            score = await self.limiter.ainvoke(retrieval_grader, {"document": doc, "question": query})
+            grades.append(_normalize_grade(score.grade if score else None))
+        return grades
+
+    async def _agrade_single_call(self, query, docs):
+        batch_grader, grader_input = self._batch_grade_input(query, docs)
+        try:
+            res = await self.limiter.ainvoke(batch_grader, grader_input)
+        except (OutputParserException, ValidationError) as e:
+            print("Batch grading failed: ", e)
+            return None
+        return _batch_grades(res, docs)
+
+    async def _agrade_concurrent(self, query, docs):
+        retrieval_grader = self._document_grader()
+
+        inputs = [{"document": doc, "question": query} for doc in docs]
+        results = await retrieval_grader.abatch(
+            inputs,
+            config={"max_concurrency": self.grading_concurrency},
+            return_exceptions=True,
         )
+
+        grades = []
+        for grader_input, score in zip(inputs, results):
+            grade = None if isinstance(score, Exception) or score is None else _normalize_grade(score.grade)
+            if grade is None:
+                print("--MALFORMED GRADE, RETRYING--")
+                score = await self.limiter.ainvoke(retrieval_grader, grader_input)
+                grade = _normalize_grade(score.grade if score else None)
+            grades.append(grade)
+        return grades
+
+    async def agenerate(self, state):
+
+        print("--GENERATION--")
+
+        rag_chain, inputs = self._generation_input(state)
+        res = await self.limiter.ainvoke(rag_chain, inputs)
+        print("Generated answer: ", res)
+        return {"generation": res}
+
+    async def aanswer_grade(self, state):
+
+        print("--ANSWER GRADING--")
+
+        answer_grader_chain, inputs = self._answer_grade_input(state)
+        return _answer_verdict(await self.limiter.ainvoke(answer_grader_chain, inputs))
+
+    async def asave_messages(self, state):
+        return self.save_messages(state)
+
+    async def acompact_history(self, app, config):
+        state = (await app.aget_state(config)).values
+        if not self.history.needs_summary(state.get("messages", [])):
+            return False
+        print("--SUMMARIZING HISTORY--")
+        old, inputs = self._summary_input(state)
+        summary = await self.limiter.ainvoke(summary_prompt | self.model | StrOutputParser(), inputs)
+        await app.aupdate_state(config, {"summary": summary, "messages": remove_messages(old)}, as_node="save_message")
+        return True
+
+    async def arewrite_query(self, state):
+
+        print("--REWRITING QUERY--")
+
+        question_rewriter, inputs = self._rewrite_input(state)
+        return self._rewritten(await self.limiter.ainvoke(question_rewriter, inputs))
+
+    async def awiki_search(self, state):
+        print("--WIKIPEDIA SEARCH--")
+        pending = self._take_wiki_prefetch(state)
+        page = await pending if pending is not None else await self._awiki_lookup(state["constructed_query"])
+        return self._wiki_update(state, page)
+
+    async def _arewrites(self, query):
+        rewriter, rewriter_input = self._multi_query_input(query)
+        try:
+            res = await self.limiter.ainvoke(rewriter, rewriter_input)
+        except (OutputParserException, ValidationError) as e:
+            print("Multi-query rewrite failed: ", e)
+            res = None
+        return self._parse_rewrites(query, res)
+
+    async def _amulti_retrieve(self, rewrites):
+        with tracer.span("retrieval"):
+            return await self.multi_retriever.ainvoke(rewrites)
+
+    async def amulti_query_search(self, state):
+        print("--MULTI-QUERY SEARCH--")
+        rewrites = await self._arewrites(state["constructed_query"])
+        print("Rewritten queries: ", rewrites)
+        lookups = [self._awiki_lookup(rewrite) for rewrite in rewrites[:self.multi_query_wiki]]
+        pending = self._wiki_prefetches.pop(state.get("wiki_prefetch"), None)
+        if pending is not None:
+            lookups.insert(0, pending)
+        docs, *pages = await asyncio.gather(self._amulti_retrieve(rewrites), *lookups)
+        return self._multi_query_update(state, docs, pages)
+
+    async def aanswer_grade_or_widen(self, state):
+        return "useful" if await self.aanswer_grade(state) == "useful" else self.decide_to_widen(state)
+
+    async def ainitial_redirection(self, state):
+        print("--INITIAL ROUTING--")
+
+        if self.prerouter is not None:
+            route = await self.prerouter.aroute(state['original_query'], follow_up=_is_follow_up(state))
+            if route is not None:
+                print("--FAST ROUTE--", route)
+                return route
+
+        initial_router_chain, inputs = self._routing_input(state)
+        return (await self.limiter.ainvoke(initial_router_chain, inputs)).route_to
+
+    async def aroute(self, state):
+        return {"route": await self.ainitial_redirection(state)}
+
+    async def aspeculative_construct_query(self, state):
+        update = await self.aconstruct_query(state)
+        del update["messages"]
+        return update
+
+    async def allm(self, state):
+
+        print("--DIRECT GENERATION--")
+
+        model, prompt = self._direct_input(state)
+        return self._direct_answer(await self.limiter.ainvoke(model, prompt))
+
+    def create_agent(self, parallel_routing=PARALLEL_ROUTING, multi_query=None):
+        """Build the workflow. Every node has a sync and an async implementation, so
+        the compiled graph serves both ``invoke``/``stream`` and ``ainvoke``/``astream``.
+
+        With ``parallel_routing`` the router and query construction run as two
+        parallel branches that join in ``dispatch``. With ``multi_query`` a failed
+        retrieval or answer goes to ``multi_query_search`` once, instead of the
+        rewrite -> retrieve -> rewrite -> Wikipedia loop.
+        """
+
+        if multi_query is None:
+            multi_query = self.multi_query
+        workflow = StateGraph(GraphState)
+
+        def node(name, func, afunc=None, kind="node"):
+            func = tracer.wrap_node(name, func, kind=kind)
+            if afunc is None:
+                return func
+            return RunnableLambda(func, afunc=tracer.wrap_node(name, afunc, kind=kind), name=name)
+
+        if parallel_routing:
+            workflow.add_node("query_construction", node("query_construction", self.speculative_construct_query, self.aspeculative_construct_query))
+        else:
+            workflow.add_node("query_construction", node("query_construction", self.construct_query, self.aconstruct_query))
+        workflow.add_node("cache_lookup", node("cache_lookup", self.cache_lookup, self.acache_lookup))
+        workflow.add_node("cache_answer", node("cache_answer", self.cache_answer, self.acache_answer))
+        workflow.add_node("retrieve", node("retrieve", self.retrieve, self.aretrieve))
+        workflow.add_node("grade_docs", node("grade_docs", self.grade_docs, self.agrade_docs))
+        workflow.add_node("generate", node("generate", self.generate, self.agenerate))
+        workflow.add_node("save_message", node("save_message", self.save_messages, self.asave_messages))
+        if multi_query:
+            workflow.add_node("multi_query_search", node("multi_query_search", self.multi_query_search, self.amulti_query_search))
+        else:
+            workflow.add_node("rewrite_query", node("rewrite_query", self.rewrite_query, self.arewrite_query))
+            workflow.add_node("wiki_search", node("wiki_search", self.wiki_search, self.awiki_search))
+        workflow.add_node("llm", node("llm", self.llm, self.allm))
+        workflow.add_node("na", node("na", self.na))
+        workflow.add_node("irrelevant", node("irrelevant", self.irrelevant))
+
+        routes = {
+            "RAG": "query_construction" if not parallel_routing else "cache_lookup",
+            "LLM": "llm",
+            "Irrelevant": "irrelevant"
+        }
+        if parallel_routing:
+            workflow.add_node("route_question", node("route_question", self.route, self.aroute))
+            workflow.add_node("dispatch", node("dispatch", self.dispatch))
+            workflow.add_edge(START, "route_question")
+            workflow.add_edge(START, "query_construction")
+            workflow.add_edge(["route_question", "query_construction"], "dispatch")
+            workflow.add_conditional_edges("dispatch", node("decide_route", self.decide_route, kind="edge"), routes)
+        else:
+            workflow.add_conditional_edges(
+                START,
+                node("initial_redirection", self.initial_redirection, self.ainitial_redirection, kind="edge"),
+                routes
+            )
+            workflow.add_edge("query_construction", "cache_lookup")
+
         workflow.add_conditional_edges(
-            'rewrite_query',
-            self.question_router,
+            'cache_lookup',
+            node("decide_cache_hit", self.decide_cache_hit, kind="edge"),
             {
-            'retrieve': 'retrieve',
-            'wiki': 'wiki_search',
-            'NA': 'na'
+                "hit": "save_message",
+                "miss": "retrieve"
             }
         )
+        workflow.add_edge("retrieve", "grade_docs")
+
+        if multi_query:
+            widen = {"widen": "multi_query_search", "NA": "na"}
+            workflow.add_conditional_edges(
+                'grade_docs',
+                node("decide_to_generate", self.decide_to_generate_or_widen, kind="edge"),
+                {"generate": "generate", **widen}
+            )
+            workflow.add_conditional_edges(
+                'generate',
+                node("answer_grade", self.answer_grade_or_widen, self.aanswer_grade_or_widen, kind="edge"),
+                {"useful": "cache_answer", **widen}
+            )
+            workflow.add_edge("multi_query_search", "grade_docs")
+        else:
+            workflow.add_conditional_edges(
+                'grade_docs',
+                node("decide_to_generate", self.decide_to_generate, kind="edge"),
+                {
+                    "generate": "generate",
+                    "rewrite": "rewrite_query"
+                }
+            )
+
+            workflow.add_conditional_edges(
+                'generate',
+                node("answer_grade", self.answer_grade, self.aanswer_grade, kind="edge"),
+                {
+                    "useful": "cache_answer",
+                    "not useful": "rewrite_query"
+                }
+            )
+            workflow.add_conditional_edges(
+                'rewrite_query',
+                node("question_router", self.question_router, kind="edge"),
+                {
+                'retrieve': 'retrieve',
+                'wiki': 'wiki_search',
+                'NA': 'na'
+                }
+            )
+            workflow.add_edge("wiki_search", "grade_docs")
 
 
+        workflow.add_edge("cache_answer", "save_message")
         workflow.add_edge("llm", "save_message")
+        # History summarization runs after the turn: see compact_history.
         workflow.add_edge("save_message", END)
         workflow.add_edge("na", "save_message")
         workflow.add_edge("irrelevant", "save_message")
-        workflow.add_edge("wiki_search", "grade_docs")
 
         return workflow
\ No newline at end of file
@@ -0,0 +1,308 @@
+"""HTTP serving layer around the compiled agent graph.
+
+Runs the async graph under an ASGI server, separate from the Streamlit front end:
+
+    WEB_CONCURRENCY=4 uvicorn src.agent_comps.api:app --port 8000
+
+Every worker process opens the same memory-mapped ``data/store`` and ``data/bm25``.
+With the default flat index the vectors, texts and BM25 postings are shared
+through the page cache; an ``sq8`` or ``hnsw`` index is loaded by each worker.
+Admission limits below apply per worker, and each worker's Gemini rate limiter
+gets ``1 / RATE_LIMIT_WORKERS`` (``WEB_CONCURRENCY``) of the quota.
+
+``POST /v1/chat/stream`` answers one turn as newline-delimited JSON events:
+``{"event": "node" | "token" | "retract" | "final" | "error", "data": ...}``.
+A ``thread_id`` names a conversation of the calling API key only: checkpoints
+are stored under the key's hash, so another key cannot read or continue it.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from langgraph.checkpoint.memory import MemorySaver
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+from src.agent_comps.agent import get_sources, load_bm25, load_parents, load_vector_store
+from src.agent_comps.checkpoint import get_async_checkpoint_backend
+from src.agent_comps.prerouter import render_metrics as prerouter_metrics
+from src.agent_comps.rate_limiter import DEFAULT_LIMITS, find_rate_limiter
+from src.agent_comps.runtime import AgentCache
+from src.agent_comps.streaming import astream_turn
+from src.agent_comps.tracing import tracer
+from src.agent_comps.wiki import WikiLookup, get_wiki_lookup, load_snapshot
+
+load_dotenv()
+
+API_DATA_PATH = os.getenv("API_DATA_PATH", "./data")
+API_DEFAULT_MODEL = os.getenv("API_DEFAULT_MODEL", "gemini-2.0-flash")
+# Chat models a client may ask for (comma separated); defaults to the rate limiter's table.
+API_MODELS = [model.strip() for model in os.getenv("API_MODELS", ",".join(DEFAULT_LIMITS)).split(",") if model.strip()]
+# Turns running at once in one worker, and how many more may wait for a slot.
+API_MAX_RUNNING = int(os.getenv("API_MAX_RUNNING", "32"))
+API_MAX_QUEUED = int(os.getenv("API_MAX_QUEUED", "64"))
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "10"))
+# Turns one API key may have running or waiting in one worker.
+API_PER_KEY_CONCURRENCY = int(os.getenv("API_PER_KEY_CONCURRENCY", "4"))
+# "postgres" or "memory" (per worker, only for load tests with one worker).
+API_CHECKPOINTER = os.getenv("API_CHECKPOINTER", "postgres")
+# Serve the offline fakes instead of Gemini / Wikipedia, for load tests.
+API_FAKE_MODELS = os.getenv("API_FAKE_MODELS", "0") == "1"
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.4"))
+FAKE_TOKEN_LATENCY = float(os.getenv("FAKE_TOKEN_LATENCY", "0.01"))
+FAKE_EMBEDDING_LATENCY = float(os.getenv("FAKE_EMBEDDING_LATENCY", "0.1"))
+FAKE_WIKI_LATENCY = float(os.getenv("FAKE_WIKI_LATENCY", "0.5"))
+
+
+class Overloaded(Exception):
+
+    def __init__(self, status, reason):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class Ticket:
+    """An admitted request; ``release`` frees its slot and may be called more than once."""
+
+    def __init__(self, admission, key):
+        self.admission = admission
+        self.key = key
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.admission._release(self.key)
+
+
+class AdmissionController:
+    """Bounds the turns one worker runs at once.
+
+    At most ``max_running`` turns run; up to ``max_queued`` more wait for a slot
+    for at most ``queue_timeout`` seconds and anything beyond that is turned away
+    with 503. One API key may have at most ``per_key`` turns running or waiting,
+    beyond that it gets 429, so a single client cannot fill the queue.
+    """
+
+    def __init__(
+        self,
+        max_running=API_MAX_RUNNING,
+        max_queued=API_MAX_QUEUED,
+        queue_timeout=API_QUEUE_TIMEOUT,
+        per_key=API_PER_KEY_CONCURRENCY,
+    ):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.per_key = per_key
+        self._slots = asyncio.Semaphore(max_running)
+        self._per_key_active = Counter()
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = Counter()
+
+    async def admit(self, key):
+        if self._per_key_active[key] >= self.per_key:
+            self.rejected["key_limit"] += 1
+            raise Overloaded(429, "Too many concurrent requests for this API key.")
+        if self._slots.locked() and self.waiting >= self.max_queued:
+            self.rejected["queue_full"] += 1
+            raise Overloaded(503, "Server busy, try again shortly.")
+
+        self._per_key_active[key] += 1
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except BaseException as e:
+            self._release_key(key)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected["queue_timeout"] += 1
+                raise Overloaded(503, "Server busy, try again shortly.") from e
+            raise
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        self.admitted += 1
+        return Ticket(self, key)
+
+    def _release_key(self, key):
+        self._per_key_active[key] -= 1
+        if self._per_key_active[key] <= 0:
+            del self._per_key_active[key]
+
+    def _release(self, key):
+        self.running -= 1
+        self._slots.release()
+        self._release_key(key)
+
+    def render(self):
+        lines = [
+            f"rag_api_running {self.running}",
+            f"rag_api_waiting {self.waiting}",
+            f"rag_api_admitted_total {self.admitted}",
+        ]
+        for reason in ("key_limit", "queue_full", "queue_timeout"):
+            lines.append(f'rag_api_rejected_total{{reason="{reason}"}} {self.rejected[reason]}')
+        return "\n".join(lines) + "\n"
+
+
+def _fake_agent_kwargs():
+    from src.agent_comps.fakes import FakeChatModel, FakeEmbeddings, FakeWikipedia
+    from src.agent_comps.history import ConversationHistory, approx_tokens
+
+    return {
+        "chat_model": FakeChatModel(latency=FAKE_LLM_LATENCY, token_latency=FAKE_TOKEN_LATENCY),
+        "embeddings": FakeEmbeddings(latency=FAKE_EMBEDDING_LATENCY),
+        "wikipedia_tool": WikiLookup(FakeWikipedia(latency=FAKE_WIKI_LATENCY), snapshot=load_snapshot()),
+        "history": ConversationHistory(length_function=approx_tokens),
+    }
+
+
+def _key_hash(api_key):
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+def _thread_id(api_key, thread_id):
+    # Scopes the client's thread id to its key, so ids cannot be used across keys.
+    return f"{_key_hash(api_key)[:16]}:{thread_id}"
+
+
+def _line(event, data=None):
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+
+def _final_payload(state, trace):
+    source = state.get("source")
+    return {
+        "generation": state.get("generation", ""),
+        "source": source,
+        "sources": get_sources(state) if source == "retrieval" else [],
+        "trace": trace.summary() if trace is not None else None,
+    }
+
+
+class ChatRequest(BaseModel):
+    thread_id: str
+    message: str
+    model: str = API_DEFAULT_MODEL
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Map the index before the first request instead of during it.
+    load_vector_store(None, API_DATA_PATH)
+    load_bm25(API_DATA_PATH)
+    load_parents(API_DATA_PATH)
+    app.state.admission = AdmissionController()
+    agent_kwargs = {"data_path": API_DATA_PATH}
+    if API_FAKE_MODELS:
+        agent_kwargs.update(_fake_agent_kwargs())
+    app.state.wiki = agent_kwargs.get("wikipedia_tool") or get_wiki_lookup()
+    agent_kwargs["wikipedia_tool"] = app.state.wiki
+    app.state.runtimes = AgentCache(agent_kwargs=agent_kwargs)
+    app.state.backend = None
+    if API_CHECKPOINTER == "postgres":
+        app.state.backend = await get_async_checkpoint_backend()
+        app.state.checkpointer = app.state.backend.saver
+    else:
+        app.state.checkpointer = MemorySaver()
+    print(f"--API WORKER {os.getpid()} READY--")
+    yield
+    if app.state.backend is not None:
+        await app.state.backend.close()
+
+
+app = FastAPI(title="Art history RAG", lifespan=lifespan)
+
+
+async def _compact(state, runtime, graph, config, thread_id):
+    # Runs after the response is sent, so summarizing never delays the answer.
+    try:
+        await runtime.agent.acompact_history(graph, config)
+        if state.backend is not None:
+            await state.backend.prune(thread_id)
+    except Exception as e:
+        print("--HISTORY SUMMARY FAILED--", e)
+
+
+async def _after_turn(ticket, pending):
+    ticket.release()
+    for step in pending:
+        await step
+
+
+async def _turn(state, chat, api_key, ticket, pending):
+    try:
+        runtime = await asyncio.to_thread(state.runtimes.get, chat.model, api_key)
+        graph = runtime.compile(state.checkpointer)
+        thread_id = _thread_id(api_key, chat.thread_id)
+        config = {"configurable": {"thread_id": thread_id}}
+        final = {}
+        with tracer.turn(thread_id) as trace:
+            async for event, payload in astream_turn(graph, {"original_query": chat.message}, config):
+                if event == "final":
+                    final = payload or {}
+                else:
+                    yield _line(event, payload)
+            if trace is not None:
+                trace.final_state = final
+        yield _line("final", _final_payload(final, trace))
+        pending.append(_compact(state, runtime, graph, config, thread_id))
+    except Exception as e:
+        print("--TURN FAILED--", e)
+        yield _line("error", str(e))
+    finally:
+        ticket.release()
+
+
+@app.post("/v1/chat/stream")
+async def chat_stream(chat: ChatRequest, request: Request, x_api_key: str = Header(default="")):
+    if not x_api_key and not API_FAKE_MODELS:
+        return JSONResponse({"detail": "Missing X-API-Key header."}, status_code=401)
+    if chat.model not in API_MODELS:
+        return JSONResponse({"detail": f"Unknown model. Choose one of: {', '.join(API_MODELS)}."}, status_code=400)
+    try:
+        ticket = await request.app.state.admission.admit(_key_hash(x_api_key))
+    except Overloaded as e:
+        return JSONResponse({"detail": e.reason}, status_code=e.status, headers={"Retry-After": "1"})
+    # The background task also runs when the client disconnects before the
+    # stream starts, in which case the generator's own cleanup never runs. It
+    # then summarizes the chat history once the whole answer is sent.
+    pending = []
+    return StreamingResponse(
+        _turn(request.app.state, chat, x_api_key, ticket, pending),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(_after_turn, ticket, pending),
+    )
+
+
+@app.get("/v1/rate_limiter")
+async def rate_limiter(model: str = API_DEFAULT_MODEL, x_api_key: str = Header(default="")):
+    # Per worker: every worker keeps its own limiter. Only looks limiters up, so
+    # probing with new keys does not create (and keep) one per key.
+    limiter = find_rate_limiter(model, x_api_key)
+    if limiter is None:
+        return JSONResponse({"detail": "No requests for this model and key in this worker yet."}, status_code=404)
+    return limiter.stats()
+
+
+@app.get("/healthz")
+async def healthz(request: Request):
+    admission = request.app.state.admission
+    return {"status": "ok", "pid": os.getpid(), "running": admission.running, "waiting": admission.waiting}
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    body = request.app.state.admission.render() + request.app.state.wiki.render() + prerouter_metrics()
+    if tracer.enabled:
+        body += tracer.metrics.render()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
@@ -35,6 +35,22 @@ grade_prompt = ChatPromptTemplate.from_messages(
 
 
 
+batch_grade_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", """
+                        You are a grader assessing relevance of several retrieved documents to a user question. \n
+                        The documents are numbered. Grade every document independently. \n
+                        If a document contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
+                        It does not need to be a stringent test. The goal is to filter out erroneous retrievals. \n
+                        Return exactly one binary score 'yes' or 'no' per document, in the same order as the documents.
+        """
+),
+        ("human", "Retrieved documents: \n\n {documents} \n\n User question: {question}"),
+    ]
+)
+
+
+
 rag_prompt = ChatPromptTemplate.from_template(
     """
     Answer the following question based only on the documents and context below.
@@ -72,6 +88,21 @@ re_write_prompt = ChatPromptTemplate.from_messages(
 )
 
 
+multi_query_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", """You a question re-writer. Nothing relevant was found for the input question, so write {count} different versions of it \n
+                        optimized for vectorstore and encyclopedia retrieval. Look at the input and reason about the underlying semantic intent / meaning, \n
+                        then vary the wording: use synonyms, name the likely artists, works, periods or techniques, and make one version broader. \n
+                        Return only the questions."""
+),
+        (
+            "human",
+            "Here is the initial question: \n\n {question} \n Formulate {count} improved questions.",
+        ),
+    ]
+)
+
+
 
 
 initial_routing = ChatPromptTemplate.from_messages(
@@ -100,3 +131,20 @@ initial_routing = ChatPromptTemplate.from_messages(
     ]
 )
 
+
+
+
+summary_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", """You maintain a running summary of a conversation between a user and an art history assistant.
+                        Extend the existing summary with the new messages. Keep the artists, artworks, periods and places discussed,
+                        and what the user wanted to know, so later questions like 'where was he born?' can be resolved.
+                        Use at most {words} words and return only the summary."""
+),
+        ("human", "Existing summary: \n\n {summary} \n\n New messages: \n\n {messages}"),
+    ]
+)
+
+direct_answer_prompt = ChatPromptTemplate.from_template(
+    "You are a helpful RAG assistant that is a part of a system that answers questions related to Art history. Your job is to answer the casual greetings and common inquiries of users. User question: {question}"
+)
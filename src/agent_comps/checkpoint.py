@@ -0,0 +1,163 @@
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from src.agent_comps.tracing import tracer
+
+load_dotenv()
+
+CHECKPOINT_POOL_MIN_SIZE = int(os.getenv("CHECKPOINT_POOL_MIN_SIZE", "1"))
+CHECKPOINT_POOL_MAX_SIZE = int(os.getenv("CHECKPOINT_POOL_MAX_SIZE", "10"))
+CHECKPOINT_POOL_TIMEOUT = float(os.getenv("CHECKPOINT_POOL_TIMEOUT", "30"))
+CHECKPOINT_STATEMENT_TIMEOUT_MS = int(os.getenv("CHECKPOINT_STATEMENT_TIMEOUT_MS", "5000"))
+# Checkpoints kept per thread after each turn; a turn writes one per graph step.
+# Only the newest is needed to continue a chat. 0 disables pruning.
+CHECKPOINTS_PER_THREAD = int(os.getenv("CHECKPOINTS_PER_THREAD", "10"))
+
+# Older checkpoints of the thread go first, then their pending writes, then the
+# channel blobs no remaining checkpoint points at (each checkpoint's
+# channel_versions names the blob version it uses per channel).
+PRUNE_CHECKPOINTS_SQL = """
+DELETE FROM checkpoints c
+USING (
+    SELECT checkpoint_ns, checkpoint_id,
+           row_number() OVER (PARTITION BY checkpoint_ns ORDER BY checkpoint_id DESC) AS position
+    FROM checkpoints
+    WHERE thread_id = %(thread_id)s
+) ranked
+WHERE c.thread_id = %(thread_id)s
+  AND c.checkpoint_ns = ranked.checkpoint_ns
+  AND c.checkpoint_id = ranked.checkpoint_id
+  AND ranked.position > %(keep)s
+"""
+
+PRUNE_WRITES_SQL = """
+DELETE FROM checkpoint_writes w
+WHERE w.thread_id = %(thread_id)s
+  AND NOT EXISTS (
+    SELECT 1 FROM checkpoints c
+    WHERE c.thread_id = w.thread_id AND c.checkpoint_ns = w.checkpoint_ns AND c.checkpoint_id = w.checkpoint_id
+  )
+"""
+
+PRUNE_BLOBS_SQL = """
+DELETE FROM checkpoint_blobs b
+WHERE b.thread_id = %(thread_id)s
+  AND NOT EXISTS (
+    SELECT 1 FROM checkpoints c
+    WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+      AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+  )
+"""
+
+PRUNE_STATEMENTS = (PRUNE_CHECKPOINTS_SQL, PRUNE_WRITES_SQL, PRUNE_BLOBS_SQL)
+
+
+def checkpoint_db_uri():
+    db_host = os.getenv("DB_HOST")
+    db_port = os.getenv("DB_PORT", "5432")
+    db_name = os.getenv("DB_NAME")
+    db_user = os.getenv("DB_USER")
+    db_password = os.getenv("DB_PASSWORD")
+    return f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+
+
+class TracedAsyncPostgresSaver(AsyncPostgresSaver):
+    """AsyncPostgresSaver that records a ``checkpoint`` span for every read and write."""
+
+    async def aget_tuple(self, config):
+        with tracer.span("checkpoint", "checkpoint_read"):
+            return await super().aget_tuple(config)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        with tracer.span("checkpoint", "checkpoint_write"):
+            return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        with tracer.span("checkpoint", "checkpoint_write"):
+            return await super().aput_writes(config, writes, task_id, task_path)
+
+
+def _connection_kwargs(statement_timeout_ms):
+    return {
+        "autocommit": True,
+        "prepare_threshold": 0,
+        "row_factory": dict_row,
+        "options": f"-c statement_timeout={statement_timeout_ms}",
+    }
+
+
+class AsyncCheckpointBackend:
+    """Owns the Postgres connection pool used by the graph checkpointer.
+
+    The schema migrations in ``AsyncPostgresSaver.setup()`` run once when the
+    backend is opened, and every compiled graph shares the same pool-backed saver
+    afterwards. The pool belongs to the event loop that opens it, so create and
+    use it from one loop (e.g. the ASGI server's).
+    """
+
+    def __init__(
+        self,
+        conninfo=None,
+        min_size=CHECKPOINT_POOL_MIN_SIZE,
+        max_size=CHECKPOINT_POOL_MAX_SIZE,
+        timeout=CHECKPOINT_POOL_TIMEOUT,
+        statement_timeout_ms=CHECKPOINT_STATEMENT_TIMEOUT_MS,
+    ):
+        self.conninfo = conninfo or checkpoint_db_uri()
+        self.pool = AsyncConnectionPool(
+            self.conninfo,
+            min_size=min_size,
+            max_size=max_size,
+            timeout=timeout,
+            check=AsyncConnectionPool.check_connection,
+            kwargs=_connection_kwargs(statement_timeout_ms),
+            open=False,
+        )
+        self.saver = (TracedAsyncPostgresSaver if tracer.enabled else AsyncPostgresSaver)(self.pool)
+
+    async def open(self):
+        print("--OPENING ASYNC CHECKPOINT POOL--")
+        await self.pool.open(wait=True)
+        await self.saver.setup()
+        return self
+
+    async def close(self):
+        await self.pool.close()
+
+    async def prune(self, thread_id, keep=CHECKPOINTS_PER_THREAD):
+        """Delete all but the newest ``keep`` checkpoints of a thread; returns the rows deleted."""
+        if keep <= 0:
+            return 0
+        params = {"thread_id": thread_id, "keep": keep}
+        deleted = 0
+        with tracer.span("checkpoint", "checkpoint_prune"):
+            async with self.pool.connection() as conn, conn.transaction():
+                for statement in PRUNE_STATEMENTS:
+                    deleted += (await conn.execute(statement, params)).rowcount
+        return deleted
+
+    def stats(self):
+        return self.pool.get_stats()
+
+
+_async_backend = None
+_async_backend_lock = None
+
+
+async def get_async_checkpoint_backend():
+    global _async_backend, _async_backend_lock
+    if _async_backend_lock is None:
+        _async_backend_lock = asyncio.Lock()
+    async with _async_backend_lock:
+        if _async_backend is None:
+            _async_backend = await AsyncCheckpointBackend().open()
+        return _async_backend
+
+
+async def get_async_checkpointer():
+    return (await get_async_checkpoint_backend()).saver
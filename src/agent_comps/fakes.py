@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import PrivateAttr
+
+from src.agent_comps.output_models import GradeAnswer, GradeDocument, GradeDocuments, MultiQuery, QuestionRouter
+
+VOCABULARY = (
+    "the painting fresco portrait artist renaissance baroque sculpture light composition "
+    "church patron figure canvas perspective gold temple mosaic style period museum"
+).split()
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic offline embeddings with a simulated per-request latency.
+
+    The same text always maps to the same vector. Like the Gemini client,
+    ``embed_documents`` sends one request per ``batch_size`` texts, one after
+    another; ``calls`` counts those requests.
+    """
+
+    def __init__(self, size=768, latency=0.0, per_text_latency=0.0, batch_size=100):
+        self.embedding = DeterministicFakeEmbedding(size=size)
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.batch_size = batch_size
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _request(self, count):
+        with self._lock:
+            self.calls += 1
+        delay = self.latency + self.per_text_latency * count
+        if delay:
+            time.sleep(delay)
+
+    def embed_documents(self, texts):
+        for start in range(0, len(texts), self.batch_size):
+            self._request(len(texts[start:start + self.batch_size]))
+        return self.embedding.embed_documents(texts)
+
+    def embed_query(self, text):
+        self._request(1)
+        return self.embedding.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        for start in range(0, len(texts), self.batch_size):
+            with self._lock:
+                self.calls += 1
+            await asyncio.sleep(self.latency + self.per_text_latency * len(texts[start:start + self.batch_size]))
+        return self.embedding.embed_documents(texts)
+
+    async def aembed_query(self, text):
+        with self._lock:
+            self.calls += 1
+        await asyncio.sleep(self.latency + self.per_text_latency)
+        return self.embedding.embed_query(text)
+
+
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def _stable(text):
+    # Message ids in formatted history are random per run; drop them so the
+    # same conversation always gets the same scripted output.
+    return _UUID.sub("", text)
+
+
+def _fraction(text):
+    # Stable value in [0, 1) for a piece of text, so scripted verdicts repeat across runs.
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16) / 2 ** 32
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic offline chat model with simulated latency and scripted verdicts.
+
+    Free-text calls return ``answer_words`` words chosen from a hash of the prompt
+    and stream them word by word. ``with_structured_output`` returns scripted
+    ``QuestionRouter`` / ``GradeDocument(s)`` / ``GradeAnswer`` / ``MultiQuery`` objects: a document
+    is graded relevant when the hash of its text falls under ``document_relevance``,
+    an answer is accepted when the hash of the grading prompt falls under
+    ``answer_acceptance``. ``calls`` counts every request, free-text or structured;
+    ``max_prompt_words`` is the longest prompt seen, in words.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer_words: int = 40
+    route: str = "RAG"
+    document_relevance: float = 1.0
+    answer_acceptance: float = 1.0
+
+    _calls: int = PrivateAttr(default=0)
+    _max_prompt_words: int = PrivateAttr(default=0)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    @property
+    def calls(self):
+        return self._calls
+
+    @property
+    def max_prompt_words(self):
+        return self._max_prompt_words
+
+    def _count(self, prompt):
+        words = len(prompt.split())
+        with self._lock:
+            self._calls += 1
+            self._max_prompt_words = max(self._max_prompt_words, words)
+
+    def _request(self, prompt):
+        self._count(prompt)
+        if self.latency:
+            time.sleep(self.latency)
+
+    async def _arequest(self, prompt):
+        self._count(prompt)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _prompt(self, messages):
+        return "\n".join(str(message.content) for message in messages)
+
+    def _words(self, messages):
+        prompt = self._prompt(messages)
+        rng = random.Random(_stable(prompt))
+        return [rng.choice(VOCABULARY) for _ in range(self.answer_words)]
+
+    def _usage(self, messages, words):
+        prompt_tokens = sum(len(str(message.content).split()) for message in messages)
+        return {"input_tokens": prompt_tokens, "output_tokens": len(words), "total_tokens": prompt_tokens + len(words)}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._request(self._prompt(messages))
+        words = self._words(messages)
+        if self.token_latency:
+            time.sleep(self.token_latency * len(words))
+        message = AIMessage(content=" ".join(words), usage_metadata=self._usage(messages, words))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await self._arequest(self._prompt(messages))
+        words = self._words(messages)
+        if self.token_latency:
+            await asyncio.sleep(self.token_latency * len(words))
+        message = AIMessage(content=" ".join(words), usage_metadata=self._usage(messages, words))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, messages, words):
+        for i, word in enumerate(words):
+            text = word if i == 0 else " " + word
+            usage = self._usage(messages, words) if i == len(words) - 1 else None
+            yield text, ChatGenerationChunk(message=AIMessageChunk(content=text, usage_metadata=usage))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self._request(self._prompt(messages))
+        for text, chunk in self._chunks(messages, self._words(messages)):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await self._arequest(self._prompt(messages))
+        for text, chunk in self._chunks(messages, self._words(messages)):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    def _grade(self, text, threshold):
+        return "yes" if _fraction(text) < threshold else "no"
+
+    def _structured(self, schema, prompt):
+        self._request(prompt.to_string())
+        return self._verdict(schema, prompt)
+
+    async def _astructured(self, schema, prompt):
+        await self._arequest(prompt.to_string())
+        return self._verdict(schema, prompt)
+
+    def _verdict(self, schema, prompt):
+        text = _stable(prompt.to_string())
+        if schema is QuestionRouter:
+            return QuestionRouter(route_to=self.route)
+        if schema is GradeAnswer:
+            return GradeAnswer(binary_score=self._grade(text, self.answer_acceptance))
+        if schema is GradeDocuments:
+            documents = re.split(r"Document \d+:\n", text)[1:]
+            return GradeDocuments(grades=[GradeDocument(grade=self._grade(doc, self.document_relevance)) for doc in documents])
+        if schema is GradeDocument:
+            return GradeDocument(grade=self._grade(text, self.document_relevance))
+        if schema is MultiQuery:
+            match = re.search(r"Formulate (\d+) improved questions", text)
+            count = int(match.group(1)) if match else 3
+            rng = random.Random(text)
+            return MultiQuery(queries=[" ".join(rng.choice(VOCABULARY) for _ in range(8)) for _ in range(count)])
+        raise ValueError(f"No scripted output for {schema.__name__}")
+
+    def with_structured_output(self, schema, **kwargs):
+        async def afunc(prompt):
+            return await self._astructured(schema, prompt)
+
+        return RunnableLambda(lambda prompt: self._structured(schema, prompt), afunc=afunc)
+
+
+class FakeWikipedia:
+    """Stands in for ``WikipediaQueryRun``: fixed-size text after a simulated latency.
+
+    ``resolve`` / ``fetch`` split the same latency between a title search and a
+    page fetch, as ``LiveWikipedia`` does for ``WikiLookup``. Queries resolve to
+    one of a few titles picked by their words, so related questions share pages.
+    """
+
+    def __init__(self, latency=0.0, words=150):
+        self.latency = latency
+        self.words = words
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _page(self, input):
+        with self._lock:
+            self.calls += 1
+        rng = random.Random(str(input))
+        return "Page: " + " ".join(rng.choice(VOCABULARY) for _ in range(self.words))
+
+    def invoke(self, input):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._page(input)
+
+    async def ainvoke(self, input):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._page(input)
+
+    def resolve(self, query, k=1):
+        if self.latency:
+            time.sleep(self.latency / 2)
+        words = sorted(set(re.findall(r"\w+", query.lower())) & set(VOCABULARY)) or ["art"]
+        return [" ".join(words[:2]).title()][:k]
+
+    def fetch(self, title):
+        if self.latency:
+            time.sleep(self.latency / 2)
+        return title, self._page(title)
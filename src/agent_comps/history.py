@@ -0,0 +1,82 @@
+"""Bounded conversation history.
+
+``GraphState.messages`` gains two messages every turn. Prompts only see the newest
+messages that fit in ``HISTORY_TOKEN_BUDGET`` tokens, plus a rolling ``summary``
+of everything older. Once the stored messages no longer fit in the budget, the
+oldest ones are folded into the summary by one LLM call and removed from the
+state with ``RemoveMessage``, so the checkpointed state stops growing as well.
+That call runs after the turn's answer is delivered (``Agent.compact_history``).
+"""
+import os
+from functools import lru_cache
+
+import tiktoken
+from langchain_core.messages import RemoveMessage, get_buffer_string
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+# Share of the budget the kept messages fit in after summarizing, so the next
+# summary is a few turns away rather than due on every turn.
+HISTORY_KEEP_RATIO = float(os.getenv("HISTORY_KEEP_RATIO", "0.5"))
+HISTORY_SUMMARY_WORDS = int(os.getenv("HISTORY_SUMMARY_WORDS", "150"))
+# Role prefix and separators per message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding():
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text):
+    return len(_encoding().encode(text))
+
+
+def approx_tokens(text):
+    # For offline runs where the tiktoken encoding can't be downloaded.
+    return len(text) // 4
+
+
+class ConversationHistory:
+    """Token-budgeted window over the message history, and the split used to summarize it."""
+
+    def __init__(self, budget=HISTORY_TOKEN_BUDGET, keep_ratio=HISTORY_KEEP_RATIO, length_function=count_tokens):
+        self.budget = budget
+        self.keep_ratio = keep_ratio
+        self.length_function = length_function
+
+    def tokens(self, message):
+        return self.length_function(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+
+    def window(self, messages, budget=None):
+        """The newest messages that fit in ``budget`` tokens (at least the newest one)."""
+        budget = self.budget if budget is None else budget
+        total = 0
+        start = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            total += self.tokens(messages[i])
+            if total > budget and start < len(messages):
+                break
+            start = i
+        return messages[start:]
+
+    def render(self, messages, summary=""):
+        """History text for a prompt: the rolling summary, then the windowed messages."""
+        parts = []
+        if summary:
+            parts.append(f"Summary of the earlier conversation: {summary}")
+        window = self.window(messages)
+        if window:
+            parts.append(get_buffer_string(window))
+        return "\n".join(parts)
+
+    def needs_summary(self, messages):
+        return sum(self.tokens(message) for message in messages) > self.budget
+
+    def to_summarize(self, messages):
+        """The oldest messages to fold into the summary, leaving ``keep_ratio`` of the budget."""
+        kept = self.window(messages, int(self.budget * self.keep_ratio))
+        return messages[:len(messages) - len(kept)]
+
+
+def remove_messages(messages):
+    return [RemoveMessage(id=message.id) for message in messages]
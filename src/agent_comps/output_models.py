@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic import BaseModel, Field
 
 class GradeAnswer(BaseModel):
@@ -14,3 +16,17 @@ class GradeDocument(BaseModel):
 
 class QuestionRouter(BaseModel):
     route_to: str = Field(desrciption="RAG or LLM or Irrelevant")
+
+class GradeDocuments(BaseModel):
+    """Relevance verdicts for a numbered list of documents, in the same order."""
+
+    grades: List[GradeDocument] = Field(
+        description="One grade per document, in the order the documents were given"
+    )
+
+class MultiQuery(BaseModel):
+    """Alternative phrasings of a question for retrieval."""
+
+    queries: List[str] = Field(
+        description="The rewritten questions, one per entry"
+    )
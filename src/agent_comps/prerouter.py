@@ -0,0 +1,345 @@
+"""Local fast path for the initial routing decision (RAG / LLM / Irrelevant).
+
+Clear cases are decided without the structured-output LLM call:
+
+- small talk: a message that is only a greeting, thanks or "who are you?" goes to
+  the LLM route;
+- embeddings (``PREROUTER_EMBEDDINGS=1``): the query is compared with one centroid
+  vector per route. The RAG centroid combines the vectors of the indexed chunks
+  with example art-history questions; the LLM and Irrelevant centroids come from
+  example queries. The best route is taken when its similarity is at least
+  ``PREROUTER_MIN_SIMILARITY`` and beats the runner-up by ``PREROUTER_MARGIN``.
+
+The embedding step is off by default: an "Irrelevant" verdict ends the turn
+without an answer, so turn it on only after checking the thresholds for the
+embedding model with
+
+    python -m src.agent_comps.prerouter --data-path data
+
+which writes the centroids to ``data/route_centroids.npz`` (otherwise they are
+computed on first use) and reports how many of the example queries the fast
+path decides, and how accurately, for a range of margins.
+
+Anything else, "Irrelevant" verdicts on follow-up messages (which often only
+make sense with the conversation, like "where was he born?") and failed
+embedding requests go to the LLM router.
+"""
+import argparse
+import os
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+from src.agent_comps.tracing import tracer
+
+PREROUTER_ENABLED = os.getenv("PREROUTER", "1") == "1"
+# Also decide by embedding similarity; needs thresholds calibrated for the embedding model.
+PREROUTER_EMBEDDINGS = os.getenv("PREROUTER_EMBEDDINGS", "0") == "1"
+PREROUTER_CENTROIDS_PATH = os.getenv("PREROUTER_CENTROIDS_PATH", "./data/route_centroids.npz")
+PREROUTER_MIN_SIMILARITY = float(os.getenv("PREROUTER_MIN_SIMILARITY", "0.5"))
+PREROUTER_MARGIN = float(os.getenv("PREROUTER_MARGIN", "0.08"))
+# Indexed chunk vectors averaged into the RAG centroid.
+CORPUS_SAMPLE = 5000
+ROUTES = ("RAG", "LLM", "Irrelevant")
+# Bumped when saved centroids stop matching the current ones (3: examples embedded in one batch).
+CENTROIDS_VERSION = 3
+
+_SMALL_TALK_PHRASE = (
+    r"(hi+|hello+|hey+|hiya|howdy|yo|greetings|good (morning|afternoon|evening|night)|"
+    r"thanks?( you)?( (so|very) much)?( for (the|your) help)?|thx|ty|cheers|much appreciated|"
+    r"bye|goodbye|see you( later)?|ok(ay)?|cool|great|nice|awesome|perfect|got it|"
+    r"(that|this)( really)? help(s|ed)|(that|this)('s| is| was)( very| really)? (helpful|great|interesting)|"
+    r"how are you( doing)?( today)?|how('s| is) it going|what'?s up|"
+    r"who are you|what are you|what can you do|what do you do|how can you help( me)?|are you a bot)"
+    r"( there| again| friend| bot)?"
+)
+# The whole message is small talk: one or more of the phrases above and punctuation.
+SMALL_TALK = re.compile(rf"^{_SMALL_TALK_PHRASE}([\s,;!.?:)-]+{_SMALL_TALK_PHRASE})*[\s,;!.?:)-]*$", re.IGNORECASE)
+
+EXAMPLES = {
+    "RAG": [
+        "Who painted the ceiling of the Sistine Chapel?",
+        "What is chiaroscuro?",
+        "How did Gothic cathedrals use flying buttresses?",
+        "What are the characteristics of Baroque painting?",
+        "Explain the difference between Impressionism and Post-Impressionism.",
+        "Why is the Parthenon important?",
+        "What materials did Egyptian sculptors use?",
+        "Tell me about Caravaggio's use of light.",
+        "What is linear perspective and who developed it?",
+        "Describe the art of the Northern Renaissance.",
+        "What was the Bauhaus?",
+        "How is a woodcut print made?",
+        "What themes did Romantic painters explore?",
+        "Who were the Abstract Expressionists?",
+        "What is a fresco?",
+        "How did photography influence painting in the 19th century?",
+    ],
+    "LLM": [
+        "Hello, how are you today?",
+        "Good morning!",
+        "Thanks, that was helpful.",
+        "Nice to meet you.",
+        "What can you help me with?",
+        "Who made you?",
+        "Can you hear me?",
+        "I appreciate the help, have a good day.",
+        "Are you there?",
+        "Hey, what's going on?",
+    ],
+    "Irrelevant": [
+        "What's the weather forecast for tomorrow?",
+        "How do I fix a Python import error?",
+        "Give me a recipe for chocolate chip cookies.",
+        "Who won the football match last night?",
+        "What is the stock price of Apple?",
+        "How do I change a car tire?",
+        "Translate this sentence into Spanish.",
+        "What is the capital of Australia?",
+        "Solve the equation 3x + 5 = 20.",
+        "Recommend a good laptop for gaming.",
+        "How many calories are in a banana?",
+        "Write me a cover letter for a software job.",
+    ],
+}
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def corpus_centroid(vectorstore, sample=CORPUS_SAMPLE):
+    """Mean direction of the indexed chunk vectors, or None if they cannot be read back."""
+    if vectorstore is None:
+        return None
+    index = vectorstore.index
+    if index.ntotal == 0:
+        return None
+    rows = np.linspace(0, index.ntotal - 1, min(sample, index.ntotal)).astype(np.int64)
+    try:
+        vectors = index.reconstruct_batch(rows)
+    except RuntimeError:
+        # Compressed indexes without a direct map cannot return their vectors.
+        return None
+    return _normalize(_normalize(vectors).mean(axis=0))
+
+
+def centroids_from_vectors(vectors, labels, corpus=None):
+    """One normalised centroid per route from labelled example vectors (plus the corpus for RAG)."""
+    vectors = _normalize(vectors)
+    labels = np.asarray(labels)
+    centroids = []
+    for route in ROUTES:
+        centroid = _normalize(vectors[labels == route].mean(axis=0))
+        if route == "RAG" and corpus is not None:
+            centroid = centroid + corpus
+        centroids.append(_normalize(centroid))
+    return np.vstack(centroids)
+
+
+def _examples(examples=EXAMPLES):
+    labels = [route for route in ROUTES for _ in examples[route]]
+    texts = [text for route in ROUTES for text in examples[route]]
+    return texts, labels
+
+
+def embed_queries(embeddings, texts):
+    """Embeddings of ``texts`` in one batched request."""
+    return np.asarray(embeddings.embed_documents(list(texts)), dtype=np.float32)
+
+
+def build_centroids(embeddings, vectorstore=None, examples=EXAMPLES):
+    texts, labels = _examples(examples)
+    return centroids_from_vectors(embed_queries(embeddings, texts), labels, corpus_centroid(vectorstore))
+
+
+def save_centroids(path, centroids, model):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.savez(path, centroids=centroids, routes=np.array(ROUTES), model=np.array(model), version=np.array(CENTROIDS_VERSION))
+
+
+def load_centroids(path, model):
+    if not os.path.exists(path):
+        return None
+    saved = np.load(path)
+    if str(saved["model"]) != model or tuple(saved["routes"]) != ROUTES:
+        print("--ROUTE CENTROIDS ARE FOR ANOTHER EMBEDDING MODEL, REBUILDING--")
+        return None
+    if "version" not in saved.files or int(saved["version"]) != CENTROIDS_VERSION:
+        print("--ROUTE CENTROIDS ARE OUTDATED, REBUILDING--")
+        return None
+    return saved["centroids"]
+
+
+class Prerouter:
+    """Decides the route locally when it is confident; ``None`` means ask the LLM.
+
+    Without centroids only small talk is decided locally.
+    """
+
+    def __init__(self, embeddings, centroids=None, min_similarity=PREROUTER_MIN_SIMILARITY, margin=PREROUTER_MARGIN):
+        self.embeddings = embeddings
+        self.centroids = None if centroids is None else _normalize(centroids)
+        self.min_similarity = min_similarity
+        self.margin = margin
+
+    @staticmethod
+    def small_talk(query):
+        return SMALL_TALK.match(query.strip()) is not None
+
+    def classify(self, vector):
+        """``(route or None, similarities)`` for a query vector."""
+        similarities = self.centroids @ _normalize(vector)
+        best, second = np.argsort(-similarities)[:2]
+        confident = similarities[best] >= self.min_similarity and similarities[best] - similarities[second] >= self.margin
+        return (ROUTES[best] if confident else None), similarities
+
+    def _decide(self, vector, follow_up):
+        route, _ = self.classify(vector)
+        if route == "Irrelevant" and follow_up:
+            route = None
+        _record("embedding" if route else "llm", route)
+        return route
+
+    def _undecided(self):
+        _record("llm", None)
+        return None
+
+    def route(self, query, follow_up=False):
+        if self.small_talk(query):
+            _record("pattern", "LLM")
+            return "LLM"
+        if self.centroids is None:
+            return self._undecided()
+        try:
+            vector = self.embeddings.embed_query(query)
+        except Exception as e:
+            print("--PREROUTER EMBEDDING FAILED, ASKING THE LLM--", e)
+            return self._undecided()
+        return self._decide(vector, follow_up)
+
+    async def aroute(self, query, follow_up=False):
+        if self.small_talk(query):
+            _record("pattern", "LLM")
+            return "LLM"
+        if self.centroids is None:
+            return self._undecided()
+        try:
+            vector = await self.embeddings.aembed_query(query)
+        except Exception as e:
+            print("--PREROUTER EMBEDDING FAILED, ASKING THE LLM--", e)
+            return self._undecided()
+        return self._decide(vector, follow_up)
+
+
+decisions = Counter()
+_decisions_lock = threading.Lock()
+
+
+def _record(method, route):
+    with _decisions_lock:
+        decisions[(method, route or "undecided")] += 1
+    tracer.count(f"preroute_{method}")
+
+
+def render_metrics():
+    with _decisions_lock:
+        counts = dict(decisions)
+    lines = [
+        f'rag_prerouter_decisions_total{{method="{method}",route="{route}"}} {count}'
+        for (method, route), count in sorted(counts.items())
+    ]
+    total = sum(counts.values())
+    fast = sum(count for (method, _), count in counts.items() if method != "llm")
+    lines.append(f"rag_prerouter_fast_path_ratio {fast / total if total else 0.0:.4f}")
+    return "\n".join(lines) + "\n"
+
+
+_centroids = {}
+_centroids_lock = threading.Lock()
+
+
+def get_prerouter(embeddings, vectorstore, model, use_embeddings=PREROUTER_EMBEDDINGS, path=PREROUTER_CENTROIDS_PATH):
+    """A prerouter over centroids shared by every agent using the same embedding model."""
+    if not use_embeddings:
+        return Prerouter(embeddings)
+    with _centroids_lock:
+        centroids = _centroids.get(model)
+    if centroids is None:
+        # Built outside the lock so agents of other models are not held up by the request;
+        # concurrent first builds for one model may both run, the first stored wins.
+        centroids = load_centroids(path, model)
+        if centroids is None:
+            print("--COMPUTING ROUTE CENTROIDS--")
+            centroids = build_centroids(embeddings, vectorstore)
+        with _centroids_lock:
+            centroids = _centroids.setdefault(model, centroids)
+    return Prerouter(embeddings, centroids)
+
+
+def evaluate(routes, labels):
+    """Share of queries decided locally and the accuracy of those decisions."""
+    decided = [(route, label) for route, label in zip(routes, labels) if route is not None]
+    return {
+        "fast_path": round(len(decided) / len(labels), 3) if labels else 0.0,
+        "accuracy": round(sum(route == label for route, label in decided) / len(decided), 3) if decided else None,
+    }
+
+
+def main():
+    from dotenv import load_dotenv
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    from src.agent_comps.agent import EMBEDDING_MODEL, load_vector_store
+    from src.store_comps.embedding_cache import cached_embeddings
+
+    parser = argparse.ArgumentParser(description="Precompute the route centroids of the local pre-router.")
+    parser.add_argument("--data-path", default="./data")
+    parser.add_argument("--out", default=PREROUTER_CENTROIDS_PATH)
+    parser.add_argument(
+        "--queries",
+        help="Labelled queries to evaluate on, one 'ROUTE<TAB>query' per line (default: leave-one-out on the examples).",
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    embeddings = cached_embeddings(GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
+    vectorstore = load_vector_store(embeddings, args.data_path)
+    corpus = corpus_centroid(vectorstore)
+    texts, labels = _examples()
+    vectors = _normalize(embed_queries(embeddings, texts))
+    centroids = centroids_from_vectors(vectors, labels, corpus)
+    save_centroids(args.out, centroids, EMBEDDING_MODEL)
+    print("--ROUTE CENTROIDS WRITTEN--", args.out)
+
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            pairs = [line.rstrip("\n").split("\t", 1) for line in f if line.strip()]
+        test_labels = [label for label, _ in pairs]
+        test_vectors = embed_queries(embeddings, [query for _, query in pairs])
+        routers = [Prerouter(embeddings, centroids)] * len(pairs)
+    else:
+        # Leave one out: every example is classified by centroids built without it.
+        test_labels, test_vectors = labels, vectors
+        keep = np.ones(len(labels), dtype=bool)
+        routers = []
+        for i in range(len(labels)):
+            keep[i] = False
+            routers.append(Prerouter(embeddings, centroids_from_vectors(vectors[keep], np.asarray(labels)[keep], corpus)))
+            keep[i] = True
+
+    for margin in (0.0, 0.02, 0.04, 0.06, 0.08, 0.1, 0.15):
+        routes = []
+        for router, vector in zip(routers, test_vectors):
+            router.margin = margin
+            routes.append(router.classify(vector)[0])
+        result = evaluate(routes, test_labels)
+        print(f"margin {margin:.2f}: fast path {result['fast_path']:.1%}, accuracy {result['accuracy']}")
+
+
+if __name__ == "__main__":
+    main()
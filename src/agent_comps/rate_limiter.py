@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+import weakref
+
+from google.api_core.exceptions import ResourceExhausted
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.rate_limiters import BaseRateLimiter
+
+# Requests / tokens per minute for each model. RATE_LIMIT_RPM / RATE_LIMIT_TPM
+# override the table for every model, e.g. for a paid-tier key.
+DEFAULT_LIMITS = {
+    "gemini-2.0-flash": (15, 1_000_000),
+    "gemini-2.0-flash-lite": (30, 1_000_000),
+    "gemini-2.0-pro": (2, 1_000_000),
+    "gemini-1.5-pro": (2, 32_000),
+}
+FALLBACK_LIMITS = (15, 1_000_000)
+
+# Processes sharing the quota, each with its own buckets: every worker gets an equal
+# share. uvicorn starts WEB_CONCURRENCY workers when --workers is not given.
+RATE_LIMIT_WORKERS = int(os.getenv("RATE_LIMIT_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "4"))
+RATE_LIMIT_BACKOFF_BASE = float(os.getenv("RATE_LIMIT_BACKOFF_BASE", "1.0"))
+RATE_LIMIT_BACKOFF_MAX = float(os.getenv("RATE_LIMIT_BACKOFF_MAX", "30.0"))
+
+
+def _limits_for(model_name, workers=RATE_LIMIT_WORKERS):
+    rpm, tpm = DEFAULT_LIMITS.get(model_name, FALLBACK_LIMITS)
+    rpm = int(os.getenv("RATE_LIMIT_RPM", rpm))
+    tpm = int(os.getenv("RATE_LIMIT_TPM", tpm))
+    workers = max(1, workers)
+    return rpm / workers, tpm / workers
+
+
+def is_rate_limit_error(error):
+    if isinstance(error, ResourceExhausted):
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``per_minute`` tokens a minute.
+
+    ``reserve`` takes tokens up front and returns how long the caller has to wait
+    for them, so concurrent callers queue behind each other instead of all waking
+    up at once. The balance may go negative; that debt is what later callers wait on.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _deficit(self):
+        return max(0.0, -self.tokens / self.rate) if self.rate > 0 else 0.0
+
+    def reserve(self, amount=1):
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            return self._deficit()
+
+    def try_take(self, amount=1):
+        with self._lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True
+            return False
+
+    def debit(self, amount):
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+    def wait_time(self):
+        with self._lock:
+            self._refill()
+            return self._deficit()
+
+    def drain(self):
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+
+class _UsageCallback(BaseCallbackHandler):
+    """Charges the tokens a finished LLM call actually used to the TPM bucket."""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def on_llm_end(self, response, **kwargs):
+        total = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    total += usage.get("total_tokens", 0)
+        if total:
+            self.limiter.record_tokens(total)
+
+
+class GeminiRateLimiter(BaseRateLimiter):
+    """RPM/TPM limiter shared by every session using the same model and API key.
+
+    Plugged into the chat model as its ``rate_limiter``, so every call made by an
+    ``Agent`` node waits here first, and only for as long as the quota requires.
+    ``invoke`` / ``ainvoke`` are the retry loop on 429s: build the model with
+    ``max_retries=0`` so its client does not retry underneath them. (The pinned
+    langchain-google-genai 2.0.11 ignores ``max_retries`` and always makes up to
+    two attempts, so a throttled call costs at most ``2 * (RATE_LIMIT_MAX_RETRIES + 1)``
+    requests.)
+    """
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.usage_callback = _UsageCallback(self)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "rate_limit_errors": 0,
+            "retries": 0,
+            "retry_wait_seconds": 0.0,
+            "tokens": 0,
+        }
+
+    def _count(self, **values):
+        with self._stats_lock:
+            for name, value in values.items():
+                self._stats[name] += value
+
+    def _record_wait(self, wait):
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            if wait > 0:
+                self._stats["waits"] += 1
+                self._stats["wait_seconds"] += wait
+                self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], wait)
+
+    def _reserve(self):
+        # Tokens are charged after a call finishes, so an overdrawn TPM bucket only
+        # delays the next request; it never needs a reservation of its own.
+        return max(self.requests.reserve(1), self.tokens.wait_time())
+
+    def acquire(self, *, blocking=True):
+        if not blocking:
+            if self.tokens.wait_time() > 0 or not self.requests.try_take(1):
+                return False
+            self._record_wait(0.0)
+            return True
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        self._record_wait(wait)
+        return True
+
+    async def aacquire(self, *, blocking=True):
+        if not blocking:
+            return self.acquire(blocking=False)
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._record_wait(wait)
+        return True
+
+    def record_tokens(self, amount):
+        self.tokens.debit(amount)
+        self._count(tokens=amount)
+
+    def _backoff(self, attempt):
+        # Full jitter: spreads sessions that hit the same 429 at the same moment.
+        return random.uniform(0, min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF_BASE * 2 ** attempt))
+
+    def _on_rate_limited(self, attempt):
+        # Every session sharing this key backs off, not only the one that got the 429.
+        self.requests.drain()
+        delay = self._backoff(attempt)
+        self._count(rate_limit_errors=1, retries=1, retry_wait_seconds=delay)
+        print(f"--RATE LIMITED, RETRYING IN {delay:.1f}s--")
+        return delay
+
+    def invoke(self, runnable, input, config=None, max_retries=RATE_LIMIT_MAX_RETRIES):
+        """``runnable.invoke`` with jittered exponential backoff on 429s."""
+        for attempt in range(max_retries + 1):
+            try:
+                return runnable.invoke(input, config)
+            except Exception as e:
+                if attempt == max_retries or not is_rate_limit_error(e):
+                    raise
+                time.sleep(self._on_rate_limited(attempt))
+
+    async def ainvoke(self, runnable, input, config=None, max_retries=RATE_LIMIT_MAX_RETRIES):
+        for attempt in range(max_retries + 1):
+            try:
+                return await runnable.ainvoke(input, config)
+            except Exception as e:
+                if attempt == max_retries or not is_rate_limit_error(e):
+                    raise
+                await asyncio.sleep(self._on_rate_limited(attempt))
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+# Held weakly: a limiter lives as long as the agents using it, so entries go away
+# when AgentCache evicts the last agent for a model and key.
+_limiters = weakref.WeakValueDictionary()
+_limiters_lock = threading.Lock()
+
+
+def _limiter_key(model_name, api_key):
+    return model_name, hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+def find_rate_limiter(model_name, api_key):
+    """The existing limiter for a model and key, or None; never creates one."""
+    with _limiters_lock:
+        return _limiters.get(_limiter_key(model_name, api_key))
+
+
+def get_rate_limiter(model_name, api_key):
+    key = _limiter_key(model_name, api_key)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = GeminiRateLimiter(*_limits_for(model_name))
+            _limiters[key] = limiter
+        return limiter
+
+
+def rate_limiter_stats():
+    with _limiters_lock:
+        limiters = list(_limiters.items())
+    return {f"{model}:{key_hash[:8]}": limiter.stats() for (model, key_hash), limiter in limiters}
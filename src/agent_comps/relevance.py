@@ -0,0 +1,295 @@
+"""Local relevance scoring for retrieved documents, used by ``grading_mode="rerank"``.
+
+A scorer turns (query, documents) into one number per document. Calibrated
+``low`` / ``high`` thresholds split the scores three ways: at or above ``high``
+is relevant, below ``low`` is irrelevant, and only the band in between is sent
+to the LLM grader. The thresholds come from a JSONL log of past LLM gradings,
+which the agent appends to when ``GRADINGS_LOG_PATH`` is set. In rerank mode
+the LLM only sees the borderline band, so a random ``GRADINGS_AUDIT_SHARE`` of
+the locally decided documents is graded (and logged) as well; otherwise the
+log would only cover the band the current thresholds already picked:
+
+    python -m src.agent_comps.relevance --gradings cache/gradings.jsonl --scorer embedding
+"""
+import argparse
+import json
+import os
+import random
+import threading
+
+import numpy as np
+
+from src.store_comps.bm25 import tokenize
+
+RELEVANCE_SCORER = os.getenv("RELEVANCE_SCORER", "embedding")
+RELEVANCE_THRESHOLDS_PATH = os.getenv("RELEVANCE_THRESHOLDS_PATH", "./data/relevance_thresholds.json")
+# Directory with model.onnx and tokenizer.json for the "cross_encoder" scorer.
+RELEVANCE_MODEL_DIR = os.getenv("RELEVANCE_MODEL_DIR", "./models/cross-encoder")
+# Empty disables the log of LLM gradings used for calibration.
+GRADINGS_LOG_PATH = os.getenv("GRADINGS_LOG_PATH", "")
+# Share of locally decided documents also sent to the LLM grader while the log is on.
+GRADINGS_AUDIT_SHARE = float(os.getenv("GRADINGS_AUDIT_SHARE", "0.05"))
+# Precision asked of the automatic verdicts on either side of the borderline band.
+CALIBRATION_PRECISION = float(os.getenv("CALIBRATION_PRECISION", "0.95"))
+
+# Rough, deliberately wide bands used until a calibration file exists.
+DEFAULT_THRESHOLDS = {
+    "lexical": {"low": 0.15, "high": 0.9},
+    "embedding": {"low": 0.45, "high": 0.8},
+    "cross_encoder": {"low": 0.2, "high": 0.8},
+}
+
+
+class LexicalScorer:
+    """Share of the query's BM25 idf mass whose terms appear in the document."""
+
+    name = "lexical"
+
+    def __init__(self, bm25=None):
+        self.bm25 = bm25
+
+    def _weight(self, term):
+        return self.bm25.idf(term) if self.bm25 is not None else 1.0
+
+    def score(self, query, docs):
+        terms = set(tokenize(query))
+        total = sum(self._weight(term) for term in terms)
+        scores = []
+        for doc in docs:
+            present = terms & set(tokenize(doc.page_content))
+            scores.append(sum(self._weight(term) for term in present) / total if total else 0.0)
+        return scores
+
+
+class EmbeddingScorer:
+    """Cosine similarity between the query and each document's vector.
+
+    Vectors of indexed chunks are read back from the FAISS index instead of
+    being embedded again; only documents not in the index (Wikipedia pages) are
+    embedded. The query embedding is normally an embedding cache hit, since
+    retrieval just embedded the same text.
+    """
+
+    name = "embedding"
+
+    def __init__(self, embeddings, vectorstore=None):
+        self.embeddings = embeddings
+        self.vectorstore = vectorstore
+        self._row_of = None
+
+    def _row(self, doc):
+        # A parent section is scored with the vector of the child it was retrieved through.
+        doc_id = doc.metadata.get("child_id", doc.id)
+        if self.vectorstore is None or doc_id is None:
+            return None
+        if self._row_of is None:
+            if hasattr(self.vectorstore, "row_of"):
+                self._row_of = self.vectorstore.row_of
+            else:
+                self._row_of = {doc_id: row for row, doc_id in self.vectorstore.index_to_docstore_id.items()}.get
+        return self._row_of(doc_id)
+
+    def score(self, query, docs):
+        rows = [self._row(doc) for doc in docs]
+        vectors = [None] * len(docs)
+        indexed = [i for i, row in enumerate(rows) if row is not None]
+        if indexed:
+            stored = self.vectorstore.index.reconstruct_batch(np.array([rows[i] for i in indexed], dtype=np.int64))
+            for i, vector in zip(indexed, stored):
+                vectors[i] = vector
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            for i, vector in zip(missing, self.embeddings.embed_documents([docs[i].page_content for i in missing])):
+                vectors[i] = vector
+
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+        return [float(s) for s in (matrix @ query_vector) / np.maximum(norms, 1e-12)]
+
+
+class CrossEncoderScorer:
+    """Small ONNX cross-encoder (e.g. ms-marco-MiniLM) run on the CPU.
+
+    Needs the optional ``onnxruntime`` and ``tokenizers`` packages and a
+    directory with ``model.onnx`` and ``tokenizer.json``.
+    """
+
+    name = "cross_encoder"
+
+    def __init__(self, model_dir=RELEVANCE_MODEL_DIR, max_length=512):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The cross_encoder scorer needs `pip install onnxruntime tokenizers`.") from e
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self._lock = threading.Lock()
+
+    def score(self, query, docs):
+        encodings = self.tokenizer.encode_batch([(query, doc.page_content) for doc in docs])
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        with self._lock:
+            logits = self.session.run(None, {k: v for k, v in inputs.items() if k in self.input_names})[0]
+        return [float(s) for s in 1 / (1 + np.exp(-logits.reshape(len(docs), -1)[:, 0]))]
+
+
+def get_scorer(name=RELEVANCE_SCORER, embeddings=None, vectorstore=None, bm25=None):
+    if name == "lexical":
+        return LexicalScorer(bm25)
+    if name == "embedding":
+        return EmbeddingScorer(embeddings, vectorstore)
+    if name == "cross_encoder":
+        return CrossEncoderScorer()
+    raise ValueError(f"Unknown relevance scorer: {name}")
+
+
+def load_thresholds(scorer_name, path=RELEVANCE_THRESHOLDS_PATH):
+    if os.path.exists(path):
+        with open(path) as f:
+            calibrated = json.load(f)
+        if scorer_name in calibrated:
+            return calibrated[scorer_name]
+    print(f"--NO CALIBRATED THRESHOLDS FOR {scorer_name.upper()}, USING DEFAULTS--")
+    return DEFAULT_THRESHOLDS[scorer_name]
+
+
+def calibrate(scores, labels, precision=CALIBRATION_PRECISION):
+    """Widest automatic region on each side that keeps ``precision`` on the labeled set.
+
+    ``high`` is the lowest score above which at least ``precision`` of the
+    documents were graded relevant; ``low`` is the highest score below which at
+    least ``precision`` were graded irrelevant. Scores in ``[low, high)`` go to
+    the LLM.
+    """
+    order = np.argsort(scores)
+    scores = np.asarray(scores, dtype=np.float64)[order]
+    labels = np.asarray(labels, dtype=bool)[order]
+    n = len(scores)
+
+    high = float("inf")
+    positives_above = 0
+    for i in range(n - 1, -1, -1):
+        positives_above += labels[i]
+        if i > 0 and scores[i] == scores[i - 1]:
+            continue
+        if positives_above / (n - i) >= precision:
+            high = float(scores[i])
+
+    low = float("-inf")
+    negatives_below = 0
+    for i in range(n):
+        negatives_below += not labels[i]
+        if i < n - 1 and scores[i] == scores[i + 1]:
+            continue
+        if negatives_below / (i + 1) >= precision:
+            low = float(scores[i]) + 1e-9
+
+    return {"low": min(low, high), "high": high}
+
+
+class RelevanceGrader:
+    """Scores documents locally and says which ones still need the LLM grader."""
+
+    def __init__(self, scorer, thresholds=None):
+        self.scorer = scorer
+        self.thresholds = thresholds or load_thresholds(scorer.name)
+
+    def grade(self, query, docs):
+        """One of "yes", "no" or None (borderline) per document, plus the raw scores."""
+        scores = self.scorer.score(query, docs)
+        grades = []
+        for score in scores:
+            if score >= self.thresholds["high"]:
+                grades.append("yes")
+            elif score < self.thresholds["low"]:
+                grades.append("no")
+            else:
+                grades.append(None)
+        return grades, scores
+
+
+def audit_sample(grades, share=GRADINGS_AUDIT_SHARE, path=GRADINGS_LOG_PATH):
+    """Indices of locally decided grades to send to the LLM anyway, for the calibration log."""
+    if not path or share <= 0:
+        return []
+    return [i for i, grade in enumerate(grades) if grade is not None and random.random() < share]
+
+
+_log_lock = threading.Lock()
+
+
+def log_gradings(query, docs, grades, path=GRADINGS_LOG_PATH):
+    """Append LLM verdicts to the calibration log (no-op when ``path`` is empty)."""
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with _log_lock, open(path, "a") as f:
+        for doc, grade in zip(docs, grades):
+            if grade in ("yes", "no"):
+                record = {"query": query, "document": doc.page_content, "id": doc.id, "grade": grade}
+                if "child_id" in doc.metadata:
+                    # Parent sections are scored through the child they were retrieved by.
+                    record["child_id"] = doc.metadata["child_id"]
+                f.write(json.dumps(record) + "\n")
+
+
+def main():
+    from langchain.schema import Document
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    from dotenv import load_dotenv
+
+    from src.agent_comps.agent import EMBEDDING_MODEL, load_bm25, load_vector_store
+    from src.store_comps.embedding_cache import cached_embeddings
+
+    parser = argparse.ArgumentParser(description="Calibrate relevance thresholds from logged LLM gradings.")
+    parser.add_argument("--gradings", required=True, help="JSONL written through GRADINGS_LOG_PATH.")
+    parser.add_argument("--scorer", default=RELEVANCE_SCORER, choices=sorted(DEFAULT_THRESHOLDS))
+    parser.add_argument("--data-path", default="./data")
+    parser.add_argument("--precision", type=float, default=CALIBRATION_PRECISION)
+    parser.add_argument("--out", default=RELEVANCE_THRESHOLDS_PATH)
+    args = parser.parse_args()
+
+    load_dotenv()
+    embeddings = vectorstore = None
+    if args.scorer == "embedding":
+        embeddings = cached_embeddings(GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
+        vectorstore = load_vector_store(embeddings, args.data_path)
+    scorer = get_scorer(args.scorer, embeddings, vectorstore, load_bm25(args.data_path))
+
+    scores = []
+    labels = []
+    with open(args.gradings) as f:
+        for line in f:
+            record = json.loads(line)
+            metadata = {"child_id": record["child_id"]} if "child_id" in record else {}
+            doc = Document(id=record.get("id"), page_content=record["document"], metadata=metadata)
+            scores.extend(scorer.score(record["query"], [doc]))
+            labels.append(record["grade"] == "yes")
+
+    thresholds = calibrate(scores, labels, args.precision)
+    auto = sum(1 for s in scores if s >= thresholds["high"] or s < thresholds["low"])
+    print(f"--{len(scores)} GRADINGS, {auto} DECIDED WITHOUT THE LLM--", thresholds)
+
+    calibrated = {}
+    if os.path.exists(args.out):
+        with open(args.out) as f:
+            calibrated = json.load(f)
+    calibrated[args.scorer] = thresholds
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(calibrated, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
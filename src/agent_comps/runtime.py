@@ -0,0 +1,97 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from src.agent_comps.agent import Agent, clear_vector_stores
+
+AGENT_CACHE_SIZE = int(os.getenv("AGENT_CACHE_SIZE", "8"))
+
+
+def _key_hash(api_key):
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+class AgentRuntime:
+    """An agent together with its workflow and the graphs compiled from it."""
+
+    def __init__(self, model_name, api_key, **agent_kwargs):
+        self.agent = Agent(model_name, api_key, **agent_kwargs)
+        self.workflow = self.agent.create_agent()
+        self._compiled = None
+        self._checkpointer = None
+        self._lock = threading.Lock()
+
+    def compile(self, checkpointer=None):
+        # Compiling is cheap compared to loading the agent, but it is still
+        # repeated work when the same checkpointer is reused across turns.
+        with self._lock:
+            if self._compiled is None or self._checkpointer is not checkpointer:
+                self._compiled = self.workflow.compile(checkpointer=checkpointer)
+                self._checkpointer = checkpointer
+            return self._compiled
+
+
+class AgentCache:
+    """Process-wide LRU cache of agent runtimes keyed by (model_name, api_key hash).
+
+    ``agent_kwargs`` are passed to every ``Agent`` it builds, e.g. fake clients.
+    """
+
+    def __init__(self, maxsize=AGENT_CACHE_SIZE, agent_kwargs=None):
+        self.maxsize = maxsize
+        self.agent_kwargs = agent_kwargs or {}
+        self._runtimes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model_name, api_key):
+        key = (model_name, _key_hash(api_key))
+        with self._lock:
+            runtime = self._runtimes.get(key)
+            if runtime is not None:
+                self._runtimes.move_to_end(key)
+                return runtime
+
+        # Build outside the lock so a slow cold start does not block other sessions.
+        runtime = AgentRuntime(model_name, api_key, **self.agent_kwargs)
+
+        with self._lock:
+            existing = self._runtimes.get(key)
+            if existing is not None:
+                self._runtimes.move_to_end(key)
+                return existing
+            self._runtimes[key] = runtime
+            while len(self._runtimes) > self.maxsize:
+                self._runtimes.popitem(last=False)
+            return runtime
+
+    def invalidate(self, model_name=None, api_key=None, reload_index=False):
+        """Drop cached runtimes matching the given model and/or key (all if neither is given).
+
+        With ``reload_index`` the shared FAISS index is re-read from disk on next use,
+        e.g. after the ingestion script has rebuilt ``data/``.
+        """
+        key_hash = _key_hash(api_key) if api_key is not None else None
+        with self._lock:
+            for key in list(self._runtimes):
+                if model_name is not None and key[0] != model_name:
+                    continue
+                if key_hash is not None and key[1] != key_hash:
+                    continue
+                del self._runtimes[key]
+        if reload_index:
+            clear_vector_stores()
+
+    def __len__(self):
+        return len(self._runtimes)
+
+
+agent_cache = AgentCache()
+
+
+def get_runtime(model_name, api_key):
+    return agent_cache.get(model_name, api_key)
+
+
+def invalidate(model_name=None, api_key=None, reload_index=False):
+    agent_cache.invalidate(model_name, api_key, reload_index)
@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+
+import numpy as np
+
+from src.store_comps.mmap_store import MMAP_STORE_ENABLED, STORE_DIRNAME, VECTORS_FILENAME, has_mmap_store
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "1") == "1"
+# Base name; each served index and embedding model gets its own file next to it.
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "./cache/semantic_cache.sqlite")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", str(7 * 24 * 3600)))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+
+
+def _served_files(data_path):
+    # The files the agent searches: the exported store if it loads one, else the pickled index.
+    store_dir = os.path.join(data_path, STORE_DIRNAME)
+    if MMAP_STORE_ENABLED and has_mmap_store(store_dir):
+        return [os.path.join(store_dir, name) for name in ("manifest.json", VECTORS_FILENAME, "index.faiss")]
+    return [os.path.join(data_path, "index.faiss")]
+
+
+def index_fingerprint(data_path):
+    """Changes whenever the index served from ``data_path`` is rebuilt."""
+    parts = []
+    for path in _served_files(data_path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        parts.append(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return ",".join(parts) or "missing"
+
+
+def cache_file(data_path, embedding_model, path=SEMANTIC_CACHE_PATH):
+    """SQLite file for answers from the index in ``data_path`` with ``embedding_model`` vectors.
+
+    Separate files keep caches over different indexes from wiping each other's
+    entries, and keep vectors of different models (and sizes) apart.
+    """
+    scope = hashlib.sha256(f"{os.path.abspath(data_path)}\0{embedding_model}".encode("utf-8")).hexdigest()[:16]
+    root, ext = os.path.splitext(path)
+    return f"{root}-{scope}{ext}"
+
+
+class CacheEntry:
+
+    def __init__(self, query, vector, generation, sources, source, created_at, last_access):
+        self.query = query
+        self.vector = vector
+        self.generation = generation
+        self.sources = sources
+        self.source = source
+        self.created_at = created_at
+        self.last_access = last_access
+
+    @property
+    def key(self):
+        return hashlib.sha256(self.query.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """Keeps nothing across restarts; the cache itself already holds entries in memory."""
+
+    def load(self, fingerprint):
+        return []
+
+    def put(self, entry):
+        pass
+
+    def touch(self, key, last_access):
+        pass
+
+    def delete(self, keys):
+        pass
+
+
+class SQLiteCacheBackend:
+
+    def __init__(self, path=SEMANTIC_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, query TEXT, vector BLOB, generation TEXT, "
+                "sources TEXT, source TEXT, created_at REAL, last_access REAL)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+
+    def load(self, fingerprint):
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM meta WHERE name = 'index_fingerprint'").fetchone()
+            if row is None or row[0] != fingerprint:
+                # Answers were generated against a different index; start over.
+                self._conn.execute("DELETE FROM entries")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (name, value) VALUES ('index_fingerprint', ?)", (fingerprint,)
+                )
+                return []
+            rows = self._conn.execute(
+                "SELECT query, vector, generation, sources, source, created_at, last_access "
+                "FROM entries ORDER BY last_access"
+            ).fetchall()
+        return [
+            CacheEntry(query, np.frombuffer(vector, dtype=np.float32), generation, json.loads(sources), source, created_at, last_access)
+            for query, vector, generation, sources, source, created_at, last_access in rows
+        ]
+
+    def put(self, entry):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    entry.key,
+                    entry.query,
+                    entry.vector.astype(np.float32).tobytes(),
+                    entry.generation,
+                    json.dumps(entry.sources),
+                    entry.source,
+                    entry.created_at,
+                    entry.last_access,
+                ),
+            )
+
+    def touch(self, key, last_access):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (last_access, key))
+
+    def delete(self, keys):
+        if not keys:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+
+
+class SemanticCache:
+    """Validated answers keyed by the embedding of the constructed query.
+
+    A lookup is a hit when the cosine similarity to a stored query is at least
+    ``threshold``. Entries expire after ``ttl`` seconds, the least recently used
+    ones are evicted past ``maxsize``, and everything is dropped when the index
+    served from ``data_path`` changes.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        ttl=SEMANTIC_CACHE_TTL,
+        maxsize=SEMANTIC_CACHE_SIZE,
+        data_path="./data",
+    ):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.data_path = data_path
+        self._lock = threading.Lock()
+        self._fingerprint = index_fingerprint(data_path)
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._keys = []
+        for entry in self.backend.load(self._fingerprint):
+            self._entries[entry.key] = entry
+        self._evict(time.time())
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_index(self):
+        fingerprint = index_fingerprint(self.data_path)
+        if fingerprint != self._fingerprint:
+            print("--INDEX CHANGED, CLEARING SEMANTIC CACHE--")
+            self._fingerprint = fingerprint
+            self._entries.clear()
+            self._matrix = None
+            # Loading under a new fingerprint wipes the persisted entries as well.
+            self.backend.load(fingerprint)
+
+    def _evict(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry.created_at > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        overflow = len(self._entries) - self.maxsize
+        if overflow > 0:
+            lru_keys = list(islice(self._entries, overflow))
+            for key in lru_keys:
+                del self._entries[key]
+            expired.extend(lru_keys)
+        if expired:
+            self._matrix = None
+            self.backend.delete(expired)
+
+    def _similarities(self, vector):
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = np.vstack([self._entries[key].vector for key in self._keys]) if self._keys else None
+        if self._matrix is None:
+            return None
+        return self._matrix @ vector
+
+    def lookup(self, vector):
+        vector = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            self._check_index()
+            self._evict(now)
+            similarities = self._similarities(vector)
+            if similarities is None:
+                return None
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            entry = self._entries[self._keys[best]]
+            entry.last_access = now
+            self._entries.move_to_end(entry.key)
+        self.backend.touch(entry.key, now)
+        return entry
+
+    def store(self, query, vector, generation, sources, source):
+        now = time.time()
+        entry = CacheEntry(query, self._normalize(vector), generation, list(sources), source, now, now)
+        with self._lock:
+            self._check_index()
+            self._entries[entry.key] = entry
+            self._entries.move_to_end(entry.key)
+            self._matrix = None
+            self._evict(now)
+        self.backend.put(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_caches = {}
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache(data_path="./data", embedding_model=""):
+    """The process-wide cache for answers generated from the index in ``data_path``."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    key = (data_path, embedding_model)
+    with _cache_lock:
+        if key not in _caches:
+            backend = SQLiteCacheBackend(cache_file(data_path, embedding_model))
+            _caches[key] = SemanticCache(backend, data_path=data_path)
+        return _caches[key]
@@ -0,0 +1,59 @@
+ANSWER_STREAM_TAG = "answer_stream"
+
+# Nodes that undo an answer which was already streamed: answer grading rejected it.
+RETRACTING_NODES = ("rewrite_query", "multi_query_search", "na")
+
+NODE_LABELS = {
+    "query_construction": "Understanding the question",
+    "route_question": "Understanding the question",
+    "cache_lookup": "Checking earlier answers",
+    "retrieve": "Searching the art history book",
+    "grade_docs": "Checking the retrieved passages",
+    "rewrite_query": "Rephrasing the question",
+    "multi_query_search": "Searching with rephrased questions",
+    "wiki_search": "Searching Wikipedia",
+    "generate": "Writing the answer",
+    "cache_answer": "Checking the answer",
+    "llm": "Writing the answer",
+}
+
+
+def _turn_events(state, mode, chunk):
+    # Shared by stream_turn / astream_turn: maps one graph stream item to UI events.
+    if mode == "messages":
+        message, metadata = chunk
+        if ANSWER_STREAM_TAG in metadata.get("tags", []) and isinstance(message.content, str) and message.content:
+            state["streamed"] = True
+            yield "token", message.content
+    elif chunk["type"] == "task":
+        node = chunk["payload"]["name"]
+        if state["streamed"] and node in RETRACTING_NODES:
+            state["streamed"] = False
+            yield "retract", None
+        yield "node", node
+    elif chunk["type"] == "checkpoint":
+        state["final"] = chunk["payload"]["values"]
+
+
+def stream_turn(app, inputs, config):
+    """Run one turn of the compiled graph and yield UI events as they happen.
+
+    Events are ``(kind, payload)`` tuples:
+      - ``("node", name)`` when a node starts,
+      - ``("token", text)`` for each answer token from ``generate`` / ``llm``,
+      - ``("retract", None)`` when a streamed answer failed grading and is being redone,
+      - ``("final", state)`` once, with the final graph state.
+    """
+    state = {"streamed": False, "final": None}
+    for mode, chunk in app.stream(inputs, config=config, stream_mode=["messages", "debug"]):
+        yield from _turn_events(state, mode, chunk)
+    yield "final", state["final"]
+
+
+async def astream_turn(app, inputs, config):
+    """Async version of ``stream_turn``, running the graph's async nodes."""
+    state = {"streamed": False, "final": None}
+    async for mode, chunk in app.astream(inputs, config=config, stream_mode=["messages", "debug"]):
+        for event in _turn_events(state, mode, chunk):
+            yield event
+    yield "final", state["final"]
@@ -0,0 +1,289 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+TRACING_ENABLED = os.getenv("TRACING", "0") == "1"
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "./cache/traces.jsonl")
+# 0 disables the Prometheus-style /metrics endpoint.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+TURN_SECONDS_BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, 64)
+
+_NULL_SPAN = nullcontext()
+_current_turn = contextvars.ContextVar("current_turn", default=None)
+
+
+class TurnTrace:
+    """Everything recorded while one chat turn runs through the graph."""
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.started = time.time()
+        self.duration = None
+        self.spans = []
+        self.counters = Counter()
+        self.final_state = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, kind, name, seconds, **fields):
+        with self._lock:
+            self.spans.append({"kind": kind, "name": name, "ms": round(seconds * 1000, 2), **fields})
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def summary(self):
+        per_kind = defaultdict(float)
+        per_node = defaultdict(float)
+        for span in self.spans:
+            per_kind[span["kind"]] += span["ms"]
+            if span["kind"] == "node":
+                per_node[span["name"]] += span["ms"]
+        return {
+            "thread_id": self.thread_id,
+            "started": self.started,
+            "total_ms": round((self.duration or 0) * 1000, 2),
+            "nodes_ms": {name: round(ms, 2) for name, ms in per_node.items()},
+            "calls_ms": {kind: round(ms, 2) for kind, ms in per_kind.items() if kind != "node"},
+            "llm_calls": self.counters["llm_calls"],
+            "prompt_tokens": self.counters["prompt_tokens"],
+            "completion_tokens": self.counters["completion_tokens"],
+            "retrieve_loops": self.final_state.get("route_to_retrieve", 0),
+            "wiki_loops": self.final_state.get("route_to_wiki", 0),
+            "counters": {
+                name: value
+                for name, value in self.counters.items()
+                if name not in ("llm_calls", "prompt_tokens", "completion_tokens")
+            },
+        }
+
+
+class Metrics:
+    """Process-wide counters rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self.turn_buckets = Counter()
+        self.turn_seconds_sum = 0.0
+        self.turns = 0
+
+    def observe_turn(self, trace):
+        with self._lock:
+            self.turns += 1
+            self.turn_seconds_sum += trace.duration
+            for bound in TURN_SECONDS_BUCKETS:
+                if trace.duration <= bound:
+                    self.turn_buckets[bound] += 1
+            for span in trace.spans:
+                labels = f'{span["kind"]}="{span["name"]}"' if span["kind"] == "node" else f'kind="{span["kind"]}"'
+                self.counters[f"rag_span_seconds_sum{{{labels}}}"] += span["ms"] / 1000
+                self.counters[f"rag_span_calls_total{{{labels}}}"] += 1
+            for name, value in trace.counters.items():
+                self.counters[f'rag_events_total{{event="{name}"}}'] += value
+            self.counters["rag_rewrite_loops_total"] += trace.final_state.get("route_to_retrieve", 0) + trace.final_state.get(
+                "route_to_wiki", 0
+            )
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for bound in TURN_SECONDS_BUCKETS:
+                lines.append(f'rag_turn_seconds_bucket{{le="{bound}"}} {self.turn_buckets[bound]}')
+            lines.append(f'rag_turn_seconds_bucket{{le="+Inf"}} {self.turns}')
+            lines.append(f"rag_turn_seconds_sum {self.turn_seconds_sum}")
+            lines.append(f"rag_turn_seconds_count {self.turns}")
+            for name in sorted(self.counters):
+                lines.append(f"{name} {self.counters[name]}")
+            return "\n".join(lines) + "\n"
+
+
+class _LLMCallback(BaseCallbackHandler):
+    """Times every chat model call and collects its token usage for the current turn."""
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self._starts = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._starts.pop(run_id, None)
+        trace = _current_turn.get()
+        if trace is None or started is None:
+            return
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+        trace.add_span("llm", "llm", time.perf_counter() - started, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        trace.count("llm_calls")
+        trace.count("prompt_tokens", prompt_tokens)
+        trace.count("completion_tokens", completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+
+
+class TracedEmbeddings(Embeddings):
+    """Records an ``embedding`` span for every call on the wrapped embeddings."""
+
+    def __init__(self, embeddings, tracer):
+        self.embeddings = embeddings
+        self.tracer = tracer
+
+    def embed_documents(self, texts):
+        with self.tracer.span("embedding"):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        with self.tracer.span("embedding"):
+            return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        with self.tracer.span("embedding"):
+            return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text):
+        with self.tracer.span("embedding"):
+            return await self.embeddings.aembed_query(text)
+
+
+class Tracer:
+    """Per-turn tracing of graph nodes and the calls they make.
+
+    When disabled, ``wrap_node`` returns the node unchanged and ``span`` /
+    ``count`` return immediately, so nothing is added to the request path.
+    """
+
+    def __init__(self, enabled=TRACING_ENABLED, log_path=TRACE_LOG_PATH, metrics_port=METRICS_PORT):
+        self.enabled = enabled
+        self.log_path = log_path
+        self.metrics = Metrics()
+        self.llm_callback = _LLMCallback(self)
+        self._log_lock = threading.Lock()
+        if enabled and metrics_port:
+            self._serve_metrics(metrics_port)
+
+    def wrap_node(self, name, fn, kind="node"):
+        if not self.enabled:
+            return fn
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with self.span(kind, name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.span(kind, name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def wrap_embeddings(self, embeddings):
+        if not self.enabled:
+            return embeddings
+        if hasattr(embeddings, "on_lookup"):
+            embeddings.on_lookup = self._count_embedding_cache
+        return TracedEmbeddings(embeddings, self)
+
+    def _count_embedding_cache(self, hits, misses):
+        self.count("embedding_cache_hit", hits)
+        self.count("embedding_cache_miss", misses)
+
+    def span(self, kind, name=None):
+        if not self.enabled or _current_turn.get() is None:
+            return _NULL_SPAN
+        return self._span(kind, name or kind)
+
+    @contextmanager
+    def _span(self, kind, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            trace = _current_turn.get()
+            if trace is not None:
+                trace.add_span(kind, name, time.perf_counter() - started)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        trace = _current_turn.get()
+        if trace is not None:
+            trace.count(name, amount)
+
+    @contextmanager
+    def turn(self, thread_id):
+        """Trace everything run inside the block as one turn; yields the TurnTrace (or None)."""
+        if not self.enabled:
+            yield None
+            return
+        trace = TurnTrace(thread_id)
+        token = _current_turn.set(trace)
+        started = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - started
+            _current_turn.reset(token)
+            self.metrics.observe_turn(trace)
+            self._write(trace)
+
+    def _write(self, trace):
+        record = {**trace.summary(), "spans": trace.spans}
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        with self._log_lock, open(self.log_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _serve_metrics(self, port):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        except OSError as e:
+            # Another worker in this box already serves the endpoint.
+            print("--METRICS ENDPOINT NOT STARTED--", e)
+            return
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"--METRICS ON :{port}/metrics--")
+
+
+tracer = Tracer()
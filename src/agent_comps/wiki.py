@@ -0,0 +1,446 @@
+"""Wikipedia fallback lookups: cached, time-bounded and optionally offline.
+
+``WikiLookup`` stands in for ``WikipediaQueryRun`` (same ``invoke`` /
+``ainvoke`` with ``{"query": ...}``, same "Page: ...\\nSummary: ..." text):
+
+- Cache: queries are normalised (case, accents, punctuation, stopwords) and
+  mapped to the page titles Wikipedia resolved them to; pages are cached by
+  normalised title, so different questions landing on the same article fetch it
+  once. Both caches expire after ``WIKI_CACHE_TTL`` and evict the least
+  recently used entries past ``WIKI_CACHE_SIZE``.
+- Hard timeout: a live lookup that takes longer than ``WIKI_TIMEOUT`` seconds is
+  abandoned (it finishes in the background and still fills the cache).
+- Circuit breaker: after ``WIKI_BREAKER_FAILURES`` failures or timeouts in a row,
+  live lookups are skipped for ``WIKI_BREAKER_COOLDOWN`` seconds, then one trial
+  lookup decides whether to close it again.
+- Snapshot: a pre-fetched set of art-history articles on disk, searched with
+  BM25. With ``WIKI_SOURCE="snapshot"`` it is the only source (fully offline);
+  otherwise it answers whenever the live lookup fails, times out or is skipped.
+
+Build the snapshot from the chapter titles of the book (plus ``--seeds`` file):
+
+    python -m src.agent_comps.wiki --data-dir data --per-seed 5
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from langchain.schema import Document
+
+from src.agent_comps.tracing import tracer
+from src.store_comps.bm25 import BM25_DIRNAME, BM25Index, has_bm25, tokenize, write_bm25
+from src.store_comps.mmap_store import STORE_DIRNAME, Documents, MmapVectorStore, swap_directory, write_documents
+
+# "live": query Wikipedia (the snapshot, if built, covers failures), "snapshot": offline only.
+WIKI_SOURCE = os.getenv("WIKI_SOURCE", "live")
+WIKI_SNAPSHOT_PATH = os.getenv("WIKI_SNAPSHOT_PATH", "./data/wiki_snapshot")
+WIKI_TOP_K = int(os.getenv("WIKI_TOP_K", "1"))
+WIKI_CHARS_MAX = int(os.getenv("WIKI_CHARS_MAX", "1000"))
+WIKI_CACHE_SIZE = int(os.getenv("WIKI_CACHE_SIZE", "1024"))
+WIKI_CACHE_TTL = float(os.getenv("WIKI_CACHE_TTL", str(24 * 3600)))
+WIKI_TIMEOUT = float(os.getenv("WIKI_TIMEOUT", "4"))
+WIKI_BREAKER_FAILURES = int(os.getenv("WIKI_BREAKER_FAILURES", "3"))
+WIKI_BREAKER_COOLDOWN = float(os.getenv("WIKI_BREAKER_COOLDOWN", "60"))
+# Threads for live lookups; abandoned (timed out) lookups keep one busy until they return.
+WIKI_MAX_IN_FLIGHT = int(os.getenv("WIKI_MAX_IN_FLIGHT", "8"))
+NO_RESULT = "No good Wikipedia Search Result was found"
+WIKIPEDIA_MAX_QUERY_LENGTH = 300
+# Characters of the article body indexed next to the summary in the snapshot.
+SNAPSHOT_INDEXED_CHARS = 4000
+PAGES_DIRNAME = "pages"
+
+
+def normalize_query(query):
+    return " ".join(tokenize(query))
+
+
+def normalize_title(title):
+    return " ".join(title.replace("_", " ").lower().split())
+
+
+def format_page(title, summary):
+    return f"Page: {title}\nSummary: {summary}"
+
+
+class TTLCache:
+    """Thread-safe LRU map whose entries also expire ``ttl`` seconds after being stored."""
+
+    def __init__(self, maxsize=WIKI_CACHE_SIZE, ttl=WIKI_CACHE_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if self.clock() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class CircuitBreaker:
+    """Closed until ``failures`` consecutive failures, then open for ``cooldown`` seconds.
+
+    After the cooldown one caller is let through (half-open); its success closes
+    the breaker, its failure opens it for another cooldown.
+    """
+
+    def __init__(self, failures=WIKI_BREAKER_FAILURES, cooldown=WIKI_BREAKER_COOLDOWN, clock=time.monotonic):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.clock() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or self.clock() - self.opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._trial:
+                # The trial after the cooldown failed: stay open for another cooldown.
+                self.opened_at = self.clock()
+                self._trial = False
+            elif self.opened_at is None and self.consecutive_failures >= self.failures:
+                print("--WIKIPEDIA CIRCUIT BREAKER OPEN--")
+                self.trips += 1
+                self.opened_at = self.clock()
+
+
+class LiveWikipedia:
+    """Title search and page fetch against the Wikipedia API."""
+
+    def __init__(self, lang="en"):
+        import wikipedia
+
+        wikipedia.set_lang(lang)
+        self.client = wikipedia
+
+    def resolve(self, query, k=WIKI_TOP_K):
+        return self.client.search(query[:WIKIPEDIA_MAX_QUERY_LENGTH], results=k)
+
+    def page(self, title):
+        """The article titled ``title`` (redirects followed), or None."""
+        try:
+            return self.client.page(title=title, auto_suggest=False)
+        except (self.client.exceptions.PageError, self.client.exceptions.DisambiguationError):
+            return None
+
+    def fetch(self, title):
+        """``(resolved title, page text)``, or None when there is no such page."""
+        page = self.page(title)
+        if page is None:
+            return None
+        return page.title, format_page(title, page.summary)
+
+
+class WikiSnapshot:
+    """Pre-fetched articles in the memory-mapped document layout, searched with BM25."""
+
+    def __init__(self, directory=WIKI_SNAPSHOT_PATH):
+        pages_dir = os.path.join(directory, PAGES_DIRNAME)
+        with open(os.path.join(pages_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self._documents = Documents(pages_dir, self.manifest["columns"])
+        self._bm25 = BM25Index(os.path.join(directory, BM25_DIRNAME))
+
+    def __len__(self):
+        return len(self._documents)
+
+    def search(self, query, k=WIKI_TOP_K):
+        return [self._documents.document(row) for row, _ in self._bm25.search(query, k)]
+
+    def lookup(self, query, k=WIKI_TOP_K, chars_max=WIKI_CHARS_MAX):
+        pages = [doc.page_content for doc in self.search(query, k)]
+        return "\n\n".join(pages)[:chars_max] if pages else NO_RESULT
+
+
+def has_snapshot(directory):
+    return has_bm25(os.path.join(directory, BM25_DIRNAME))
+
+
+def write_snapshot(articles, directory):
+    """``articles``: dicts with title, url, summary and content."""
+    os.makedirs(os.path.dirname(os.path.abspath(directory)), exist_ok=True)
+    pages = [
+        Document(page_content=format_page(a["title"], a["summary"]), metadata={"title": a["title"], "source": a["url"]})
+        for a in articles
+    ]
+    # The title and the start of the article are indexed; the summary is what is returned.
+    indexed = [
+        Document(page_content=f"{a['title']}\n{a['summary']}\n{a['content'][:SNAPSHOT_INDEXED_CHARS]}")
+        for a in articles
+    ]
+    tmp_dir = directory + ".tmp"
+    pages_dir = os.path.join(tmp_dir, PAGES_DIRNAME)
+    os.makedirs(pages_dir)
+    names = write_documents(pages_dir, pages, [a["url"] for a in articles])
+    with open(os.path.join(pages_dir, "manifest.json"), "w") as f:
+        json.dump({"count": len(pages), "columns": names}, f)
+    write_bm25(indexed, os.path.join(tmp_dir, BM25_DIRNAME))
+    swap_directory(tmp_dir, directory)
+
+
+class WikiLookup:
+    """Cached, time-bounded Wikipedia search; see the module docstring.
+
+    ``live`` is anything with ``resolve(query, k) -> titles`` and
+    ``fetch(title) -> (resolved title, text) | None``, e.g. ``LiveWikipedia``
+    or the offline ``FakeWikipedia``. ``cache_size=0`` turns caching off.
+    """
+
+    def __init__(
+        self,
+        live=None,
+        snapshot=None,
+        source=WIKI_SOURCE,
+        top_k=WIKI_TOP_K,
+        chars_max=WIKI_CHARS_MAX,
+        cache_size=WIKI_CACHE_SIZE,
+        ttl=WIKI_CACHE_TTL,
+        timeout=WIKI_TIMEOUT,
+        breaker=None,
+        max_in_flight=WIKI_MAX_IN_FLIGHT,
+    ):
+        if live is None and source != "snapshot":
+            live = LiveWikipedia()
+        self.live = live
+        self.snapshot = snapshot
+        self.source = source
+        self.top_k = top_k
+        self.chars_max = chars_max
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.titles = TTLCache(cache_size, ttl)
+        self.pages = TTLCache(cache_size, ttl)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="wikipedia")
+        self.stats = {"cache_hits": 0, "cache_misses": 0, "page_cache_hits": 0, "timeouts": 0, "errors": 0, "short_circuited": 0, "snapshot": 0}
+
+    def _count(self, name):
+        self.stats[name] += 1
+        tracer.count(f"wiki_{name}")
+
+    def _cached(self, query):
+        """The answer assembled from the caches alone, or None."""
+        titles = self.titles.get(normalize_query(query))
+        if titles is None:
+            return None
+        pages = []
+        for title in titles:
+            page = self.pages.get(normalize_title(title))
+            if page is None:
+                return None
+            pages.append(page)
+        return self._join(pages)
+
+    def _join(self, pages):
+        pages = [page for page in pages if page]
+        return "\n\n".join(pages)[:self.chars_max] if pages else NO_RESULT
+
+    def _fetch_live(self, query):
+        key = normalize_query(query)
+        titles = self.titles.get(key)
+        if titles is None:
+            titles = list(self.live.resolve(query, self.top_k))[:self.top_k]
+            self.titles.put(key, titles)
+        pages = []
+        for title in titles:
+            page = self.pages.get(normalize_title(title))
+            if page is not None:
+                self._count("page_cache_hits")
+            else:
+                fetched = self.live.fetch(title)
+                page = "" if fetched is None else fetched[1]
+                self.pages.put(normalize_title(title), page)
+                if fetched is not None:
+                    self.pages.put(normalize_title(fetched[0]), page)
+            pages.append(page)
+        return self._join(pages)
+
+    def _from_snapshot(self, query):
+        if self.snapshot is None:
+            return NO_RESULT
+        self._count("snapshot")
+        return self.snapshot.lookup(query, self.top_k, self.chars_max)
+
+    def _before_live(self, query):
+        """(answer, go_live): answer from the cache or the snapshot, or go live."""
+        if self.source == "snapshot":
+            return self._from_snapshot(query), False
+        cached = self._cached(query)
+        if cached is not None:
+            self._count("cache_hits")
+            return cached, False
+        self._count("cache_misses")
+        if not self.breaker.allow():
+            print("--WIKIPEDIA SKIPPED, CIRCUIT OPEN--")
+            self._count("short_circuited")
+            return self._from_snapshot(query), False
+        return None, True
+
+    def _failed(self, query, error):
+        self.breaker.record_failure()
+        if isinstance(error, (FutureTimeoutError, asyncio.TimeoutError)):
+            print(f"--WIKIPEDIA TIMED OUT AFTER {self.timeout}s--")
+            self._count("timeouts")
+        else:
+            print("--WIKIPEDIA LOOKUP FAILED--", error)
+            self._count("errors")
+        return self._from_snapshot(query)
+
+    def invoke(self, input, config=None):
+        query = input["query"] if isinstance(input, dict) else input
+        answer, go_live = self._before_live(query)
+        if not go_live:
+            return answer
+        future = self._pool.submit(contextvars.copy_context().run, self._fetch_live, query)
+        try:
+            answer = future.result(timeout=self.timeout)
+        except Exception as e:
+            future.cancel()
+            return self._failed(query, e)
+        self.breaker.record_success()
+        return answer
+
+    async def ainvoke(self, input, config=None):
+        query = input["query"] if isinstance(input, dict) else input
+        answer, go_live = self._before_live(query)
+        if not go_live:
+            return answer
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool, contextvars.copy_context().run, self._fetch_live, query)
+        try:
+            # shield: a timed-out lookup keeps running and still fills the cache.
+            answer = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except Exception as e:
+            return self._failed(query, e)
+        self.breaker.record_success()
+        return answer
+
+    def render(self):
+        lines = [f'rag_wiki_lookups_total{{result="{name}"}} {value}' for name, value in self.stats.items()]
+        lines.append(f"rag_wiki_breaker_open {int(self.breaker.state != 'closed')}")
+        lines.append(f"rag_wiki_breaker_trips_total {self.breaker.trips}")
+        return "\n".join(lines) + "\n"
+
+
+def load_snapshot(directory=WIKI_SNAPSHOT_PATH):
+    return WikiSnapshot(directory) if has_snapshot(directory) else None
+
+
+_lookup = None
+_lookup_lock = threading.Lock()
+
+
+def get_wiki_lookup():
+    """The process-wide lookup, so every agent shares one cache and breaker."""
+    global _lookup
+    with _lookup_lock:
+        if _lookup is None:
+            snapshot = load_snapshot(WIKI_SNAPSHOT_PATH)
+            if snapshot is not None:
+                print(f"--LOADED WIKIPEDIA SNAPSHOT ({len(snapshot)} ARTICLES)--")
+            elif WIKI_SOURCE == "snapshot":
+                print("--NO WIKIPEDIA SNAPSHOT AT", WIKI_SNAPSHOT_PATH, "--")
+            _lookup = WikiLookup(snapshot=snapshot)
+        return _lookup
+
+
+def chapter_seeds(data_dir):
+    """Chapter titles of the book, from the source URLs of the indexed chunks."""
+    store = MmapVectorStore(os.path.join(data_dir, STORE_DIRNAME))
+    sources = {store.document(row).metadata["source"] for row in range(len(store))}
+    slugs = [url.rstrip("/").rsplit("/", 1)[-1] for url in sources]
+    return sorted({slug.replace("-", " ") for slug in slugs})
+
+
+def fetch_articles(live, seeds, per_seed):
+    articles = {}
+    for seed in seeds:
+        try:
+            titles = live.resolve(seed, per_seed)
+        except Exception as e:
+            print("--SEARCH FAILED--", seed, e)
+            continue
+        for title in titles:
+            if normalize_title(title) in articles:
+                continue
+            try:
+                page = live.page(title)
+                if page is None:
+                    continue
+                article = {"title": page.title, "url": page.url, "summary": page.summary, "content": page.content}
+            except Exception as e:
+                print("--FETCH FAILED--", title, e)
+                continue
+            articles[normalize_title(title)] = article
+            print(f"--FETCHED {len(articles)}--", page.title)
+    return list({a["url"]: a for a in articles.values()}.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline Wikipedia snapshot used by the fallback.")
+    parser.add_argument("--data-dir", default="data", help="Chapter titles of this index seed the snapshot.")
+    parser.add_argument("--seeds", help="File with one extra search query per line.")
+    parser.add_argument("--per-seed", type=int, default=5, help="Articles fetched per search query.")
+    parser.add_argument("--out", default=WIKI_SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    seeds = chapter_seeds(args.data_dir)
+    if args.seeds:
+        with open(args.seeds, encoding="utf-8") as f:
+            seeds += [line.strip() for line in f if line.strip()]
+    articles = fetch_articles(LiveWikipedia(), seeds, args.per_seed)
+    write_snapshot(articles, args.out)
+    print(f"--WIKIPEDIA SNAPSHOT WRITTEN ({len(articles)} ARTICLES)--", args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,74 @@
-import langchain
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-import langgraph
-
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import WebBaseLoader
-from langchain_community.vectorstores import FAISS
-
-import bs4
-from bs4 import BeautifulSoup
-import requests
-from uuid import uuid4
+import argparse
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from dotenv import load_dotenv
 
-load_dotenv()
+from src.ingestion_comps.embedding import EMBED_BATCH_TOKENS, EMBED_MAX_IN_FLIGHT, EmbeddingStage
+from src.ingestion_comps.fetch import BOOK_URL, FETCH_CONCURRENCY, collect_links
+from src.ingestion_comps.pipeline import IncrementalIngestion
+from src.ingestion_comps.preprocess import PREPROCESS_ENABLED, Preprocessor
+from src.store_comps.ann import FAISS_INDEX, INDEX_KINDS
+from src.store_comps.embedding_cache import cached_embeddings
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+
 
-embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
+def main():
+    parser = argparse.ArgumentParser(description="Scrape, chunk and embed the art history book into data/.")
+    parser.add_argument("--book-url", default=BOOK_URL)
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="Save progress after this many changed chapters.")
+    parser.add_argument("--concurrency", type=int, default=FETCH_CONCURRENCY, help="Concurrent chapter downloads per host.")
+    parser.add_argument("--max-in-flight", type=int, default=EMBED_MAX_IN_FLIGHT, help="Concurrent embedding requests.")
+    parser.add_argument("--batch-tokens", type=int, default=EMBED_BATCH_TOKENS, help="Token budget per embedding request.")
+    parser.add_argument(
+        "--fake-embeddings",
+        action="store_true",
+        help="Use deterministic offline embeddings, e.g. against benchmarks.pressbook_server.",
+    )
+    parser.add_argument(
+        "--no-mmap-store",
+        action="store_true",
+        help="Only save index.faiss/index.pkl, not the memory-mapped data/store copy or the data/bm25 index.",
+    )
+    parser.add_argument(
+        "--no-preprocess",
+        action="store_true",
+        help="Index plain 400-token chunks: no boilerplate stripping, deduplication or parent-child chunks.",
+    )
+    parser.add_argument(
+        "--index",
+        default=FAISS_INDEX,
+        help=f"Index the app searches: one of {', '.join(INDEX_KINDS)} or a faiss.index_factory string.",
+    )
+    args = parser.parse_args()
 
-url = "https://boisestate.pressbooks.pub/arthistory/"
-page = requests.get(url)
-soup = BeautifulSoup(page.content, "html.parser")
+    load_dotenv()
 
-links = []
-for i in soup.find_all(class_="toc__title"):
-    links.append(i.find("a").get("href"))
-print("--LINKS COLLECTED--")
-print(len(links))
+    if args.fake_embeddings:
+        embeddings = DeterministicFakeEmbedding(size=768)
+    else:
+        embeddings = cached_embeddings(GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
 
-loader = WebBaseLoader(links, bs_kwargs = dict(parse_only= bs4.SoupStrainer(
-    class_ = ("site-content")
-)))
-data = loader.load()
-print("--DATA LOADED--")
-print(len(data))
+    links = collect_links(args.book_url)
+    print("--LINKS COLLECTED--")
+    print(len(links))
 
+    ingestion = IncrementalIngestion(
+        embeddings,
+        args.data_dir,
+        checkpoint_every=args.checkpoint_every,
+        fetch_concurrency=args.concurrency,
+        embedding_stage=EmbeddingStage(embeddings, max_tokens=args.batch_tokens, max_in_flight=args.max_in_flight),
+        export_store=not args.no_mmap_store,
+        preprocessor=Preprocessor() if PREPROCESS_ENABLED and not args.no_preprocess else None,
+        index_kind=args.index,
+    )
+    stats = ingestion.run(links)
+    print("--DATA SAVED--")
+    print(stats)
 
-splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=400, chunk_overlap=0)
-docs = splitter.split_documents(data)
-print("--DOCUMENTS SPLIT--")
-print(len(docs))
-print(docs[0])
 
-db = FAISS.from_documents(documents=docs, embedding=embeddings)
-print("--VECTOR STORE CREATED--")
-db.save_local("data")
-print("--DATA SAVED--")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
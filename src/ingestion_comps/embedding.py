@@ -0,0 +1,84 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+
+import tiktoken
+
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "20000"))
+# batchEmbedContents accepts at most 100 texts per request.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_MAX_IN_FLIGHT = int(os.getenv("EMBED_MAX_IN_FLIGHT", "4"))
+
+
+@lru_cache(maxsize=None)
+def _encoding():
+    # Same encoding the chunk splitter measures chunk_size with.
+    return tiktoken.get_encoding("gpt2")
+
+
+def count_tokens(text):
+    return len(_encoding().encode(text))
+
+
+def batch_by_tokens(chunks, max_tokens=EMBED_BATCH_TOKENS, max_size=EMBED_BATCH_SIZE, length_function=count_tokens):
+    """Group chunk positions into batches of at most ``max_tokens`` tokens and ``max_size`` chunks."""
+    batch = []
+    batch_tokens = 0
+    for i, chunk in enumerate(chunks):
+        tokens = length_function(chunk.page_content)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_size):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+class EmbeddingStage:
+    """Embeds chunks in token-budgeted batches with a bounded number of requests in flight.
+
+    ``run`` yields ``(positions, vectors)`` as each batch finishes, so the caller
+    can add vectors to the index incrementally instead of waiting for the whole set.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        max_tokens=EMBED_BATCH_TOKENS,
+        max_batch_size=EMBED_BATCH_SIZE,
+        max_in_flight=EMBED_MAX_IN_FLIGHT,
+        length_function=count_tokens,
+    ):
+        self.embeddings = embeddings
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self.length_function = length_function
+
+    def run(self, chunks):
+        batches = iter(batch_by_tokens(chunks, self.max_tokens, self.max_batch_size, self.length_function))
+        done_chunks = 0
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            in_flight = {}
+
+            def submit():
+                batch = next(batches, None)
+                if batch is None:
+                    return False
+                texts = [chunks[i].page_content for i in batch]
+                in_flight[pool.submit(self.embeddings.embed_documents, texts)] = batch
+                return True
+
+            while len(in_flight) < self.max_in_flight and submit():
+                pass
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch = in_flight.pop(future)
+                    vectors = future.result()
+                    done_chunks += len(batch)
+                    print(f"--EMBEDDED {done_chunks}/{len(chunks)} CHUNKS--")
+                    yield batch, vectors
+                    submit()
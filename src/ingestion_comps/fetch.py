@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import os
+import queue
+import random
+import threading
+
+import aiohttp
+import bs4
+import requests
+from bs4 import BeautifulSoup
+from langchain.schema import Document
+
+BOOK_URL = "https://boisestate.pressbooks.pub/arthistory/"
+CONTENT_STRAINER = bs4.SoupStrainer(class_=("site-content"))
+
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "8"))
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "3"))
+FETCH_BACKOFF = float(os.getenv("FETCH_BACKOFF", "0.5"))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "30"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# How often a blocked producer checks whether the consumer has gone away.
+PUT_POLL_SECONDS = 0.5
+
+
+class FetchResult:
+
+    def __init__(self, url, status, etag=None, last_modified=None, document=None):
+        self.url = url
+        # "ok", "not_modified" or "failed"
+        self.status = status
+        self.etag = etag
+        self.last_modified = last_modified
+        self.document = document
+
+    @property
+    def content_hash(self):
+        return hashlib.sha256(self.document.page_content.encode("utf-8")).hexdigest()
+
+
+def collect_links(url=BOOK_URL, session=None):
+    page = (session or requests).get(url)
+    page.raise_for_status()
+    soup = BeautifulSoup(page.content, "html.parser")
+
+    links = []
+    for i in soup.find_all(class_="toc__title"):
+        links.append(i.find("a").get("href"))
+    return links
+
+
+def parse_page(url, html):
+    # Same extraction as WebBaseLoader with the site-content strainer.
+    soup = BeautifulSoup(html, "html.parser", parse_only=CONTENT_STRAINER)
+    return Document(page_content=soup.get_text(), metadata={"source": url})
+
+
+def conditional_headers(entry):
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+async def _fetch_page(session, url, entry, retries, backoff):
+    loop = asyncio.get_running_loop()
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url, headers=conditional_headers(entry)) as response:
+                if response.status == 304:
+                    return FetchResult(url, "not_modified", entry.get("etag"), entry.get("last_modified"))
+                if response.status >= 400 and response.status not in RETRY_STATUSES:
+                    # A 404 or 403 will not go away on retry.
+                    print("--FETCH FAILED--", url, response.status)
+                    return FetchResult(url, "failed")
+                response.raise_for_status()
+                html = await response.read()
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+            # Parsing is CPU-bound; keep it off the event loop so other downloads progress.
+            document = await loop.run_in_executor(None, parse_page, url, html)
+            return FetchResult(url, "ok", etag, last_modified, document)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == retries:
+                print("--FETCH FAILED--", url, e)
+                return FetchResult(url, "failed")
+            await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def _put(results, item, stop):
+    """Put ``item`` on the bounded queue; gives up (returns False) once ``stop`` is set."""
+    while not stop.is_set():
+        try:
+            results.put(item, timeout=PUT_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+async def _fetch_all(urls, entries, results, stop, concurrency, retries, backoff, timeout):
+    loop = asyncio.get_running_loop()
+    pending = asyncio.Queue()
+    for url in urls:
+        pending.put_nowait(url)
+
+    async def worker(session):
+        while not pending.empty() and not stop.is_set():
+            url = pending.get_nowait()
+            result = await _fetch_page(session, url, entries.get(url, {}), retries, backoff)
+            # The results queue is bounded: if splitting/embedding falls behind,
+            # the workers stop taking new URLs until it catches up.
+            if not await loop.run_in_executor(None, _put, results, result, stop):
+                return
+
+    connector = aiohttp.TCPConnector(limit_per_host=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+
+
+def fetch_pages(
+    urls,
+    manifest,
+    concurrency=FETCH_CONCURRENCY,
+    retries=FETCH_RETRIES,
+    backoff=FETCH_BACKOFF,
+    timeout=FETCH_TIMEOUT,
+):
+    """Fetch chapter pages concurrently and yield a FetchResult as each one completes.
+
+    The downloads run on an asyncio loop in a background thread with at most
+    ``concurrency`` connections per host, so the caller can split and embed
+    pages while the rest are still in flight. Each page body is read in full
+    before it is parsed. If the caller stops iterating (a failed embedding
+    request, a ``break``), the thread finishes the downloads in flight and exits.
+    """
+    entries = {url: dict(manifest.get(url)) for url in urls}
+    results = queue.Queue(maxsize=concurrency * 2)
+    stop = threading.Event()
+    done = object()
+    errors = []
+
+    def run():
+        try:
+            asyncio.run(_fetch_all(urls, entries, results, stop, concurrency, retries, backoff, timeout))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put(results, done, stop)
+
+    worker = threading.Thread(target=run, name="fetch_pages", daemon=True)
+    worker.start()
+    try:
+        while (result := results.get()) is not done:
+            yield result
+    finally:
+        # Also runs when the generator is closed early, so the producer stops waiting on the queue.
+        stop.set()
+    worker.join()
+    if errors:
+        raise errors[0]
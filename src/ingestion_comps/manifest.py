@@ -0,0 +1,33 @@
+import json
+import os
+
+
+class Manifest:
+    """What has been ingested so far, per chapter URL.
+
+    Each entry keeps the HTTP validators (ETag / Last-Modified) used for
+    conditional requests, a hash of the extracted page text and the ids of the
+    chunks that page produced in the index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.urls = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.urls = json.load(f).get("urls", {})
+
+    def get(self, url):
+        return self.urls.get(url, {})
+
+    def update(self, url, **fields):
+        self.urls.setdefault(url, {}).update(fields)
+
+    def remove(self, url):
+        return self.urls.pop(url, None)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"urls": self.urls}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,271 @@
+import os
+import shutil
+from collections import Counter, defaultdict
+from contextlib import closing
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores import FAISS
+
+from src.ingestion_comps.embedding import EMBED_BATCH_SIZE, EMBED_MAX_IN_FLIGHT, EmbeddingStage
+from src.ingestion_comps.fetch import FETCH_CONCURRENCY, fetch_pages
+from src.ingestion_comps.manifest import Manifest
+from src.ingestion_comps.preprocess import chunk_ids, line_hashes
+from src.store_comps.ann import FAISS_INDEX
+from src.store_comps.bm25 import BM25_DIRNAME, has_bm25, write_bm25
+from src.store_comps.mmap_store import STORE_DIRNAME, export_faiss_store, store_kind
+from src.store_comps.parents import PARENTS_DIRNAME, ParentStore, has_parents, write_parents
+from src.store_comps.saved_index import finish_swap, has_saved_index, load_faiss, save_index
+
+
+def default_splitter():
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=400, chunk_overlap=0)
+
+
+class IncrementalIngestion:
+    """Brings the FAISS index in ``data_dir`` up to date with a list of chapter URLs.
+
+    Unchanged chapters (304, or same text hash) are skipped, changed chapters only
+    have their stale chunks deleted and their new chunks embedded, and chapters
+    gone from the table of contents are removed. The index and manifest are
+    saved every ``checkpoint_every`` chapters, so an interrupted run resumes from
+    the last checkpoint.
+
+    With a ``preprocessor`` (see ``preprocess.Preprocessor``) chapters are
+    stripped of boilerplate and split into parents and children; only children
+    that are not near duplicates of indexed chunks are embedded, and the parents
+    are written to ``data/parents``.
+
+    ``index_kind`` picks the index of the exported store (see ``store_comps.ann``);
+    ``index.faiss`` itself always stays exact, so chapters can be updated in place.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        data_dir="data",
+        splitter=None,
+        checkpoint_every=10,
+        fetch_concurrency=FETCH_CONCURRENCY,
+        embedding_stage=None,
+        flush_chunks=EMBED_BATCH_SIZE * EMBED_MAX_IN_FLIGHT,
+        export_store=True,
+        preprocessor=None,
+        index_kind=FAISS_INDEX,
+    ):
+        self.embeddings = embeddings
+        self.fetch_concurrency = fetch_concurrency
+        self.embedding_stage = embedding_stage or EmbeddingStage(embeddings)
+        # Chunks from several chapters are embedded together so batches stay full.
+        self.flush_chunks = flush_chunks
+        self._queued = []
+        self.data_dir = data_dir
+        self.splitter = splitter or default_splitter()
+        self.checkpoint_every = checkpoint_every
+        # Also write the memory-mapped, pickle-free copy and the BM25 index the app loads.
+        self.export_store = export_store
+        self.index_kind = index_kind
+        self.preprocessor = preprocessor
+        self.chunking = "parent_child" if preprocessor is not None else "plain"
+        self.parents = {}
+        parents_dir = os.path.join(data_dir, PARENTS_DIRNAME)
+        if preprocessor is not None and has_parents(parents_dir):
+            self.parents = {doc.id: doc for doc in ParentStore(parents_dir).documents()}
+        self._duplicates_loaded = False
+        os.makedirs(data_dir, exist_ok=True)
+        self.manifest = Manifest(os.path.join(data_dir, "manifest.json"))
+        self.db = None
+        # Completes a save a crash interrupted between moving index.faiss and index.pkl.
+        finish_swap(data_dir)
+        if has_saved_index(data_dir):
+            self.db = load_faiss(data_dir, embeddings)
+        self._legacy_ids = None
+        self._pending = 0
+        self.stats = Counter()
+
+    def _present_ids(self):
+        return set(self.db.index_to_docstore_id.values()) if self.db is not None else set()
+
+    def _ids_by_source(self, url):
+        # Indexes built before the manifest existed have random ids; find a
+        # chapter's chunks through their source metadata instead.
+        if self._legacy_ids is None:
+            self._legacy_ids = defaultdict(set)
+            if self.db is not None:
+                for doc_id in self.db.index_to_docstore_id.values():
+                    doc = self.db.docstore.search(doc_id)
+                    self._legacy_ids[doc.metadata.get("source")].add(doc_id)
+        return self._legacy_ids.get(url, set())
+
+    def _stale_ids(self, url, keep=()):
+        entry = self.manifest.get(url)
+        old_ids = set(entry["chunk_ids"]) if "chunk_ids" in entry else self._ids_by_source(url)
+        return (old_ids - set(keep)) & self._present_ids()
+
+    def _delete(self, ids):
+        if ids:
+            self.db.delete(list(ids))
+            self.stats["chunks_deleted"] += len(ids)
+
+    def _load_duplicates(self):
+        # Signatures of the chunks already in the index, computed once per run.
+        if self._duplicates_loaded:
+            return
+        self._duplicates_loaded = True
+        duplicates = self.preprocessor.duplicates
+        for doc_id in self._present_ids():
+            duplicates.add(doc_id, duplicates.signature(self.db.docstore.search(doc_id).page_content))
+
+    def _forget(self, url, ids):
+        # Drop a chapter's old chunks and parents before its new ones are deduplicated,
+        # so they are not mistaken for duplicates of their previous version.
+        if self.preprocessor is None:
+            return
+        self._load_duplicates()
+        for doc_id in ids:
+            self.preprocessor.duplicates.remove(doc_id)
+        for parent_id in self.manifest.get(url).get("parent_ids", []):
+            self.parents.pop(parent_id, None)
+
+    def _add(self, chunks, ids):
+        present = self._present_ids() | {doc_id for doc_id, _ in self._queued}
+        new = [(doc_id, chunk) for doc_id, chunk in zip(ids, chunks) if doc_id not in present]
+        self._queued.extend(new)
+        if len(self._queued) >= self.flush_chunks:
+            self.flush()
+
+    def flush(self):
+        """Embed the queued chunks and add them to the index batch by batch."""
+        if not self._queued:
+            return
+        queued, self._queued = self._queued, []
+        chunks = [chunk for _, chunk in queued]
+        for positions, vectors in self.embedding_stage.run(chunks):
+            texts = [chunks[i].page_content for i in positions]
+            metadatas = [chunks[i].metadata for i in positions]
+            ids = [queued[i][0] for i in positions]
+            if self.db is None:
+                self.db = FAISS.from_embeddings(zip(texts, vectors), self.embeddings, metadatas=metadatas, ids=ids)
+            else:
+                self.db.add_embeddings(zip(texts, vectors), metadatas=metadatas, ids=ids)
+            self.stats["chunks_added"] += len(positions)
+
+    def remove_url(self, url):
+        print("--REMOVING--", url)
+        stale = self._stale_ids(url)
+        self._forget(url, stale)
+        self._delete(stale)
+        self.manifest.remove(url)
+        self.stats["removed"] += 1
+        self._pending += 1
+
+    def process(self, result):
+        url = result.url
+        entry = self.manifest.get(url)
+        validators = {"etag": result.etag, "last_modified": result.last_modified}
+
+        if result.status == "failed":
+            # Keep whatever the index already has for this chapter; retried next run.
+            self.stats["failed"] += 1
+            return
+
+        if result.status == "not_modified" or (
+            "chunk_ids" in entry
+            and entry.get("content_hash") == result.content_hash
+            and entry.get("chunking", "plain") == self.chunking
+        ):
+            self.manifest.update(url, **validators)
+            self.stats["unchanged"] += 1
+            return
+
+        print("--INGESTING--", url)
+        parent_ids = []
+        if self.preprocessor is None:
+            chunks = self.splitter.split_documents([result.document])
+            ids = chunk_ids(url, chunks)
+        else:
+            self._forget(url, self._stale_ids(url))
+            parents, chunks = self.preprocessor.process(result.document)
+            ids = [chunk.id for chunk in chunks]
+            parent_ids = [parent.id for parent in parents]
+            self.parents.update((parent.id, parent) for parent in parents)
+        self._delete(self._stale_ids(url, keep=ids))
+        self._add(chunks, ids)
+        self.manifest.update(
+            url,
+            content_hash=result.content_hash,
+            chunk_ids=ids,
+            parent_ids=parent_ids,
+            chunking=self.chunking,
+            **validators,
+        )
+        self.stats["updated"] += 1
+        self._pending += 1
+
+    def _exports_current(self):
+        # The store and BM25 files were written from the saved index, as this run would write them.
+        store_dir = os.path.join(self.data_dir, STORE_DIRNAME)
+        bm25_dir = os.path.join(self.data_dir, BM25_DIRNAME)
+        if self.export_store:
+            return store_kind(store_dir) == self.index_kind and has_bm25(bm25_dir)
+        return not os.path.exists(store_dir) and not os.path.exists(bm25_dir)
+
+    def checkpoint(self):
+        self.flush()
+        if self._pending == 0 and self._exports_current():
+            # Nothing added or removed since the last save. Rewriting the index would
+            # change its fingerprint and empty the semantic cache for no reason.
+            self.manifest.save()
+            return
+        if self.db is not None:
+            save_index(self.db, self.data_dir)
+            store_dir = os.path.join(self.data_dir, STORE_DIRNAME)
+            bm25_dir = os.path.join(self.data_dir, BM25_DIRNAME)
+            if self.export_store:
+                documents = export_faiss_store(self.db, store_dir, self.index_kind)
+                write_bm25(documents, bm25_dir)
+            else:
+                # Old copies would shadow the index that was just saved.
+                shutil.rmtree(store_dir, ignore_errors=True)
+                shutil.rmtree(bm25_dir, ignore_errors=True)
+            parents_dir = os.path.join(self.data_dir, PARENTS_DIRNAME)
+            if self.preprocessor is not None:
+                write_parents(list(self.parents.values()), parents_dir)
+            else:
+                shutil.rmtree(parents_dir, ignore_errors=True)
+        self.manifest.save()
+        self._pending = 0
+        print("--CHECKPOINT SAVED--")
+
+    def run(self, links):
+        links = list(dict.fromkeys(links))
+
+        for url in set(self.manifest.urls) - set(links):
+            self.remove_url(url)
+
+        for url in links:
+            entry = self.manifest.get(url)
+            if entry and entry.get("chunking", "plain") != self.chunking:
+                # Chunked the other way last time: fetch it in full to split it again.
+                entry.pop("etag", None)
+                entry.pop("last_modified", None)
+
+        # Closed on the way out, so a failure part-way also stops the download thread.
+        with closing(fetch_pages(links, self.manifest, concurrency=self.fetch_concurrency)) as results:
+            if self.preprocessor is not None:
+                # Boilerplate is learned from the lines of every chapter, so all
+                # chapters are fetched before the first one is split.
+                results = list(results)
+                for result in results:
+                    if result.status == "ok":
+                        self.manifest.update(result.url, line_hashes=line_hashes(result.document.page_content))
+                self.preprocessor.fit(self.manifest.get(url).get("line_hashes", []) for url in links)
+
+            for result in results:
+                self.process(result)
+                if self._pending >= self.checkpoint_every:
+                    self.checkpoint()
+
+        self.checkpoint()
+        if self.preprocessor is not None:
+            self.stats.update(self.preprocessor.stats)
+        return dict(self.stats)
@@ -0,0 +1,223 @@
+"""Chunk preprocessing between fetching a chapter and embedding it.
+
+- Boilerplate: lines that repeat on many chapters (section labels, license
+  footers, image credits) are learned from the line hashes of every page, and
+  the attribution footer at the end of a chapter is cut off.
+- Near duplicates: child chunks whose MinHash signature over word shingles
+  matches an already indexed chunk are dropped.
+- Parent-child: each chapter is split into parent sections, and each parent into
+  small child chunks. Only children are embedded; retrieval returns the parents.
+"""
+import hashlib
+import os
+import re
+import zlib
+from collections import Counter, defaultdict
+
+import numpy as np
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+PREPROCESS_ENABLED = os.getenv("PREPROCESS", "1") == "1"
+# A line is boilerplate when it is on at least this many pages and this share of them.
+BOILERPLATE_MIN_PAGES = int(os.getenv("BOILERPLATE_MIN_PAGES", "3"))
+BOILERPLATE_MIN_SHARE = float(os.getenv("BOILERPLATE_MIN_SHARE", "0.2"))
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.85"))
+PARENT_CHUNK_TOKENS = int(os.getenv("PARENT_CHUNK_TOKENS", "1000"))
+CHILD_CHUNK_TOKENS = int(os.getenv("CHILD_CHUNK_TOKENS", "250"))
+MINHASH_PERMUTATIONS = 64
+# 16 bands of 4 rows: pairs above ~0.5 Jaccard become candidates, then the
+# signature agreement has to reach NEAR_DUPLICATE_THRESHOLD.
+MINHASH_BANDS = 16
+SHINGLE_WORDS = 5
+
+# Everything from the attribution heading to the end of the chapter is dropped.
+FOOTER_HEADING = re.compile(r"^(licen[sc](es|ing) (and|&) attributions?|cc licensed content.*)$", re.IGNORECASE)
+# Short lines that only credit an image or embed a video.
+CREDIT_LINE = re.compile(
+    r"(PD-US|some rights reserved|used with permission|courtesy( of)? the artist|^watch this video online:?$|^\[?\d+\]?\s*https?://\S+$)",
+    re.IGNORECASE,
+)
+CREDIT_MAX_CHARS = 100
+_WORD = re.compile(r"\w+")
+_PRIME = np.uint64((1 << 32) + 15)
+
+
+def chunk_ids(url, chunks):
+    # Content-derived ids: an unchanged chunk keeps its id (and its vector) when
+    # the rest of its page is edited.
+    seen = Counter()
+    ids = []
+    for chunk in chunks:
+        content_hash = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+        ids.append(hashlib.sha256(f"{url}\0{content_hash}\0{seen[content_hash]}".encode("utf-8")).hexdigest())
+        seen[content_hash] += 1
+    return ids
+
+
+def _line_hash(line):
+    return hashlib.sha1(" ".join(line.lower().split()).encode("utf-8")).hexdigest()[:12]
+
+
+def line_hashes(text):
+    """Hashes of the distinct non-empty lines of a page, kept in the manifest to learn boilerplate."""
+    return sorted({_line_hash(line) for line in text.split("\n") if line.strip()})
+
+
+def token_splitter(chunk_size):
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=chunk_size, chunk_overlap=0)
+
+
+class NearDuplicateIndex:
+    """MinHash signatures of indexed chunks, bucketed by LSH band."""
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD, permutations=MINHASH_PERMUTATIONS, bands=MINHASH_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = permutations // bands
+        # Fixed seed: signatures from different runs must be comparable.
+        rng = np.random.default_rng(0)
+        self._a = rng.integers(1, 1 << 31, permutations, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, permutations, dtype=np.uint64)
+        self.signatures = {}
+        self._buckets = defaultdict(set)
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.signatures
+
+    def signature(self, text):
+        words = _WORD.findall(text.lower())
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self._a) + self._b) % _PRIME).min(axis=0)
+
+    def _keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find(self, signature):
+        """Id of an indexed chunk that is a near duplicate of ``signature``, or None."""
+        candidates = set()
+        for key in self._keys(signature):
+            candidates |= self._buckets.get(key, set())
+        for doc_id in candidates:
+            if np.mean(self.signatures[doc_id] == signature) >= self.threshold:
+                return doc_id
+        return None
+
+    def add(self, doc_id, signature):
+        self.signatures[doc_id] = signature
+        for key in self._keys(signature):
+            self._buckets[key].add(doc_id)
+
+    def remove(self, doc_id):
+        signature = self.signatures.pop(doc_id, None)
+        if signature is not None:
+            for key in self._keys(signature):
+                self._buckets[key].discard(doc_id)
+
+
+class Preprocessor:
+    """Cleans chapters, splits them into parents and children and drops near-duplicate children.
+
+    ``fit`` has to see the line hashes of every page before ``clean`` can
+    recognise repeated lines; the statistics of what was removed are in ``stats``.
+    """
+
+    def __init__(
+        self,
+        parent_splitter=None,
+        child_splitter=None,
+        min_pages=BOILERPLATE_MIN_PAGES,
+        min_share=BOILERPLATE_MIN_SHARE,
+        duplicates=None,
+    ):
+        self.parent_splitter = parent_splitter or token_splitter(PARENT_CHUNK_TOKENS)
+        self.child_splitter = child_splitter or token_splitter(CHILD_CHUNK_TOKENS)
+        self.min_pages = min_pages
+        self.min_share = min_share
+        self.duplicates = duplicates or NearDuplicateIndex()
+        self.boilerplate = frozenset()
+        self.stats = Counter()
+
+    def fit(self, pages_line_hashes):
+        pages_line_hashes = list(pages_line_hashes)
+        counts = Counter(h for hashes in pages_line_hashes for h in set(hashes))
+        limit = max(self.min_pages, self.min_share * len(pages_line_hashes))
+        self.boilerplate = frozenset(h for h, count in counts.items() if count >= limit)
+        return self
+
+    def clean(self, document):
+        lines = document.page_content.split("\n")
+        kept = []
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            if not stripped:
+                kept.append("")
+                continue
+            if FOOTER_HEADING.match(stripped):
+                self.stats["footer_lines"] += sum(1 for rest in lines[i:] if rest.strip())
+                break
+            if _line_hash(stripped) in self.boilerplate or (
+                len(stripped) <= CREDIT_MAX_CHARS and CREDIT_LINE.search(stripped)
+            ):
+                self.stats["boilerplate_lines"] += 1
+                continue
+            kept.append(stripped)
+        text = re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
+        return Document(page_content=text, metadata=dict(document.metadata))
+
+    def split(self, document):
+        """Parents and children of a cleaned page, with content-derived ids.
+
+        Children carry their parent's id as ``parent_id`` metadata.
+        """
+        url = document.metadata["source"]
+        parents = self.parent_splitter.split_documents([document])
+        for parent, parent_id in zip(parents, chunk_ids(url, parents)):
+            parent.id = parent_id
+        children = []
+        for parent in parents:
+            for child in self.child_splitter.split_documents([parent]):
+                child.metadata["parent_id"] = parent.id
+                children.append(child)
+        for child, child_id in zip(children, chunk_ids(url, children)):
+            child.id = child_id
+        return parents, children
+
+    def deduplicate(self, children):
+        """Drop children that nearly repeat an indexed chunk; the rest join the index."""
+        kept = []
+        for child in children:
+            if child.id in self.duplicates:
+                kept.append(child)
+                continue
+            signature = self.duplicates.signature(child.page_content)
+            if self.duplicates.find(signature) is not None:
+                self.stats["near_duplicates"] += 1
+                continue
+            self.duplicates.add(child.id, signature)
+            kept.append(child)
+        return kept
+
+    def process(self, document):
+        """Clean, split and deduplicate one page; returns the parents still referenced and the kept children."""
+        parents, children = self.split(self.clean(document))
+        children = self.deduplicate(children)
+        used = {child.metadata["parent_id"] for child in children}
+        return [parent for parent in parents if parent.id in used], children
+
+    def process_pages(self, documents):
+        """Whole-corpus run: learn the boilerplate from ``documents`` and process each of them."""
+        documents = list(documents)
+        self.fit(line_hashes(doc.page_content) for doc in documents)
+        parents = []
+        children = []
+        for document in documents:
+            page_parents, page_children = self.process(document)
+            parents.extend(page_parents)
+            children.extend(page_children)
+        return parents, children
@@ -0,0 +1,130 @@
+"""Approximate FAISS indexes for the served store.
+
+Ingestion keeps the exact flat index in ``index.faiss`` (it supports deleting
+a changed chapter's vectors); the memory-mapped ``store`` copy the app searches
+can instead hold a compressed or graph index built from those vectors:
+
+- ``flat``: exact search, 4 bytes per dimension;
+- ``sq8``: 8-bit scalar quantization, a quarter of the memory, still a full scan;
+- ``hnsw``: HNSW graph over the full vectors, ~log(n) search, more memory than flat;
+- ``ivfsq8``: inverted file over ``nlist`` k-means cells with 8-bit codes; a query
+  scans ``nprobe`` cells;
+- ``ivfpq``: inverted file with 4-bit product quantization (``dim / 8`` bytes per
+  vector; the fast-scan variant is avoided because reading its vectors back
+  crashes after reloading in faiss 1.10), re-ranked by 8-bit codes: the PQ scan
+  keeps ``FAISS_REFINE_K_FACTOR * k`` candidates and ``Refine(SQ8)`` re-scores
+  them. On 768-dimension embeddings PQ alone tops out at recall@10 ~0.6-0.77
+  whatever ``nprobe`` is; with the refine stage and a factor of 4 it reaches
+  ~0.98 at ``nprobe=16``. The cost is memory: ``dim * 1.2`` bytes per vector
+  (~920 for 768 dimensions, about 0.3x flat instead of 1/20), and the SQ8 codes
+  are read into every process rather than mapped;
+
+or any ``faiss.index_factory`` string. Trained indexes learn their centroids on
+a sample of at most ``FAISS_TRAIN_SAMPLE`` vectors; later checkpoints reuse the
+trained index until the corpus has grown ``FAISS_RETRAIN_GROWTH`` times.
+"""
+import math
+import os
+
+import faiss
+import numpy as np
+
+FAISS_INDEX = os.getenv("FAISS_INDEX", "flat")
+# 0 picks about 4 * sqrt(n) inverted lists.
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "0"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_TRAIN_SAMPLE = int(os.getenv("FAISS_TRAIN_SAMPLE", "100000"))
+FAISS_RETRAIN_GROWTH = float(os.getenv("FAISS_RETRAIN_GROWTH", "2"))
+# Query-time knobs: inverted lists scanned per query, and the HNSW candidate list size.
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+# Candidates per result the ivfpq scan passes to its refine stage.
+FAISS_REFINE_K_FACTOR = float(os.getenv("FAISS_REFINE_K_FACTOR", "4"))
+# k-means wants ~39 training points per centroid.
+MIN_POINTS_PER_CENTROID = 39
+PQ_CENTROIDS = 16
+INDEX_KINDS = ("flat", "sq8", "hnsw", "ivfsq8", "ivfpq")
+
+
+def nlist_for(n, train_size, nlist=FAISS_NLIST):
+    if nlist <= 0:
+        nlist = int(4 * math.sqrt(n))
+    return max(1, min(nlist, train_size // MIN_POINTS_PER_CENTROID))
+
+
+def factory_string(kind, n, dim, train_sample=FAISS_TRAIN_SAMPLE, nlist=FAISS_NLIST, hnsw_m=FAISS_HNSW_M):
+    """The ``index_factory`` description for ``kind`` over ``n`` vectors of ``dim`` dimensions."""
+    train_size = min(n, train_sample)
+    if kind == "flat":
+        return "Flat"
+    if kind == "sq8":
+        return "SQ8"
+    if kind == "hnsw":
+        return f"HNSW{hnsw_m}"
+    if kind == "ivfsq8":
+        return f"IVF{nlist_for(n, train_size, nlist)},SQ8"
+    if kind == "ivfpq":
+        if dim % 8:
+            raise ValueError(f"ivfpq needs a dimension divisible by 8, got {dim}")
+        return f"IVF{nlist_for(n, train_size, nlist)},PQ{dim // 8}x4,Refine(SQ8)"
+    return kind
+
+
+def min_training_size(factory):
+    """Vectors needed to train ``factory`` sensibly (0 when it needs no training)."""
+    if factory.startswith("IVF"):
+        nlist = int(factory[3:].split(",")[0].split("_")[0])
+        needed = nlist * MIN_POINTS_PER_CENTROID
+        if ",PQ" in factory:
+            needed = max(needed, PQ_CENTROIDS * MIN_POINTS_PER_CENTROID)
+        return needed
+    return 0
+
+
+def configure_search(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH, k_factor=FAISS_REFINE_K_FACTOR):
+    """Apply the query-time parameters that exist on ``index``."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    concrete = faiss.downcast_index(index)
+    if hasattr(concrete, "hnsw"):
+        concrete.hnsw.efSearch = ef_search
+    if hasattr(concrete, "k_factor"):
+        concrete.k_factor = k_factor
+    return index
+
+
+def _add(index, vectors, batch_size=65536):
+    for start in range(0, len(vectors), batch_size):
+        index.add(vectors[start:start + batch_size])
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # Lets reconstruct() read stored vectors back, as the embedding relevance scorer does.
+        ivf.make_direct_map()
+
+
+def build_index(vectors, factory, metric=faiss.METRIC_L2, train_sample=FAISS_TRAIN_SAMPLE, trained=None, seed=0):
+    """Build ``factory`` over ``vectors``; ``trained`` is a previously trained index of the same factory to refill."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if trained is not None:
+        index = trained
+        index.reset()
+    else:
+        index = faiss.index_factory(vectors.shape[1], factory, metric)
+        if not index.is_trained:
+            rng = np.random.default_rng(seed)
+            sample = vectors
+            if len(vectors) > train_sample:
+                sample = vectors[np.sort(rng.choice(len(vectors), train_sample, replace=False))]
+            print(f"--TRAINING {factory} ON {len(sample)} VECTORS--")
+            index.train(sample)
+    _add(index, vectors)
+    return index
+
+
+def reconstruct_all(index):
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def index_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
@@ -0,0 +1,148 @@
+"""Precomputed BM25 inverted index stored as flat numpy arrays.
+
+A ``bm25`` directory next to the vector store holds:
+
+- ``terms.txt``: the vocabulary, one term per line, term id = line number;
+- ``postings.offsets.npy``: int64, postings of term ``t`` are ``offsets[t]:offsets[t + 1]``;
+- ``postings.rows.npy`` / ``postings.tfs.npy``: int32 row (FAISS position) and term frequency;
+- ``lengths.npy``: int32 token count per row;
+- ``manifest.json``: row count and the BM25 parameters.
+
+Rows follow the FAISS positions of the vector store built from the same chunks.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from src.store_comps.mmap_store import STORE_DIRNAME, MmapVectorStore, has_mmap_store, swap_directory
+from src.store_comps.saved_index import read_docstore
+
+BM25_DIRNAME = "bm25"
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his in is it its of on or she that the their them "
+    "they this to was were which who with what when where why how did does do".split()
+)
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    # Accents are folded so "Durer" matches "Dürer".
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [token for token in _TOKEN.findall(text) if token not in STOPWORDS]
+
+
+def write_bm25(documents, directory, k1=BM25_K1, b=BM25_B):
+    """Build the inverted index for ``documents`` (in FAISS position order) into ``directory``."""
+    vocabulary = {}
+    postings = []
+    lengths = np.zeros(len(documents), dtype=np.int32)
+    for row, doc in enumerate(documents):
+        tokens = tokenize(doc.page_content)
+        lengths[row] = len(tokens)
+        for term, tf in Counter(tokens).items():
+            term_id = vocabulary.setdefault(term, len(vocabulary))
+            if term_id == len(postings):
+                postings.append([])
+            postings[term_id].append((row, tf))
+
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(entries) for entries in postings])
+    rows = np.fromiter((row for entries in postings for row, _ in entries), dtype=np.int32, count=offsets[-1])
+    tfs = np.fromiter((tf for entries in postings for _, tf in entries), dtype=np.int32, count=offsets[-1])
+
+    tmp_dir = directory + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    with open(os.path.join(tmp_dir, "terms.txt"), "w", encoding="utf-8") as f:
+        f.write("".join(f"{term}\n" for term in vocabulary))
+    np.save(os.path.join(tmp_dir, "postings.offsets.npy"), offsets)
+    np.save(os.path.join(tmp_dir, "postings.rows.npy"), rows)
+    np.save(os.path.join(tmp_dir, "postings.tfs.npy"), tfs)
+    np.save(os.path.join(tmp_dir, "lengths.npy"), lengths)
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump({"count": len(documents), "terms": len(vocabulary), "k1": k1, "b": b}, f)
+    swap_directory(tmp_dir, directory)
+
+
+def has_bm25(directory):
+    return os.path.exists(os.path.join(directory, "manifest.json"))
+
+
+class BM25Index:
+    """Scores rows against a query with Okapi BM25 over the arrays written by ``write_bm25``."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(directory, "terms.txt"), encoding="utf-8") as f:
+            self.term_ids = {line.rstrip("\n"): i for i, line in enumerate(f)}
+        self.offsets = np.load(os.path.join(directory, "postings.offsets.npy"), mmap_mode="r")
+        self.rows = np.load(os.path.join(directory, "postings.rows.npy"), mmap_mode="r")
+        self.tfs = np.load(os.path.join(directory, "postings.tfs.npy"), mmap_mode="r")
+        lengths = np.load(os.path.join(directory, "lengths.npy"))
+        self.count = len(lengths)
+        self.k1 = self.manifest["k1"]
+        self.b = self.manifest["b"]
+        avg_length = lengths.mean() if self.count else 1.0
+        # Per-row part of the BM25 denominator, computed once.
+        self._norm = self.k1 * (1 - self.b + self.b * lengths / max(avg_length, 1e-9))
+
+    def __len__(self):
+        return self.count
+
+    def idf(self, term):
+        term_id = self.term_ids.get(term)
+        df = 0 if term_id is None else self.offsets[term_id + 1] - self.offsets[term_id]
+        return float(np.log(1 + (self.count - df + 0.5) / (df + 0.5)))
+
+    def search(self, query, k=10):
+        """Return ``(row, score)`` pairs for the ``k`` best-scoring rows, best first."""
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.rows[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log(1 + (self.count - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + self._norm[rows])
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(int(row), float(scores[row])) for row in hits]
+
+
+def _documents(data_dir):
+    store_dir = os.path.join(data_dir, STORE_DIRNAME)
+    if has_mmap_store(store_dir):
+        store = MmapVectorStore(store_dir)
+        return [store.document(row) for row in range(len(store))]
+    # Only unpickle an index.pkl you built yourself.
+    docstore, index_to_docstore_id = read_docstore(data_dir)
+    return [docstore.search(index_to_docstore_id[i]) for i in range(len(index_to_docstore_id))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the BM25 index for an existing vector store.")
+    parser.add_argument("--data-dir", default="data")
+    args = parser.parse_args()
+    directory = os.path.join(args.data_dir, BM25_DIRNAME)
+    write_bm25(_documents(args.data_dir), directory)
+    print("--BM25 INDEX WRITTEN--", directory)
+
+
+if __name__ == "__main__":
+    main()
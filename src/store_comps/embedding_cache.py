@@ -0,0 +1,181 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "1") == "1"
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./cache/embeddings")
+
+
+def text_key(kind, text):
+    # Query and document embeddings differ for the same text (task type), so the
+    # kind is part of the content address.
+    return hashlib.sha256(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Append-only, content-addressed float32 matrix on disk for one embedding model.
+
+    ``vectors.f32`` holds the rows back to back and is read through a memory map;
+    ``keys.txt`` maps each sha256 key to its row. Appends take an exclusive file
+    lock, so several processes can share one store.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.keys_path = os.path.join(directory, "keys.txt")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.dim = None
+        self.rows = {}
+        self._keys_offset = 0
+        self._mmap = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    def _read_meta(self):
+        # Another process may have created the store after this one opened it.
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+
+    def _refresh(self):
+        # Pick up rows appended by other processes since the last read.
+        self._read_meta()
+        if self.dim is None or not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path) as f:
+            f.seek(self._keys_offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                key, row = line.split()
+                self.rows[key] = int(row)
+                self._keys_offset += len(line)
+
+    def _matrix(self, min_rows):
+        if self._mmap is None or self._mmap.shape[0] < min_rows:
+            # Only complete rows that a key points at; a partly written append is ignored.
+            total = min(os.path.getsize(self.vectors_path) // (self.dim * 4), max(self.rows.values()) + 1)
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(total, self.dim))
+        return self._mmap
+
+    def get(self, keys):
+        with self._lock:
+            if any(key not in self.rows for key in keys):
+                self._refresh()
+            found = {key: self.rows[key] for key in keys if key in self.rows}
+            if not found:
+                return {}
+            matrix = self._matrix(max(found.values()) + 1)
+            found = {key: row for key, row in found.items() if row < matrix.shape[0]}
+            return {key: np.array(matrix[row]) for key, row in found.items()}
+
+    def put(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            with open(self.vectors_path, "ab") as vf, open(self.keys_path, "a") as kf:
+                fcntl.flock(vf, fcntl.LOCK_EX)
+                try:
+                    self._read_meta()
+                    if self.dim is None:
+                        self.dim = int(vectors.shape[1])
+                        with open(self.meta_path, "w") as f:
+                            json.dump({"dim": self.dim}, f)
+                    # Drop what an interrupted append left behind, so every new row
+                    # starts on a row boundary and every key line on a new line.
+                    first_row = os.fstat(vf.fileno()).st_size // (self.dim * 4)
+                    vf.truncate(first_row * self.dim * 4)
+                    _truncate_partial_line(self.keys_path, kf)
+                    vf.write(vectors.tobytes())
+                    vf.flush()
+                    kf.write("".join(f"{key} {first_row + i}\n" for i, key in enumerate(keys)))
+                    kf.flush()
+                finally:
+                    fcntl.flock(vf, fcntl.LOCK_UN)
+
+
+def _truncate_partial_line(path, f):
+    # Only read the whole file in the rare case its last line is unfinished.
+    with open(path, "rb") as reader:
+        size = reader.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        reader.seek(size - 1)
+        if reader.read(1) == b"\n":
+            return
+        reader.seek(0)
+        f.truncate(reader.read().rfind(b"\n") + 1)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(model_name, cache_dir=EMBEDDING_CACHE_DIR):
+    directory = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = EmbeddingStore(directory)
+            _stores[directory] = store
+        return store
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps any LangChain ``Embeddings`` so each (model, text) is embedded only once."""
+
+    def __init__(self, embeddings, model_name, cache_dir=EMBEDDING_CACHE_DIR):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = get_embedding_store(model_name, cache_dir)
+        # Optional hook called with (hits, misses) after every lookup.
+        self.on_lookup = None
+
+    def _lookup(self, kind, texts):
+        keys = [text_key(kind, text) for text in texts]
+        cached = self.store.get(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if self.on_lookup is not None:
+            self.on_lookup(len(keys) - len(missing), len(missing))
+        return keys, cached, missing
+
+    def _merge(self, keys, cached, missing, vectors):
+        if missing:
+            self.store.put(list(missing), vectors)
+            cached.update(zip(missing, (np.asarray(v, dtype=np.float32) for v in vectors)))
+        return [cached[key].tolist() for key in keys]
+
+    def embed_documents(self, texts):
+        keys, cached, missing = self._lookup("document", texts)
+        vectors = self.embeddings.embed_documents(list(missing.values())) if missing else []
+        return self._merge(keys, cached, missing, vectors)
+
+    def embed_query(self, text):
+        keys, cached, missing = self._lookup("query", [text])
+        vectors = [self.embeddings.embed_query(text)] if missing else []
+        return self._merge(keys, cached, missing, vectors)[0]
+
+    async def aembed_documents(self, texts):
+        keys, cached, missing = self._lookup("document", texts)
+        vectors = await self.embeddings.aembed_documents(list(missing.values())) if missing else []
+        return self._merge(keys, cached, missing, vectors)
+
+    async def aembed_query(self, text):
+        keys, cached, missing = self._lookup("query", [text])
+        vectors = [await self.embeddings.aembed_query(text)] if missing else []
+        return self._merge(keys, cached, missing, vectors)[0]
+
+
+def cached_embeddings(embeddings, model_name):
+    if not EMBEDDING_CACHE_ENABLED:
+        return embeddings
+    return CachedEmbeddings(embeddings, model_name)
@@ -0,0 +1,53 @@
+import os
+
+from langchain_core.retrievers import BaseRetriever
+
+HYBRID_RETRIEVAL_ENABLED = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "5"))
+# Candidates taken from each side before fusion.
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+HYBRID_DENSE_WEIGHT = float(os.getenv("HYBRID_DENSE_WEIGHT", "1.0"))
+HYBRID_SPARSE_WEIGHT = float(os.getenv("HYBRID_SPARSE_WEIGHT", "1.0"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+
+def document_at(vectorstore, row):
+    """The document at FAISS position ``row`` of an ``MmapVectorStore`` or LangChain ``FAISS`` store."""
+    if hasattr(vectorstore, "document"):
+        return vectorstore.document(row)
+    return vectorstore.docstore.search(vectorstore.index_to_docstore_id[row])
+
+
+def _key(doc):
+    return doc.id or doc.page_content
+
+
+def reciprocal_rank_fusion(rankings, weights, rrf_k=RRF_K):
+    """Fuse ranked document lists: each document scores ``sum(weight / (rrf_k + rank))``."""
+    scores = {}
+    docs = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc in enumerate(ranking, start=1):
+            key = _key(doc)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ordered]
+
+
+class HybridRetriever(BaseRetriever):
+    """Dense FAISS search and BM25 over the same chunks, fused by reciprocal rank fusion."""
+
+    vectorstore: object
+    bm25: object
+    k: int = RETRIEVAL_K
+    candidates: int = HYBRID_CANDIDATES
+    dense_weight: float = HYBRID_DENSE_WEIGHT
+    sparse_weight: float = HYBRID_SPARSE_WEIGHT
+    rrf_k: int = RRF_K
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        dense = self.vectorstore.similarity_search(query, k=self.candidates)
+        sparse = [document_at(self.vectorstore, row) for row, _ in self.bm25.search(query, self.candidates)]
+        fused = reciprocal_rank_fusion([dense, sparse], [self.dense_weight, self.sparse_weight], self.rrf_k)
+        return fused[:self.k]
@@ -0,0 +1,405 @@
+"""Pickle-free, memory-mapped vector store layout.
+
+A store directory holds:
+
+- ``vectors.npy``: the exact (flat) index as a raw float32 matrix, opened with
+  ``np.load(..., mmap_mode="r")`` and searched with ``faiss.knn``, so processes
+  on one box share its pages through the page cache. faiss' ``IO_FLAG_MMAP``
+  would not do that: it only maps the inverted lists of IVF indexes;
+- ``index.faiss``: an approximate index instead (see ``ann``), read with
+  ``IO_FLAG_MMAP``. IVF indexes keep their lists mapped, the others (``sq8``,
+  ``hnsw``) are read into each process;
+- ``texts.bin`` / ``texts.offsets.npy``: every chunk's text as one UTF-8 blob, row
+  ``i`` spanning ``offsets[i]:offsets[i + 1]``;
+- ``ids.bin`` / ``ids.offsets.npy``: the docstore ids, laid out the same way;
+- ``columns/``: one dictionary-encoded column per metadata key (int32 codes per
+  row, -1 when the key is missing, plus the distinct values as JSON);
+- ``manifest.json``: row count, dimension, metric, column names and the FAISS
+  index type (the exact flat index unless ``FAISS_INDEX`` says otherwise).
+
+Rows follow FAISS positions, so a search hit maps straight to its row and only
+the top-k hits are ever turned into ``Document`` objects.
+"""
+import argparse
+import copy
+import json
+import os
+import shutil
+import uuid
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_core.vectorstores import VectorStore
+
+from src.store_comps.ann import (
+    FAISS_INDEX,
+    FAISS_RETRAIN_GROWTH,
+    INDEX_KINDS,
+    build_index,
+    configure_search,
+    factory_string,
+    min_training_size,
+    reconstruct_all,
+)
+from src.store_comps.saved_index import read_docstore, read_faiss_index
+
+MMAP_STORE_ENABLED = os.getenv("MMAP_STORE", "1") == "1"
+STORE_DIRNAME = "store"
+VECTORS_FILENAME = "vectors.npy"
+FORMAT_VERSION = 2
+
+
+def swap_directory(tmp_dir, directory):
+    """Move a fully written ``tmp_dir`` into place, replacing ``directory``."""
+    old_dir = directory + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old_dir)
+    os.replace(tmp_dir, directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _write_blob(directory, name, strings):
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    with open(os.path.join(directory, f"{name}.bin"), "wb") as f:
+        for i, text in enumerate(strings):
+            data = text.encode("utf-8")
+            f.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+    np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+
+
+class _Blob:
+
+    def __init__(self, directory, name):
+        self.offsets = np.load(os.path.join(directory, f"{name}.offsets.npy"), mmap_mode="r")
+        path = os.path.join(directory, f"{name}.bin")
+        # np.memmap refuses empty files.
+        self.data = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, row):
+        return bytes(self.data[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+
+class _Column:
+
+    def __init__(self, directory, position):
+        self.codes = np.load(os.path.join(directory, "columns", f"{position}.codes.npy"), mmap_mode="r")
+        self._values_path = os.path.join(directory, "columns", f"{position}.values.json")
+        self._values = None
+
+    @property
+    def values(self):
+        if self._values is None:
+            with open(self._values_path) as f:
+                self._values = json.load(f)
+        return self._values
+
+    def get(self, row):
+        code = self.codes[row]
+        return None if code < 0 else self.values[code]
+
+    def codes_for(self, wanted):
+        wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+        return {code for code, value in enumerate(self.values) if value in wanted}
+
+
+def write_documents(directory, documents, ids):
+    """Write the texts, ids and metadata columns of ``documents``; returns the column names."""
+    os.makedirs(os.path.join(directory, "columns"))
+    _write_blob(directory, "texts", [doc.page_content for doc in documents])
+    _write_blob(directory, "ids", [str(doc_id) for doc_id in ids])
+
+    names = list(dict.fromkeys(key for doc in documents for key in doc.metadata))
+    for position, name in enumerate(names):
+        values = {}
+        codes = np.full(len(documents), -1, dtype=np.int32)
+        for row, doc in enumerate(documents):
+            if name in doc.metadata:
+                value = doc.metadata[name]
+                codes[row] = values.setdefault(json.dumps(value, sort_keys=True), len(values))
+        np.save(os.path.join(directory, "columns", f"{position}.codes.npy"), codes)
+        with open(os.path.join(directory, "columns", f"{position}.values.json"), "w") as f:
+            json.dump([json.loads(value) for value in values], f)
+    return names
+
+
+class Documents:
+    """Read side of ``write_documents``: documents by row, built on demand."""
+
+    def __init__(self, directory, columns):
+        self._texts = _Blob(directory, "texts")
+        self._ids = _Blob(directory, "ids")
+        self.columns = {name: _Column(directory, i) for i, name in enumerate(columns)}
+        self._rows = None
+
+    def __len__(self):
+        return len(self._texts)
+
+    def row_of(self, doc_id):
+        if self._rows is None:
+            self._rows = {self._ids.get(row): row for row in range(len(self._ids))}
+        return self._rows.get(doc_id)
+
+    def document(self, row):
+        metadata = {}
+        for name, column in self.columns.items():
+            value = column.get(row)
+            if value is not None:
+                metadata[name] = value
+        return Document(id=self._ids.get(row), page_content=self._texts.get(row), metadata=metadata)
+
+
+class MappedFlatIndex:
+    """Exact search over a memory-mapped ``vectors.npy``, with the parts of the faiss index API the app uses."""
+
+    def __init__(self, path, metric_type=faiss.METRIC_L2):
+        self.vectors = np.load(path, mmap_mode="r")
+        self.ntotal, self.d = self.vectors.shape
+        self.metric_type = metric_type
+
+    def search(self, x, k):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        distances = np.full((len(x), k), np.inf, dtype=np.float32)
+        labels = np.full((len(x), k), -1, dtype=np.int64)
+        found = min(k, self.ntotal)
+        if found:
+            distances[:, :found], labels[:, :found] = faiss.knn(x, self.vectors, found, self.metric_type)
+        return distances, labels
+
+    def reconstruct(self, row):
+        return np.array(self.vectors[row])
+
+    def reconstruct_batch(self, rows):
+        return np.array(self.vectors[np.asarray(rows, dtype=np.int64)])
+
+    def reconstruct_n(self, start, count):
+        return np.array(self.vectors[start:start + count])
+
+
+def _open_index(directory, manifest):
+    vectors = os.path.join(directory, VECTORS_FILENAME)
+    if os.path.exists(vectors):
+        return MappedFlatIndex(vectors, manifest.get("metric", faiss.METRIC_L2))
+    # Approximate indexes, and flat ones from stores written before vectors.npy.
+    return configure_search(
+        faiss.read_index(os.path.join(directory, "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    )
+
+
+def write_store(index, documents, ids, directory, factory="Flat", trained_on=0, kind="flat"):
+    """Write ``documents`` (in FAISS position order) and ``index`` to ``directory``.
+
+    The store is built next to ``directory`` and swapped in, so readers never see
+    a half-written one.
+    """
+    tmp_dir = directory + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    if factory == "Flat":
+        np.save(os.path.join(tmp_dir, VECTORS_FILENAME), np.ascontiguousarray(reconstruct_all(index), dtype=np.float32))
+    else:
+        faiss.write_index(index, os.path.join(tmp_dir, "index.faiss"))
+    names = write_documents(tmp_dir, documents, ids)
+
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(
+            {
+                "version": FORMAT_VERSION,
+                "count": len(documents),
+                "dim": index.d,
+                "metric": int(index.metric_type),
+                "columns": names,
+                "index": factory,
+                "kind": kind,
+                "trained_on": trained_on,
+            },
+            f,
+        )
+
+    swap_directory(tmp_dir, directory)
+
+
+def _served_index(directory):
+    """Factory and training size of the index in an existing store."""
+    if not has_mmap_store(directory):
+        return "Flat", 0
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    return manifest.get("index", "Flat"), manifest.get("trained_on", 0)
+
+
+def store_kind(directory):
+    """Index kind an existing store was exported as, or None (no store, or written before kinds were recorded)."""
+    if not has_mmap_store(directory):
+        return None
+    with open(os.path.join(directory, "manifest.json")) as f:
+        return json.load(f).get("kind")
+
+
+def approximate_index(index, directory, kind=FAISS_INDEX):
+    """``(index, factory, trained_on)`` to serve in place of the exact ``index``, built as ``kind``."""
+    if index.ntotal == 0 or kind == "flat":
+        return index, "Flat", 0
+    previous, trained_on = _served_index(directory)
+    trained = None
+    if (
+        trained_on
+        and previous == factory_string(kind, trained_on, index.d)
+        and trained_on * FAISS_RETRAIN_GROWTH >= index.ntotal
+    ):
+        # Same kind, trained on a corpus not much smaller: refill it instead of retraining.
+        factory = previous
+        trained = faiss.read_index(os.path.join(directory, "index.faiss"))
+    else:
+        factory = factory_string(kind, index.ntotal, index.d)
+        trained_on = index.ntotal
+        if index.ntotal < min_training_size(factory):
+            print(f"--TOO FEW VECTORS ({index.ntotal}) TO TRAIN {factory}, KEEPING THE FLAT INDEX--")
+            return index, "Flat", 0
+    return build_index(reconstruct_all(index), factory, index.metric_type, trained=trained), factory, trained_on
+
+
+def export_faiss_store(db, directory, index_kind=FAISS_INDEX):
+    """Write a LangChain ``FAISS`` vector store out in the memory-mapped layout.
+
+    With ``index_kind`` other than "flat" the store gets an approximate index
+    built from the exact one (see ``ann``). Returns the documents in FAISS
+    position order.
+    """
+    positions = range(db.index.ntotal)
+    ids = [db.index_to_docstore_id[i] for i in positions]
+    documents = [db.docstore.search(doc_id) for doc_id in ids]
+    index, factory, trained_on = approximate_index(db.index, directory, index_kind)
+    write_store(index, documents, ids, directory, factory, trained_on, index_kind)
+    return documents
+
+
+def convert_pickle_store(data_dir, directory=None, index_kind=FAISS_INDEX):
+    """Convert ``index.faiss`` + ``index.pkl`` saved by ``FAISS.save_local``.
+
+    Unpickles ``index.pkl``, so only run it on files you built yourself.
+    """
+    directory = directory or os.path.join(data_dir, STORE_DIRNAME)
+    index = read_faiss_index(data_dir)
+    docstore, index_to_docstore_id = read_docstore(data_dir)
+    ids = [index_to_docstore_id[i] for i in range(index.ntotal)]
+    index, factory, trained_on = approximate_index(index, directory, index_kind)
+    write_store(index, [docstore.search(doc_id) for doc_id in ids], ids, directory, factory, trained_on, index_kind)
+    return directory
+
+
+def has_mmap_store(directory):
+    return os.path.exists(os.path.join(directory, "manifest.json"))
+
+
+class MmapVectorStore(VectorStore):
+    """Read-only vector store over the memory-mapped layout written by ``write_store``."""
+
+    def __init__(self, directory, embeddings=None):
+        self.directory = directory
+        self.embedding_function = embeddings
+        with open(os.path.join(directory, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.index = _open_index(directory, self.manifest)
+        self._documents = Documents(directory, self.manifest["columns"])
+        self._columns = self._documents.columns
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def with_embeddings(self, embeddings):
+        """A view sharing this store's mapped files that embeds queries with ``embeddings``."""
+        view = copy.copy(self)
+        view.embedding_function = embeddings
+        return view
+
+    def __len__(self):
+        return len(self._documents)
+
+    def row_of(self, doc_id):
+        """FAISS position of a docstore id, or None."""
+        return self._documents.row_of(doc_id)
+
+    def document(self, row):
+        return self._documents.document(row)
+
+    def _matching_rows(self, rows, filter):
+        keep = np.ones(len(rows), dtype=bool)
+        for name, wanted in filter.items():
+            column = self._columns.get(name)
+            if column is None:
+                return []
+            keep &= np.isin(column.codes[rows], list(column.codes_for(wanted)))
+        return [row for row, ok in zip(rows, keep) if ok]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, fetch_k=20, **kwargs):
+        query = np.asarray([embedding], dtype=np.float32)
+        distances, rows = self.index.search(query, max(k, fetch_k) if filter else k)
+        scores = {int(row): float(distance) for row, distance in zip(rows[0], distances[0]) if row != -1}
+        hits = list(scores)
+        if filter:
+            hits = self._matching_rows(np.array(hits, dtype=np.int64), filter)
+        return [(self.document(row), scores[row]) for row in hits[:k]]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, fetch_k=20, **kwargs):
+        embedding = self.embedding_function.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k, filter=filter, fetch_k=fetch_k)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, fetch_k=20, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter, fetch_k)]
+
+    def similarity_search(self, query, k=4, filter=None, fetch_k=20, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter, fetch_k)]
+
+    def _select_relevance_score_fn(self):
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return self._max_inner_product_relevance_score_fn
+        return self._euclidean_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, directory=None, index_kind="flat", **kwargs):
+        """Embed ``texts``, write them to ``directory`` in this layout and open the result.
+
+        Like ``FAISS.from_texts`` (L2 distance, random ids by default); the store is
+        read-only afterwards, so rebuilding means writing a new directory.
+        """
+        if directory is None:
+            raise ValueError("MmapVectorStore.from_texts needs the directory= to write the store to.")
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+        index = faiss.IndexFlatL2(vectors.shape[1])
+        index.add(vectors)
+        documents = [
+            Document(id=doc_id, page_content=text, metadata=dict(metadata))
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        index, factory, trained_on = approximate_index(index, directory, index_kind)
+        write_store(index, documents, ids, directory, factory, trained_on, index_kind)
+        return cls(directory, embedding)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a FAISS.save_local directory to the memory-mapped store.")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--out", help=f"Output directory (default: <data-dir>/{STORE_DIRNAME}).")
+    parser.add_argument(
+        "--index",
+        default=FAISS_INDEX,
+        help=f"Index to serve: one of {', '.join(INDEX_KINDS)} or a faiss.index_factory string.",
+    )
+    args = parser.parse_args()
+    directory = convert_pickle_store(args.data_dir, args.out, args.index)
+    print("--STORE WRITTEN--", directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Retrieval for several rewrites of one question at once.
+
+Each rewrite is embedded as a query (concurrently in the async path) and the
+vectors are stacked and searched with a single FAISS ``search``. Each rewrite's dense hits are fused
+with its BM25 hits as in ``HybridRetriever``; the per-rewrite rankings are then
+fused again, so a chunk found by several rewrites appears once and ranks higher.
+"""
+import asyncio
+import os
+
+import faiss
+import numpy as np
+
+from src.store_comps.hybrid import (
+    HYBRID_CANDIDATES,
+    HYBRID_DENSE_WEIGHT,
+    HYBRID_SPARSE_WEIGHT,
+    RRF_K,
+    document_at,
+    reciprocal_rank_fusion,
+)
+from src.store_comps.parents import expand_to_parents
+
+# Candidates handed to grading after merging every rewrite's hits.
+MULTI_QUERY_K = int(os.getenv("MULTI_QUERY_K", "8"))
+
+
+def search_many(vectorstore, vectors, k):
+    """One FAISS search for every row of ``vectors``; a ranked document list per row."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if getattr(vectorstore, "_normalize_L2", False):
+        faiss.normalize_L2(matrix)
+    _, rows = vectorstore.index.search(matrix, k)
+    return [[document_at(vectorstore, int(row)) for row in hits if row != -1] for hits in rows]
+
+
+class MultiQueryRetriever:
+    """Merged, deduplicated candidates for a list of queries, from one batched search."""
+
+    def __init__(self, vectorstore, bm25=None, parents=None, k=MULTI_QUERY_K, candidates=HYBRID_CANDIDATES):
+        self.vectorstore = vectorstore
+        self.bm25 = bm25
+        self.parents = parents
+        self.k = k
+        self.candidates = candidates
+
+    def _merge(self, queries, vectors):
+        rankings = search_many(self.vectorstore, vectors, self.candidates)
+        if self.bm25 is not None:
+            rankings = [
+                reciprocal_rank_fusion(
+                    [dense, [document_at(self.vectorstore, row) for row, _ in self.bm25.search(query, self.candidates)]],
+                    [HYBRID_DENSE_WEIGHT, HYBRID_SPARSE_WEIGHT],
+                    RRF_K,
+                )
+                for query, dense in zip(queries, rankings)
+            ]
+        merged = reciprocal_rank_fusion(rankings, [1.0] * len(rankings), RRF_K)
+        if self.parents is not None:
+            return expand_to_parents(merged, self.parents, self.k)
+        return merged[:self.k]
+
+    def invoke(self, queries):
+        if not queries:
+            return []
+        embeddings = self.vectorstore.embeddings
+        return self._merge(queries, [embeddings.embed_query(query) for query in queries])
+
+    async def ainvoke(self, queries):
+        if not queries:
+            return []
+        embeddings = self.vectorstore.embeddings
+        vectors = await asyncio.gather(*(embeddings.aembed_query(query) for query in queries))
+        return await asyncio.to_thread(self._merge, queries, vectors)
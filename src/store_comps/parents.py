@@ -0,0 +1,86 @@
+"""Parent sections for parent-child retrieval.
+
+Ingestion embeds small child chunks, each with a ``parent_id`` in its metadata,
+and writes the larger parent sections they were cut from to a ``parents``
+directory next to the vector store (same texts / ids / columns layout as the
+memory-mapped store, without an index). Retrieval matches children and hands
+their parents to grading and generation.
+"""
+import json
+import os
+import shutil
+
+from langchain_core.retrievers import BaseRetriever
+
+from src.store_comps.mmap_store import Documents, swap_directory, write_documents
+
+PARENTS_DIRNAME = "parents"
+PARENT_RETRIEVAL_K = int(os.getenv("PARENT_RETRIEVAL_K", "3"))
+
+
+def write_parents(documents, directory):
+    tmp_dir = directory + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    names = write_documents(tmp_dir, documents, [doc.id for doc in documents])
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump({"count": len(documents), "columns": names}, f)
+    swap_directory(tmp_dir, directory)
+
+
+def has_parents(directory):
+    return os.path.exists(os.path.join(directory, "manifest.json"))
+
+
+class ParentStore:
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self._documents = Documents(directory, self.manifest["columns"])
+
+    def __len__(self):
+        return len(self._documents)
+
+    def documents(self):
+        return [self._documents.document(row) for row in range(len(self._documents))]
+
+    def get(self, parent_id):
+        row = self._documents.row_of(parent_id)
+        return None if row is None else self._documents.document(row)
+
+
+def expand_to_parents(children, parents, k=PARENT_RETRIEVAL_K):
+    """Replace each child by its parent, keeping the first occurrence of each parent.
+
+    The parent remembers the best-ranked child it was reached through as
+    ``child_id``, so its stored vector can still be used for scoring.
+    """
+    expanded = []
+    seen = set()
+    for child in children:
+        parent_id = child.metadata.get("parent_id")
+        parent = parents.get(parent_id) if parent_id else None
+        if parent is None:
+            if child.id not in seen:
+                seen.add(child.id)
+                expanded.append(child)
+        elif parent_id not in seen:
+            seen.add(parent_id)
+            parent.metadata["child_id"] = child.id
+            expanded.append(parent)
+        if len(expanded) == k:
+            break
+    return expanded
+
+
+class ParentRetriever(BaseRetriever):
+    """Runs ``retriever`` over the child chunks and returns up to ``k`` distinct parents."""
+
+    retriever: object
+    parents: object
+    k: int = PARENT_RETRIEVAL_K
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        children = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return expand_to_parents(children, self.parents, self.k)
@@ -0,0 +1,78 @@
+"""Crash-safe ``index.faiss`` + ``index.pkl`` pair written by ``FAISS.save_local``.
+
+A save writes both files to ``.tmp_index`` and marks the directory complete
+with a ``READY`` file before moving them over the live ones. Two renames are
+not atomic together, so while ``READY`` exists the complete pair is made of
+the files still in ``.tmp_index`` plus the ones already moved: readers resolve
+each file that way, and the next save (or ``IncrementalIngestion``) finishes
+a swap a crash interrupted. A ``.tmp_index`` without ``READY`` is a save that
+never completed; the live pair is untouched and it is discarded.
+
+Unpickles ``index.pkl``, so only load files you built yourself.
+"""
+import os
+import pickle
+import shutil
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+TMP_DIRNAME = ".tmp_index"
+READY = "READY"
+INDEX_FILES = ("index.faiss", "index.pkl")
+
+
+def has_saved_index(data_dir):
+    return os.path.exists(os.path.join(data_dir, "index.faiss")) or os.path.exists(
+        os.path.join(data_dir, TMP_DIRNAME, READY)
+    )
+
+
+def finish_swap(data_dir):
+    """Move a completed save into place, or drop an incomplete one."""
+    tmp_dir = os.path.join(data_dir, TMP_DIRNAME)
+    if not os.path.exists(os.path.join(tmp_dir, READY)):
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+    for name in INDEX_FILES:
+        path = os.path.join(tmp_dir, name)
+        if os.path.exists(path):
+            os.replace(path, os.path.join(data_dir, name))
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def save_index(db, data_dir):
+    finish_swap(data_dir)
+    tmp_dir = os.path.join(data_dir, TMP_DIRNAME)
+    db.save_local(tmp_dir)
+    open(os.path.join(tmp_dir, READY), "w").close()
+    finish_swap(data_dir)
+
+
+def _read(data_dir, name):
+    tmp_dir = os.path.join(data_dir, TMP_DIRNAME)
+    if os.path.exists(os.path.join(tmp_dir, READY)):
+        try:
+            with open(os.path.join(tmp_dir, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Already moved by the writer: the live file is the new one.
+            pass
+    with open(os.path.join(data_dir, name), "rb") as f:
+        return f.read()
+
+
+def read_faiss_index(data_dir):
+    return faiss.deserialize_index(np.frombuffer(_read(data_dir, "index.faiss"), dtype=np.uint8))
+
+
+def read_docstore(data_dir):
+    """``(docstore, index_to_docstore_id)`` of the saved index."""
+    return pickle.loads(_read(data_dir, "index.pkl"))
+
+
+def load_faiss(data_dir, embeddings):
+    """``FAISS.load_local`` of the current complete pair."""
+    docstore, index_to_docstore_id = read_docstore(data_dir)
+    return FAISS(embeddings, read_faiss_index(data_dir), docstore, index_to_docstore_id)
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from src.agent_comps.api import AdmissionController, Overloaded  # noqa: E402
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_one_key_cannot_take_more_than_its_share():
+    async def scenario():
+        admission = AdmissionController(max_running=4, max_queued=4, queue_timeout=1, per_key=2)
+        tickets = [await admission.admit("a"), await admission.admit("a")]
+
+        with pytest.raises(Overloaded) as rejected:
+            await admission.admit("a")
+        assert rejected.value.status == 429
+        # Other keys still get in.
+        tickets.append(await admission.admit("b"))
+
+        tickets[0].release()
+        tickets[0].release()
+        tickets.append(await admission.admit("a"))
+        assert admission.running == 3
+        assert admission.rejected["key_limit"] == 1
+
+    run(scenario())
+
+
+def test_full_queue_answers_503():
+    async def scenario():
+        admission = AdmissionController(max_running=1, max_queued=1, queue_timeout=1, per_key=5)
+        running = await admission.admit("a")
+        queued = asyncio.create_task(admission.admit("b"))
+        await asyncio.sleep(0)
+        assert admission.waiting == 1
+
+        with pytest.raises(Overloaded) as rejected:
+            await admission.admit("c")
+        assert rejected.value.status == 503
+        assert admission.rejected["queue_full"] == 1
+
+        running.release()
+        (await queued).release()
+        assert admission.running == admission.waiting == 0
+
+    run(scenario())
+
+
+def test_queue_timeout_frees_the_key():
+    async def scenario():
+        admission = AdmissionController(max_running=1, max_queued=2, queue_timeout=0.01, per_key=1)
+        running = await admission.admit("a")
+
+        with pytest.raises(Overloaded) as rejected:
+            await admission.admit("b")
+        assert rejected.value.status == 503
+        assert admission.rejected["queue_timeout"] == 1
+
+        running.release()
+        # "b" timed out while waiting, so its per-key slot was given back.
+        (await admission.admit("b")).release()
+
+    run(scenario())
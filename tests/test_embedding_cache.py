@@ -0,0 +1,56 @@
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from src.store_comps.embedding_cache import CachedEmbeddings, EmbeddingStore
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.calls += 1
+        return super().embed_query(text)
+
+
+def test_rows_written_by_another_instance_are_read(tmp_path):
+    # Both opened before meta.json exists, like API workers starting on an empty cache.
+    reader = EmbeddingStore(str(tmp_path))
+    writer = EmbeddingStore(str(tmp_path))
+
+    writer.put(["a", "b"], np.array([[1, 2, 3], [4, 5, 6]]))
+
+    found = reader.get(["a", "b", "c"])
+    assert set(found) == {"a", "b"}
+    np.testing.assert_array_equal(found["b"], [4, 5, 6])
+
+
+def test_interrupted_append_does_not_shift_later_rows(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put(["a"], np.array([[1, 2, 3]]))
+    # A writer died halfway through a row and a key line.
+    with open(store.vectors_path, "ab") as f:
+        f.write(b"\0" * 5)
+    with open(store.keys_path, "a") as f:
+        f.write("half")
+
+    store.put(["b"], np.array([[7, 8, 9]]))
+
+    found = EmbeddingStore(str(tmp_path)).get(["a", "b"])
+    np.testing.assert_array_equal(found["a"], [1, 2, 3])
+    np.testing.assert_array_equal(found["b"], [7, 8, 9])
+
+
+def test_cached_embeddings_embed_each_text_once_per_kind(tmp_path):
+    inner = CountingEmbeddings(size=8)
+    embeddings = CachedEmbeddings(inner, "fake", cache_dir=str(tmp_path))
+
+    first = embeddings.embed_documents(["monet", "manet", "monet"])
+    again = CachedEmbeddings(CountingEmbeddings(size=8), "fake", cache_dir=str(tmp_path)).embed_documents(["manet"])
+    embeddings.embed_query("monet")
+
+    assert inner.calls == 3
+    assert again == [first[1]]
@@ -0,0 +1,65 @@
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage
+
+from src.agent_comps.history import MESSAGE_OVERHEAD_TOKENS, ConversationHistory, remove_messages
+
+
+def conversation(turns, length=16):
+    messages = []
+    for i in range(turns):
+        messages.append(HumanMessage(content=f"q{i}".ljust(length, "."), id=f"h{i}"))
+        messages.append(AIMessage(content=f"a{i}".ljust(length, "."), id=f"a{i}"))
+    return messages
+
+
+def history(budget):
+    # One token per character keeps the arithmetic visible: a message costs 16 + 4.
+    return ConversationHistory(budget=budget, keep_ratio=0.5, length_function=len)
+
+
+def test_window_keeps_the_newest_messages_that_fit():
+    messages = conversation(5)
+
+    window = history(budget=70).window(messages)
+
+    assert len(window) * (16 + MESSAGE_OVERHEAD_TOKENS) <= 70
+    assert window == messages[-3:]
+
+
+def test_window_always_keeps_the_newest_message():
+    messages = conversation(2, length=500)
+
+    assert history(budget=10).window(messages) == messages[-1:]
+
+
+def test_summary_split_leaves_keep_ratio_of_the_budget():
+    messages = conversation(5)
+    conversation_history = history(budget=120)
+
+    assert conversation_history.needs_summary(messages)
+    older = conversation_history.to_summarize(messages)
+
+    # 10 messages of 20 tokens; 60 of the 120-token budget keeps the newest 3.
+    assert older == messages[:7]
+    assert not conversation_history.needs_summary(messages[7:])
+
+
+def test_short_history_needs_no_summary():
+    messages = conversation(2)
+
+    assert not history(budget=120).needs_summary(messages)
+
+
+def test_render_puts_the_summary_before_the_window():
+    messages = conversation(5)
+
+    text = history(budget=45).render(messages, summary="They talked about Giotto.")
+
+    assert text.startswith("Summary of the earlier conversation: They talked about Giotto.\n")
+    assert "q4" in text and "a4" in text and "q3" not in text
+
+
+def test_remove_messages_targets_ids():
+    removals = remove_messages(conversation(1))
+
+    assert all(isinstance(removal, RemoveMessage) for removal in removals)
+    assert [removal.id for removal in removals] == ["h0", "a0"]
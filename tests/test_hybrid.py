@@ -0,0 +1,45 @@
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+
+from src.agent_comps.fakes import FakeEmbeddings
+from src.store_comps.bm25 import BM25Index, write_bm25
+from src.store_comps.hybrid import HybridRetriever, document_at, reciprocal_rank_fusion
+
+FILLER = [f"painting number {i} of the museum collection" for i in range(20)]
+QUERY = "Leonardo sfumato"
+# Only the dense side finds the first (same text as the query), only BM25 ranks the second high.
+DENSE_HIT = "Leonardo sfumato"
+KEYWORD_HIT = "sfumato sfumato sfumato: soft transitions between tones"
+
+
+def doc(text, doc_id):
+    return Document(page_content=text, id=doc_id)
+
+
+def test_documents_in_both_rankings_win():
+    a, b, c, d = (doc(name, name) for name in "abcd")
+
+    fused = reciprocal_rank_fusion([[a, b, c], [d, c, a]], [1.0, 1.0])
+
+    assert fused[:2] == [a, c]
+    assert fused[2:] == [d, b]
+
+
+def test_weights_shift_the_order():
+    a, b = doc("a", "a"), doc("b", "b")
+
+    assert reciprocal_rank_fusion([[a], [b]], [1.0, 2.0]) == [b, a]
+    assert reciprocal_rank_fusion([[a], [b]], [2.0, 1.0]) == [a, b]
+
+
+def test_hybrid_retriever_fuses_dense_and_bm25_hits(tmp_path):
+    texts = FILLER + [DENSE_HIT, KEYWORD_HIT]
+    store = FAISS.from_texts(texts, FakeEmbeddings(size=32), ids=[str(i) for i in range(len(texts))])
+    write_bm25([document_at(store, row) for row in range(len(texts))], str(tmp_path / "bm25"))
+    bm25 = BM25Index(str(tmp_path / "bm25"))
+
+    dense_only = store.similarity_search(QUERY, k=2)
+    hybrid = HybridRetriever(vectorstore=store, bm25=bm25, k=2, candidates=len(texts)).invoke(QUERY)
+
+    assert dense_only[0].page_content == DENSE_HIT
+    assert [d.page_content for d in hybrid] == [DENSE_HIT, KEYWORD_HIT]
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+
+import pytest
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+
+from benchmarks.pressbook_server import serve
+from src.ingestion_comps.embedding import EmbeddingStage
+from src.ingestion_comps.fetch import collect_links, fetch_pages
+from src.ingestion_comps.manifest import Manifest
+from src.ingestion_comps.pipeline import IncrementalIngestion
+from src.store_comps.bm25 import BM25_DIRNAME, BM25Index
+from src.store_comps.mmap_store import STORE_DIRNAME, MmapVectorStore
+
+CHAPTERS = 6
+
+
+class CountingEmbeddings(Embeddings):
+    """Deterministic fake embeddings that count texts embedded and can fail on a given call."""
+
+    def __init__(self, fail_on_call=None):
+        self.inner = DeterministicFakeEmbedding(size=32)
+        self.calls = 0
+        self.texts = 0
+        self.fail_on_call = fail_on_call
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise RuntimeError("embedding request failed")
+        self.texts += len(texts)
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.inner.embed_query(text)
+
+
+@pytest.fixture
+def book():
+    """Starts the stand-in site; calling it again restarts it on the same port with other pages."""
+    servers = []
+
+    def start(**site_kwargs):
+        port = 0
+        if servers:
+            port = servers[-1].server_address[1]
+            servers[-1].shutdown()
+            servers[-1].server_close()
+        server, url = serve(port, paragraphs=4, **site_kwargs)
+        servers.append(server)
+        return collect_links(url)
+
+    yield start
+    servers[-1].shutdown()
+    servers[-1].server_close()
+
+
+def ingest(data_dir, links, embeddings, checkpoint_every=10):
+    ingestion = IncrementalIngestion(
+        embeddings,
+        str(data_dir),
+        splitter=RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=0),
+        checkpoint_every=checkpoint_every,
+        fetch_concurrency=2,
+        # One chapter per embedding request, so a failure lands between checkpoints.
+        embedding_stage=EmbeddingStage(embeddings, max_tokens=4000, max_in_flight=1, length_function=len),
+        flush_chunks=1,
+    )
+    return ingestion.run(links)
+
+
+def saved_ids(data_dir):
+    """Chunk ids in the manifest, after checking the index, store and BM25 files all hold them."""
+    manifest = Manifest(os.path.join(data_dir, "manifest.json"))
+    ids = {doc_id for entry in manifest.urls.values() for doc_id in entry["chunk_ids"]}
+    db = FAISS.load_local(str(data_dir), DeterministicFakeEmbedding(size=32), allow_dangerous_deserialization=True)
+    assert set(db.index_to_docstore_id.values()) == ids
+    assert db.index.ntotal == len(ids)
+    store = MmapVectorStore(os.path.join(data_dir, STORE_DIRNAME))
+    assert store.index.ntotal == store.manifest["count"] == len(store) == len(ids)
+    assert len(BM25Index(os.path.join(data_dir, BM25_DIRNAME))) == len(ids)
+    return ids
+
+
+def sources(data_dir):
+    store = MmapVectorStore(os.path.join(data_dir, STORE_DIRNAME))
+    return {store.document(row).metadata["source"] for row in range(store.index.ntotal)}
+
+
+def test_first_run_indexes_every_chapter(tmp_path, book):
+    links = book(chapters=CHAPTERS)
+    embeddings = CountingEmbeddings()
+
+    stats = ingest(tmp_path, links, embeddings)
+
+    assert stats["updated"] == CHAPTERS
+    ids = saved_ids(tmp_path)
+    assert embeddings.texts == stats["chunks_added"] == len(ids)
+    assert sources(tmp_path) == set(links)
+
+
+def test_unchanged_rerun_embeds_nothing_and_keeps_the_index(tmp_path, book):
+    links = book(chapters=CHAPTERS)
+    ingest(tmp_path, links, CountingEmbeddings())
+    ids = saved_ids(tmp_path)
+    index_mtime = os.stat(tmp_path / "index.faiss").st_mtime_ns
+    store_mtime = os.stat(tmp_path / STORE_DIRNAME / "manifest.json").st_mtime_ns
+
+    embeddings = CountingEmbeddings()
+    stats = ingest(tmp_path, links, embeddings)
+
+    assert embeddings.calls == 0
+    assert stats["unchanged"] == CHAPTERS
+    assert saved_ids(tmp_path) == ids
+    assert os.stat(tmp_path / "index.faiss").st_mtime_ns == index_mtime
+    assert os.stat(tmp_path / STORE_DIRNAME / "manifest.json").st_mtime_ns == store_mtime
+
+
+def test_changed_and_removed_chapters(tmp_path, book):
+    links = book(chapters=CHAPTERS)
+    ingest(tmp_path, links, CountingEmbeddings())
+    before = saved_ids(tmp_path)
+
+    # The first two chapters gain a paragraph and the last one leaves the table of contents.
+    new_links = book(chapters=CHAPTERS - 1, changed=2, revision=1)
+    embeddings = CountingEmbeddings()
+    stats = ingest(tmp_path, new_links, embeddings)
+
+    assert stats["updated"] == 2
+    assert stats["removed"] == 1
+    assert stats["unchanged"] == CHAPTERS - 3
+    after = saved_ids(tmp_path)
+    assert embeddings.texts == stats["chunks_added"] == len(after - before)
+    assert stats["chunks_deleted"] == len(before - after)
+    assert sources(tmp_path) == set(new_links)
+    assert links[-1] not in Manifest(os.path.join(tmp_path, "manifest.json")).urls
+
+
+def test_resume_after_failure_between_checkpoints(tmp_path, book):
+    links = book(chapters=CHAPTERS)
+    reference = tmp_path / "reference"
+    ingest(reference, links, CountingEmbeddings())
+    expected = saved_ids(reference)
+
+    data_dir = tmp_path / "data"
+    with pytest.raises(RuntimeError):
+        # The first checkpoint (two chapters) is saved, the next batch fails.
+        ingest(data_dir, links, CountingEmbeddings(fail_on_call=3), checkpoint_every=2)
+    checkpointed = saved_ids(data_dir)
+    assert 0 < len(checkpointed) < len(expected)
+
+    embeddings = CountingEmbeddings()
+    stats = ingest(data_dir, links, embeddings, checkpoint_every=2)
+
+    assert stats["unchanged"] == 2
+    assert stats["updated"] == CHAPTERS - 2
+    assert embeddings.texts == len(expected - checkpointed)
+    assert saved_ids(data_dir) == expected
+
+
+def test_closing_the_fetch_early_stops_the_download_thread(tmp_path, book):
+    links = book(chapters=20)
+    before = set(threading.enumerate())
+
+    def fetch_threads():
+        # Everything fetch_pages started: its loop thread and the executor putting results.
+        return [
+            thread
+            for thread in threading.enumerate()
+            if thread not in before and "process_request_thread" not in thread.name
+        ]
+
+    pages = fetch_pages(links, Manifest(str(tmp_path / "manifest.json")), concurrency=1)
+    next(pages)
+    # The bounded queue is full now and the producer is blocked on it.
+    time.sleep(0.3)
+    pages.close()
+
+    deadline = time.monotonic() + 5
+    while fetch_threads() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert fetch_threads() == []
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+
+from src.agent_comps.fakes import FakeEmbeddings
+from src.store_comps.mmap_store import MmapVectorStore, convert_pickle_store, export_faiss_store
+
+EMBEDDINGS = FakeEmbeddings(size=32)
+TEXTS = [f"chapter {i // 10} paragraph {i}: fresco, panel and canvas painting" for i in range(60)]
+METADATAS = [{"source": f"https://example.org/chapter-{i // 10}", "title": f"Chapter {i // 10}"} for i in range(60)]
+QUERIES = ["fresco painting", "chapter 3 paragraph 31", "canvas", "Renaissance panel"]
+
+
+def exact_store():
+    return FAISS.from_texts(TEXTS, EMBEDDINGS, metadatas=METADATAS, ids=[f"id-{i}" for i in range(len(TEXTS))])
+
+
+def assert_same_results(expected, actual):
+    assert [doc.id for doc, _ in actual] == [doc.id for doc, _ in expected]
+    assert [doc.page_content for doc, _ in actual] == [doc.page_content for doc, _ in expected]
+    assert [doc.metadata for doc, _ in actual] == [doc.metadata for doc, _ in expected]
+    np.testing.assert_allclose([score for _, score in actual], [score for _, score in expected], rtol=1e-5)
+
+
+def test_exported_store_answers_like_the_faiss_index(tmp_path):
+    db = exact_store()
+    export_faiss_store(db, str(tmp_path / "store"), "flat")
+    store = MmapVectorStore(str(tmp_path / "store"), EMBEDDINGS)
+
+    assert len(store) == db.index.ntotal
+    for query in QUERIES:
+        assert_same_results(db.similarity_search_with_score(query, k=5), store.similarity_search_with_score(query, k=5))
+
+
+def test_filters_match_faiss(tmp_path):
+    db = exact_store()
+    export_faiss_store(db, str(tmp_path / "store"), "flat")
+    store = MmapVectorStore(str(tmp_path / "store"), EMBEDDINGS)
+    source = {"source": "https://example.org/chapter-2"}
+
+    expected = db.similarity_search_with_score("fresco", k=3, filter=source, fetch_k=60)
+    actual = store.similarity_search_with_score("fresco", k=3, filter=source, fetch_k=60)
+
+    assert_same_results(expected, actual)
+    assert all(doc.metadata == {**source, "title": "Chapter 2"} for doc, _ in actual)
+
+
+def test_converted_pickle_store_matches(tmp_path):
+    db = exact_store()
+    db.save_local(str(tmp_path))
+
+    directory = convert_pickle_store(str(tmp_path), index_kind="flat")
+    store = MmapVectorStore(directory, EMBEDDINGS)
+
+    assert directory == os.path.join(str(tmp_path), "store")
+    assert_same_results(db.similarity_search_with_score("canvas", k=4), store.similarity_search_with_score("canvas", k=4))
+
+
+def test_from_texts_writes_the_layout(tmp_path):
+    db = exact_store()
+    directory = str(tmp_path / "store")
+
+    store = MmapVectorStore.from_texts(
+        TEXTS, EMBEDDINGS, metadatas=METADATAS, ids=[f"id-{i}" for i in range(len(TEXTS))], directory=directory
+    )
+
+    assert MmapVectorStore(directory, EMBEDDINGS).manifest == store.manifest
+    for query in QUERIES:
+        assert_same_results(db.similarity_search_with_score(query, k=5), store.similarity_search_with_score(query, k=5))
+    with pytest.raises(ValueError):
+        MmapVectorStore.from_texts(TEXTS, EMBEDDINGS)
@@ -0,0 +1,79 @@
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from src.ingestion_comps.preprocess import NearDuplicateIndex, Preprocessor, line_hashes
+
+PARAGRAPH = (
+    "Giotto broke with the flat Byzantine style and gave his figures weight, volume and emotion, "
+    "setting them in a believable space on the walls of the Arena Chapel in Padua. The cycle tells "
+    "the lives of the Virgin and of Christ in scenes arranged in three registers, with a Last Judgment "
+    "on the entrance wall. Deep blue skies unify the chapel, and the figures turn their backs to the "
+    "viewer, gesture to one another and grieve, which painters of the next generations studied closely "
+    "as they learned to tell a story through bodies in space."
+)
+# The same paragraph with a closing sentence added, as it might be quoted on another chapter.
+QUOTED = PARAGRAPH + " Its influence was lasting."
+OTHER = (
+    "Gothic cathedrals used flying buttresses to carry the thrust of the vaults outward, "
+    "which let the walls open up into tall windows of stained glass."
+)
+
+
+def page(i, body):
+    text = f"Art History Textbook\n{body}\nChapter {i} of the survey\nLicenses and Attributions\nCC BY 4.0 footer text"
+    return Document(page_content=text, metadata={"source": f"https://example.org/chapter-{i}"})
+
+
+def preprocessor():
+    return Preprocessor(
+        parent_splitter=RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=0),
+        child_splitter=RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=0),
+        min_pages=3,
+        min_share=0.5,
+    )
+
+
+def test_fit_learns_lines_repeated_across_pages():
+    pages = [page(i, f"Body of chapter {i}.") for i in range(4)]
+    cleaner = preprocessor().fit(line_hashes(p.page_content) for p in pages)
+
+    cleaned = cleaner.clean(pages[0]).page_content
+
+    assert cleaned == "Body of chapter 0.\nChapter 0 of the survey"
+    assert cleaner.stats["boilerplate_lines"] == 1
+    assert cleaner.stats["footer_lines"] == 2
+
+
+def test_lines_on_too_few_pages_are_kept():
+    pages = [page(0, "A"), page(1, "B")]
+    cleaner = preprocessor().fit(line_hashes(p.page_content) for p in pages)
+
+    assert cleaner.clean(pages[0]).page_content.startswith("Art History Textbook\n")
+
+
+def test_near_duplicate_children_are_dropped():
+    pages = [
+        Document(page_content=text, metadata={"source": f"https://example.org/chapter-{i}"})
+        for i, text in enumerate([PARAGRAPH, QUOTED, OTHER])
+    ]
+    cleaner = preprocessor()
+
+    parents, children = cleaner.process_pages(pages)
+
+    assert [child.metadata["source"] for child in children] == [pages[0].metadata["source"], pages[2].metadata["source"]]
+    assert cleaner.stats["near_duplicates"] == 1
+    # The duplicate's parent is not referenced by any child, so it is not kept either.
+    assert {parent.id for parent in parents} == {child.metadata["parent_id"] for child in children}
+
+
+def test_removed_chunk_no_longer_blocks_its_duplicates():
+    index = NearDuplicateIndex()
+    signature = index.signature(PARAGRAPH)
+    index.add("a", signature)
+
+    assert index.find(index.signature(QUOTED)) == "a"
+    assert index.find(index.signature(OTHER)) is None
+
+    index.remove("a")
+    assert index.find(signature) is None
+    assert len(index) == 0
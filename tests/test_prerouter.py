@@ -0,0 +1,86 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.agent_comps import prerouter
+from src.agent_comps.fakes import FakeEmbeddings
+from src.agent_comps.prerouter import ROUTES, Prerouter, build_centroids, get_prerouter
+
+
+class BrokenEmbeddings(FakeEmbeddings):
+
+    def embed_query(self, text):
+        raise ConnectionError("embedding service unreachable")
+
+    async def aembed_query(self, text):
+        raise ConnectionError("embedding service unreachable")
+
+
+def centroids_towards(embeddings, query, route):
+    """Centroids under which ``query`` clearly belongs to ``route``."""
+    vector = np.asarray(embeddings.embed_query(query))
+    centroids = -np.tile(vector, (len(ROUTES), 1))
+    centroids[ROUTES.index(route)] = vector
+    return centroids
+
+
+@pytest.mark.parametrize("message", ["hi", "Thanks so much!", "hello, who are you?", "ok, bye"])
+def test_small_talk_goes_to_the_llm_route_without_embeddings(message):
+    router = Prerouter(BrokenEmbeddings(size=8))
+
+    assert router.route(message) == "LLM"
+    assert asyncio.run(router.aroute(message)) == "LLM"
+
+
+def test_without_centroids_only_small_talk_is_decided():
+    router = Prerouter(FakeEmbeddings(size=8))
+
+    assert router.route("Who painted the Sistine Chapel ceiling?") is None
+
+
+def test_embedding_errors_fall_back_to_the_llm_router():
+    embeddings = BrokenEmbeddings(size=8)
+    router = Prerouter(embeddings, np.eye(len(ROUTES), 8))
+
+    assert router.route("What is chiaroscuro?") is None
+    assert asyncio.run(router.aroute("What is chiaroscuro?")) is None
+
+
+def test_confident_embedding_routes():
+    embeddings = FakeEmbeddings(size=8)
+    query = "What is chiaroscuro?"
+    router = Prerouter(embeddings, centroids_towards(embeddings, query, "RAG"), min_similarity=0.5, margin=0.1)
+
+    assert router.route(query) == "RAG"
+    # Equally close to every route: no margin to decide on.
+    assert Prerouter(embeddings, np.ones((len(ROUTES), 8))).route(query) is None
+
+
+def test_irrelevant_verdict_on_a_follow_up_asks_the_llm():
+    embeddings = FakeEmbeddings(size=8)
+    query = "where was he born?"
+    router = Prerouter(embeddings, centroids_towards(embeddings, query, "Irrelevant"))
+
+    assert router.route(query) == "Irrelevant"
+    assert router.route(query, follow_up=True) is None
+
+
+def test_centroids_take_one_embedding_request(tmp_path, monkeypatch):
+    embeddings = FakeEmbeddings(size=8)
+
+    centroids = build_centroids(embeddings)
+
+    assert embeddings.calls == 1
+    assert centroids.shape == (len(ROUTES), 8)
+    np.testing.assert_allclose(np.linalg.norm(centroids, axis=1), 1, rtol=1e-5)
+
+    monkeypatch.setattr(prerouter, "_centroids", {})
+    path = str(tmp_path / "centroids.npz")
+    assert get_prerouter(embeddings, None, "fake", use_embeddings=False, path=path).centroids is None
+    assert embeddings.calls == 1
+    first = get_prerouter(embeddings, None, "fake", use_embeddings=True, path=path)
+    second = get_prerouter(embeddings, None, "fake", use_embeddings=True, path=path)
+    # Built once per embedding model and shared.
+    assert embeddings.calls == 2
+    np.testing.assert_array_equal(first.centroids, second.centroids)
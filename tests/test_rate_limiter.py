@@ -0,0 +1,107 @@
+import asyncio
+import gc
+
+import pytest
+from google.api_core.exceptions import ResourceExhausted
+from langchain_core.runnables import RunnableLambda
+
+from src.agent_comps import rate_limiter
+from src.agent_comps.rate_limiter import GeminiRateLimiter, TokenBucket, find_rate_limiter, get_rate_limiter
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(rate_limiter.time, "sleep", slept.append)
+    return slept
+
+
+def flaky(failures, error=ResourceExhausted("quota")):
+    calls = []
+
+    def call(input):
+        calls.append(input)
+        if len(calls) <= failures:
+            raise error
+        return "ok"
+
+    return RunnableLambda(call), calls
+
+
+def test_bucket_queues_callers_behind_the_debt():
+    bucket = TokenBucket(60, capacity=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # One token a second: the third and fourth callers wait about one and two seconds.
+    assert bucket.reserve() == pytest.approx(1, abs=0.05)
+    assert bucket.reserve() == pytest.approx(2, abs=0.05)
+    assert not bucket.try_take()
+
+
+def test_overdrawn_token_budget_delays_the_next_request():
+    limiter = GeminiRateLimiter(rpm=60, tpm=600)
+
+    assert limiter.acquire(blocking=False)
+    limiter.record_tokens(1200)
+
+    assert not limiter.acquire(blocking=False)
+    assert limiter.tokens.wait_time() == pytest.approx(60, abs=0.5)
+    assert limiter.stats()["tokens"] == 1200
+
+
+def test_rate_limit_errors_are_retried_with_backoff(sleeps):
+    limiter = GeminiRateLimiter(rpm=60, tpm=1_000_000)
+    runnable, calls = flaky(failures=2)
+
+    assert limiter.invoke(runnable, "q", max_retries=3) == "ok"
+
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+    stats = limiter.stats()
+    assert stats["rate_limit_errors"] == stats["retries"] == 2
+    # A 429 drains the shared request bucket, so other sessions back off too.
+    assert limiter.requests.tokens <= 0
+
+
+def test_retries_stop_after_max_retries(sleeps):
+    limiter = GeminiRateLimiter(rpm=60, tpm=1_000_000)
+    runnable, calls = flaky(failures=10)
+
+    with pytest.raises(ResourceExhausted):
+        limiter.invoke(runnable, "q", max_retries=2)
+    assert len(calls) == 3
+
+
+def test_other_errors_are_not_retried(sleeps):
+    limiter = GeminiRateLimiter(rpm=60, tpm=1_000_000)
+    runnable, calls = flaky(failures=1, error=ValueError("bad request"))
+
+    with pytest.raises(ValueError):
+        limiter.invoke(runnable, "q")
+    assert len(calls) == 1
+    assert sleeps == []
+
+
+def test_async_retry(monkeypatch):
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", no_sleep)
+    limiter = GeminiRateLimiter(rpm=60, tpm=1_000_000)
+    runnable, calls = flaky(failures=1)
+
+    assert asyncio.run(limiter.ainvoke(runnable, "q")) == "ok"
+    assert len(calls) == 2
+
+
+def test_limiters_are_shared_per_model_and_key_and_released_with_their_agents():
+    limiter = get_rate_limiter("gemini-2.0-flash", "key-a")
+
+    assert get_rate_limiter("gemini-2.0-flash", "key-a") is limiter
+    assert get_rate_limiter("gemini-2.0-flash", "key-b") is not limiter
+    assert find_rate_limiter("gemini-2.0-pro", "key-a") is None
+
+    del limiter
+    gc.collect()
+    assert find_rate_limiter("gemini-2.0-flash", "key-a") is None
@@ -0,0 +1,34 @@
+import json
+
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+
+from src.agent_comps.fakes import FakeEmbeddings
+from src.agent_comps.relevance import EmbeddingScorer, audit_sample, log_gradings
+
+
+def test_audit_sample_only_picks_locally_decided_grades():
+    grades = ["yes", None, "no", None, "yes"]
+
+    assert audit_sample(grades, share=1, path="gradings.jsonl") == [0, 2, 4]
+    assert audit_sample(grades, share=0, path="gradings.jsonl") == []
+    # Nothing to audit for when the log is off.
+    assert audit_sample(grades, share=1, path="") == []
+
+
+def test_logged_parents_are_scored_through_their_child(tmp_path):
+    embeddings = FakeEmbeddings(size=16)
+    child = "Giotto painted the Arena Chapel frescoes."
+    store = FAISS.from_texts([child, "Rembrandt etched with drypoint."], embeddings, ids=["child-0", "child-1"])
+    parent = Document(id="parent-0", page_content="Chapter 12. " + child + " He worked in Padua.", metadata={"child_id": "child-0"})
+    path = str(tmp_path / "gradings.jsonl")
+
+    log_gradings("Who painted the Arena Chapel?", [parent], ["yes"], path=path)
+
+    with open(path) as f:
+        record = json.loads(f.readline())
+    assert record["child_id"] == "child-0"
+    # Rebuilt the way the calibration command does it.
+    logged = Document(id=record["id"], page_content=record["document"], metadata={"child_id": record["child_id"]})
+    scorer = EmbeddingScorer(embeddings, store)
+    assert scorer.score(record["query"], [logged]) == scorer.score(record["query"], [Document(page_content=child)])
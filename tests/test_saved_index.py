@@ -0,0 +1,53 @@
+import os
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from src.store_comps import saved_index
+from src.store_comps.saved_index import TMP_DIRNAME, finish_swap, load_faiss, save_index
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=8)
+
+
+def texts(db):
+    return sorted(doc.page_content for doc in db.docstore._dict.values())
+
+
+def test_swap_interrupted_between_the_two_files(tmp_path, monkeypatch):
+    save_index(FAISS.from_texts(["monet"], EMBEDDINGS), str(tmp_path))
+    replace = os.replace
+    moved = []
+
+    def crash_after_first(src, dst):
+        if moved:
+            raise KeyboardInterrupt
+        moved.append(dst)
+        replace(src, dst)
+
+    monkeypatch.setattr(saved_index.os, "replace", crash_after_first)
+    try:
+        save_index(FAISS.from_texts(["manet", "degas"], EMBEDDINGS), str(tmp_path))
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.undo()
+
+    # index.faiss is new, index.pkl still old: readers take the pair from both places.
+    db = load_faiss(str(tmp_path), EMBEDDINGS)
+    assert db.index.ntotal == 2
+    assert texts(db) == ["degas", "manet"]
+
+    finish_swap(str(tmp_path))
+    assert not os.path.exists(tmp_path / TMP_DIRNAME)
+    db = FAISS.load_local(str(tmp_path), EMBEDDINGS, allow_dangerous_deserialization=True)
+    assert texts(db) == ["degas", "manet"]
+
+
+def test_incomplete_save_is_discarded(tmp_path):
+    save_index(FAISS.from_texts(["monet"], EMBEDDINGS), str(tmp_path))
+    # Died inside save_local: no READY marker.
+    FAISS.from_texts(["manet"], EMBEDDINGS).save_local(str(tmp_path / TMP_DIRNAME))
+
+    assert texts(load_faiss(str(tmp_path), EMBEDDINGS)) == ["monet"]
+    finish_swap(str(tmp_path))
+    assert not os.path.exists(tmp_path / TMP_DIRNAME)
+    assert texts(load_faiss(str(tmp_path), EMBEDDINGS)) == ["monet"]
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from src.agent_comps import semantic_cache
+from src.agent_comps.fakes import FakeEmbeddings
+from src.agent_comps.semantic_cache import SemanticCache, SQLiteCacheBackend, cache_file
+
+EMBEDDINGS = FakeEmbeddings(size=32)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    path = tmp_path / "data"
+    path.mkdir()
+    (path / "index.faiss").write_bytes(b"index v1")
+    return str(path)
+
+
+def store(cache, query):
+    cache.store(query, EMBEDDINGS.embed_query(query), f"answer to {query}", ["p. 1"], "rag")
+
+
+def lookup(cache, query):
+    entry = cache.lookup(EMBEDDINGS.embed_query(query))
+    return entry.generation if entry else None
+
+
+def test_entries_expire_after_the_ttl(data_path, clock):
+    cache = SemanticCache(ttl=60, data_path=data_path)
+    store(cache, "what is a fresco?")
+
+    clock[0] += 59
+    assert lookup(cache, "what is a fresco?") == "answer to what is a fresco?"
+    clock[0] += 2
+    assert lookup(cache, "what is a fresco?") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted(data_path, clock):
+    cache = SemanticCache(maxsize=2, data_path=data_path)
+    store(cache, "a")
+    store(cache, "b")
+    # Reading "a" makes "b" the least recently used.
+    assert lookup(cache, "a") is not None
+
+    store(cache, "c")
+
+    assert lookup(cache, "b") is None
+    assert lookup(cache, "a") is not None
+    assert lookup(cache, "c") is not None
+
+
+def test_rebuilt_index_wipes_the_cache_and_its_file(tmp_path, data_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    cache = SemanticCache(SQLiteCacheBackend(path), data_path=data_path)
+    store(cache, "who painted the sistine chapel?")
+    assert len(SemanticCache(SQLiteCacheBackend(path), data_path=data_path)) == 1
+
+    (tmp_path / "data" / "index.faiss").write_bytes(b"index v2, rebuilt")
+
+    assert lookup(cache, "who painted the sistine chapel?") is None
+    assert len(SemanticCache(SQLiteCacheBackend(path), data_path=data_path)) == 0
+
+
+def test_one_file_per_data_path_and_embedding_model(tmp_path):
+    base = str(tmp_path / "semantic_cache.sqlite")
+    files = {
+        cache_file("./data", "models/text-embedding-004", base),
+        cache_file("./other", "models/text-embedding-004", base),
+        cache_file("./data", "FakeEmbeddings", base),
+    }
+
+    assert len(files) == 3
+    assert all(name.endswith(".sqlite") and os.path.dirname(name) == str(tmp_path) for name in files)
+    assert cache_file("data", "models/text-embedding-004", base) in files
@@ -0,0 +1,76 @@
+from src.agent_comps.fakes import FakeWikipedia
+from src.agent_comps.wiki import NO_RESULT, CircuitBreaker, WikiLookup
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingWikipedia(FakeWikipedia):
+    """Fails every request while ``down`` is set."""
+
+    down = True
+
+    def resolve(self, query, k=1):
+        if self.down:
+            raise ConnectionError("wikipedia unreachable")
+        return super().resolve(query, k)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failures=3, cooldown=60, clock=Clock())
+
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    # The success reset the count: two more failures are not enough.
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.trips == 1
+
+
+def test_one_trial_after_the_cooldown():
+    clock = Clock()
+    breaker = CircuitBreaker(failures=1, cooldown=60, clock=clock)
+    breaker.record_failure()
+
+    clock.now = 60
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # The trial failed: open for another full cooldown, without counting a new trip.
+    breaker.record_failure()
+    clock.now = 119
+    assert not breaker.allow()
+    clock.now = 120
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.trips == 1
+
+
+def test_open_breaker_skips_wikipedia():
+    clock = Clock()
+    wikipedia = FailingWikipedia()
+    lookup = WikiLookup(wikipedia, source="live", cache_size=0, breaker=CircuitBreaker(failures=2, cooldown=60, clock=clock))
+
+    assert [lookup.invoke(f"fresco {i}") for i in range(4)] == [NO_RESULT] * 4
+    assert lookup.stats["errors"] == 2
+    assert lookup.stats["short_circuited"] == 2
+
+    wikipedia.down = False
+    clock.now = 60
+    assert lookup.invoke("baroque painting").startswith("Page: ")
+    assert lookup.breaker.state == "closed"